@@ -15,6 +15,7 @@ let
     flit-core
     pydantic
     pytorch-lightning
+    safetensors
     torch
     torchvision
     transformer-engine
@@ -49,6 +50,7 @@ let
       flash-attn
       pydantic
       pytorch-lightning
+      safetensors
       torch
       torchvision
       transformer-engine
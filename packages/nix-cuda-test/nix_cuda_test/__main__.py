@@ -1,82 +1,35 @@
 import argparse
+import sys
 import warnings
+from collections.abc import Callable
+from dataclasses import dataclass
 
-import torch._inductor.config
-import torch.backends.cuda
-import torch.backends.cudnn
-from pytorch_lightning.plugins import TransformerEnginePrecision
-from pytorch_lightning.trainer.trainer import Trainer
-from torchvision.transforms import Compose, Resize, ToTensor  # type: ignore[import]
-from transformer_engine.common.recipe import DelayedScaling
+from nix_cuda_test.checkpointing import checkpoint_policy, parse_bytes
+from nix_cuda_test.compile_cache import add_compile_cache_arguments
+from nix_cuda_test.config import RunConfig, add_run_arguments
+from nix_cuda_test.distributed import add_distributed_arguments
+from nix_cuda_test.loader_config import DEFAULT_LOADER_CONFIG_PATH
+from nix_cuda_test.models import MODEL_NAMES, TOKEN_DROP_MODES
+from nix_cuda_test.optim import OPTIMIZERS
+from nix_cuda_test.perf_profiles import add_perf_profile_arguments, add_sweep_profiles_arguments, sweep_profiles
+from nix_cuda_test.resolution_schedule import resolution_phase
+from nix_cuda_test.scaling import add_scaling_report_arguments, scaling_report
+from nix_cuda_test.startup import add_bench_startup_arguments, bench_startup
 
-from nix_cuda_test.cifar_data_module import CIFARDataModule
-from nix_cuda_test.wrapped_te_vit import WrappedTEViT
+# Only the modules needed to parse the command line are imported here: PyTorch, Lightning, and Transformer Engine take
+# seconds to import, so each command imports its implementation (and with it, those) once it has been chosen.
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
 
-def main() -> None:  # noqa: PLR0915
-    from lightning_fabric.fabric import Fabric  # noqa: PLC0415
-
-    Fabric.seed_everything(42, workers=True)
-
-    torch.backends.cuda.matmul.allow_tf32 = True
-    torch.backends.cuda.matmul.allow_fp16_reduced_precision_reduction = True
-    torch.backends.cuda.matmul.allow_bf16_reduced_precision_reduction = True
-
-    torch.backends.cuda.enable_flash_sdp(True)
-    torch.backends.cuda.enable_mem_efficient_sdp(True)
-    torch.backends.cuda.enable_math_sdp(True)
-    torch.backends.cuda.allow_fp16_bf16_reduction_math_sdp(True)
-    torch.backends.cuda.enable_cudnn_sdp(True)
-
-    torch.backends.cudnn.allow_tf32 = True
-
-    # BF16 should be enough for our use case.
-    # See: https://pytorch.org/docs/stable/generated/torch.set_float32_matmul_precision.html
-    torch.set_float32_matmul_precision("medium")  # type: ignore
-
-    # torch._inductor.config.compile_threads = 1
-    torch._inductor.config.dce = True
-    torch._inductor.config.permute_fusion = True
-    torch._inductor.config.b2b_gemm_pass = True
-    torch._inductor.config.max_autotune = True
-    torch._inductor.config.max_autotune_pointwise = True
-    torch._inductor.config.max_autotune_gemm = True
-    torch._inductor.config.warn_mix_layout = True
-
-    # enable the combo kernel that combines data-independent kernels (additional
-    # to foreach kernels) into a single one (Experimental)
-    torch._inductor.config.combo_kernels = True
-    # benchmark combo kernels and only allow ones with perf gains
-    torch._inductor.config.benchmark_combo_kernel = True
-    # combo_kernel autotuning options: 0 - disable, 1 - enable except for foreach,
-    # 2 - enable for all
-    torch._inductor.config.combo_kernels_autotune = 2
-    # Enable masking for combining kernels of mixed sizes: 0 - disable, 1 - enable
-    # for all except for foreach, 2 - enable for all
-    torch._inductor.config.combo_kernel_allow_mixed_sizes = 2
-    # Enable dynamic shapes for foreach kernels
-    torch._inductor.config.combo_kernel_foreach_dynamic_shapes = True
-
-    torch._inductor.config.permute_fusion = True
-    torch._inductor.config.size_asserts = False
-
-    # torch._inductor.config.triton.cudagraphs = True
-    torch._inductor.config.triton.autotune_at_compile_time = True
-    torch._inductor.config.triton.multi_kernel = True
-
-    torch._inductor.config.cuda.arch = "89"
-    torch._inductor.config.cuda.version = "12.6"
-    torch._inductor.config.cuda.compile_opt_level = "-O3"
-    torch._inductor.config.cuda.enable_cuda_lto = True
-    torch._inductor.config.cuda.use_fast_math = True
-    torch._dynamo.reset()  # type: ignore[no-untyped-call]
-
-    # te_attention._log_level = 2
-    # te_attention.fa_logger.setLevel(logging.DEBUG)
-
-    parser = argparse.ArgumentParser(description="Vision Transformer in PyTorch")
+def _add_train_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--model",
+        dest="name",
+        choices=MODEL_NAMES,
+        default=None,
+        help="model implementation (default : te-vit on CUDA, vit otherwise)",
+    )
     parser.add_argument(
         "--patch-size",
         type=int,
@@ -92,7 +45,7 @@ def main() -> None:  # noqa: PLR0915
     )
     parser.add_argument("--num-heads", type=int, default=12, help="(default : 12)")
     parser.add_argument("--num-encoders", type=int, default=12, help="number of encoders (default : 12)")
-    parser.add_argument("--dropout", type=int, default=0.1, help="dropout value (default : 0.1)")
+    parser.add_argument("--dropout", type=float, default=0.1, help="dropout value (default : 0.1)")
     parser.add_argument(
         "--img-size",
         type=int,
@@ -114,73 +67,463 @@ def main() -> None:  # noqa: PLR0915
         default=3e-2,
         help="weight decay value (default : 0.03)",
     )
+    parser.add_argument(
+        "--optimizer",
+        choices=OPTIMIZERS,
+        default=None,
+        help=(
+            "AdamW implementation, without weight decay on biases, norms, and embeddings "
+            "(default : adamw-fused on CUDA, adamw-foreach otherwise)"
+        ),
+    )
     parser.add_argument("--batch-size", type=int, default=64, help="batch size (default : 64)")
     parser.add_argument("--compile", action="store_true", help="compile the model")
-    args = parser.parse_args()
-
-    transforms = Compose([
-        Resize(size=(args.img_size, args.img_size), antialias=True),  # type: ignore[assignment]
-        ToTensor(),
-    ])
-    data_module = CIFARDataModule(
-        batch_size=args.batch_size,
-        data_dir="data",
-        drop_last=True,
-        num_workers=32,
-        pin_memory=False,
-        train_transforms=transforms,
-        val_transforms=transforms,
-    )
-
-    precision = TransformerEnginePrecision(
-        weights_dtype=torch.bfloat16,
-        # NOTE: Both of these require Hopper or newer.
-        recipe=DelayedScaling(
-            fp8_dpa=False,
-            fp8_mha=False,
+    add_compile_cache_arguments(parser)
+    add_perf_profile_arguments(parser, default_help="max-autotune on CUDA, cpu otherwise")
+    parser.add_argument(
+        "--intra-op-threads",
+        type=int,
+        default=None,
+        help="threads PyTorch splits a single op across (default : PyTorch's default)",
+    )
+    parser.add_argument(
+        "--inter-op-threads",
+        type=int,
+        default=None,
+        help="threads PyTorch runs independent ops on (default : PyTorch's default)",
+    )
+    parser.add_argument(
+        "--cpu-precision",
+        choices=["bf16-mixed", "32-true"],
+        default="bf16-mixed",
+        help="precision when training on the CPU; bf16-mixed runs under CPU autocast (default : bf16-mixed)",
+    )
+    add_distributed_arguments(parser)
+    parser.add_argument(
+        "--activation-checkpointing",
+        type=checkpoint_policy,
+        default="none",
+        metavar="POLICY",
+        help=(
+            "encoder layers that recompute activations in the backward pass: none, all, every:K, or budget:BYTES "
+            "(e.g., budget:6GiB) (default : none)"
         ),
-        replace_layers=True,
-    )
-
-    trainer = Trainer(
-        accelerator="auto",
-        accumulate_grad_batches=1,
-        benchmark=True,
-        deterministic=False,
-        devices="auto",
-        max_epochs=args.epochs,
-        plugins=[precision],
-        # precision="bf16-mixed",
-        strategy="auto",
-        # profiler="simple",
-    )
-
-    # init the model directly on the device and with parameters in half-precision
-    with trainer.init_module():
-        model = WrappedTEViT(
-            # model = WrappedViT(
-            dropout=args.dropout,
-            latent_size=args.latent_size,
-            lr=args.lr,
-            n_channels=args.n_channels,
-            num_classes=args.num_classes,
-            num_encoders=args.num_encoders,
-            num_heads=args.num_heads,
-            num_patches=(args.img_size // args.patch_size) ** 2,
-            patch_size=args.patch_size,
-            weight_decay=args.weight_decay,
-        )
-
-        # NOTE: didn't see a performance improvement with `fuse_wgrad_accumulation` on the 4090.
-        # Did see a large decrease in training and validation accuracy.
-
-    if args.compile:
-        model = torch.compile(model)  # type: ignore[assignment]
-
-    trainer.fit(
-        datamodule=data_module,
-        model=model,  # type: ignore[arg-type]
     )
+    parser.add_argument(
+        "--class-token-only-last-layer",
+        action="store_true",
+        help=(
+            "compute only the class token in the last encoder layer, whose other outputs the classifier ignores; vit "
+            "also projects only its query, te-vit still attends with every token"
+        ),
+    )
+    parser.add_argument(
+        "--token-keep-ratio",
+        dest="token_keep_ratios",
+        type=float,
+        nargs="+",
+        default=[1.0],
+        metavar="RATIO",
+        help=(
+            "share of patch tokens kept in training, one ratio per epoch with the last one repeated, e.g. 0.5 0.5 1; "
+            "the class token is always kept and evaluation uses every token (default : 1)"
+        ),
+    )
+    parser.add_argument(
+        "--token-drop",
+        choices=TOKEN_DROP_MODES,
+        default="random",
+        help=(
+            "which patch tokens to keep: a random subset per image, or the same evenly spaced subset for the whole "
+            "batch (default : random)"
+        ),
+    )
+    parser.add_argument(
+        "--resolution-schedule",
+        type=resolution_phase,
+        nargs="+",
+        default=[],
+        metavar="EPOCH:IMG_SIZE[:BATCH_SIZE]",
+        help=(
+            "train progressively: from each EPOCH on, resize images to IMG_SIZE and batch them by BATCH_SIZE, or by "
+            "--batch-size if omitted, e.g. 0:112:256 6:224; the positional embedding, learned at --img-size, is "
+            "resampled to each phase's grid (requires --batch-transforms) (default : none)"
+        ),
+    )
+    parser.add_argument(
+        "--step-metrics",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help=(
+            "record per-step timings and throughput and write per-epoch percentiles to PATH (.json or .csv); each run "
+            "of a sweep writes PATH with a -runN suffix on its stem"
+        ),
+    )
+    parser.add_argument(
+        "--resume-from",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help=(
+            "checkpoint to resume training from; with --strategy fsdp or fsdp2 this is the directory of per-rank "
+            "shards, loaded with the same number of processes (default : none)"
+        ),
+    )
+    parser.add_argument(
+        "--checkpoint-every-n-steps",
+        type=int,
+        default=None,
+        metavar="N",
+        help="also checkpoint every N training steps, keeping the latest, to resume mid-epoch (default : none)",
+    )
+    parser.add_argument(
+        "--async-checkpoint",
+        action="store_true",
+        help="write checkpoints in the background from a pinned host copy, as per-layer safetensors shards",
+    )
+    parser.add_argument(
+        "--profiler",
+        choices=["simple", "advanced", "pytorch"],
+        default=None,
+        help="Lightning profiler to run (default : none)",
+    )
+    parser.add_argument(
+        "--cache-data",
+        action="store_true",
+        help="cache the resized images in a memory-mapped file under the data directory",
+    )
+    parser.add_argument(
+        "--batch-transforms",
+        action="store_true",
+        help="load raw uint8 images and resize/flip/normalize whole batches on the device",
+    )
+    parser.add_argument(
+        "--random-flip",
+        action="store_true",
+        help="randomly flip training images horizontally (requires --batch-transforms)",
+    )
+    parser.add_argument(
+        "--normalize",
+        action="store_true",
+        help="normalize images with the CIFAR10 mean and standard deviation (requires --batch-transforms)",
+    )
+    parser.add_argument(
+        "--loader-config",
+        type=str,
+        default=DEFAULT_LOADER_CONFIG_PATH,
+        help=(
+            "DataLoader settings written by `tune-loader`, used if the file exists; the flags below take precedence "
+            f"(default : {DEFAULT_LOADER_CONFIG_PATH})"
+        ),
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=None,
+        help="number of DataLoader workers (default : 32, or 4 with --batch-transforms)",
+    )
+    parser.add_argument(
+        "--pin-memory",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="use pinned memory for batches (default : false)",
+    )
+    parser.add_argument(
+        "--prefetch-factor",
+        type=int,
+        default=None,
+        help="batches loaded in advance by each worker (default : PyTorch's default)",
+    )
+    parser.add_argument(
+        "--persistent-workers",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="keep DataLoader workers alive between epochs and validation runs (default : true)",
+    )
+    parser.add_argument(
+        "--device-prefetch",
+        action="store_true",
+        help="copy the next batch to the device while the current step runs (pair with --pin-memory on CUDA)",
+    )
+    parser.add_argument(
+        "--batch-sampling",
+        action="store_true",
+        help="load each batch with a single fancy-index into the image array (requires --batch-transforms)",
+    )
+    parser.add_argument(
+        "--shard-dir",
+        type=str,
+        default=None,
+        help="stream the dataset from shards written by `pack-shards` (requires --batch-transforms)",
+    )
+    parser.add_argument(
+        "--numa-pinning",
+        action="store_true",
+        help="pin each DataLoader worker to the CPUs of one NUMA node, spreading workers over the nodes",
+    )
+
+
+def _add_memory_budget_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--memory-budget",
+        type=parse_bytes,
+        default=None,
+        metavar="BYTES",
+        help="peak memory a training step may use, e.g. 20GiB (default : 90%% of device memory; required on CPU)",
+    )
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=4096,
+        help="largest batch size to try (default : 4096)",
+    )
+
+
+def _add_auto_batch_size_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--auto-batch-size",
+        action="store_true",
+        help="train with the largest batch size that fits in --memory-budget instead of --batch-size",
+    )
+    _add_memory_budget_arguments(parser)
+
+
+def _run_config(parser: argparse.ArgumentParser, args: argparse.Namespace) -> RunConfig:
+    try:
+        return RunConfig.from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+def _add_train_command_arguments(parser: argparse.ArgumentParser) -> None:
+    _add_train_arguments(parser)
+    _add_auto_batch_size_arguments(parser)
+
+
+def _train(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    from nix_cuda_test.training import train, with_auto_batch_size  # noqa: PLC0415
+
+    train(with_auto_batch_size(parser, _run_config(parser, args)))
+
+
+def _run(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    from nix_cuda_test.training import run  # noqa: PLC0415
+
+    run(parser, args)
+
+
+def _add_bench_loader_arguments(parser: argparse.ArgumentParser) -> None:
+    from nix_cuda_test.data_benchmark import add_bench_loader_arguments  # noqa: PLC0415
+
+    add_bench_loader_arguments(parser)
+
+
+def _bench_loader(_parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    from nix_cuda_test.data_benchmark import bench_loader  # noqa: PLC0415
+
+    bench_loader(args)
+
+
+def _add_tune_loader_arguments(parser: argparse.ArgumentParser) -> None:
+    from nix_cuda_test.data_benchmark import add_tune_loader_arguments  # noqa: PLC0415
+
+    _add_train_arguments(parser)
+    add_tune_loader_arguments(parser)
+
+
+def _tune_loader(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    from nix_cuda_test.data_benchmark import tune_loader  # noqa: PLC0415
+    from nix_cuda_test.training import build_data_module  # noqa: PLC0415
+
+    config = _run_config(parser, args)
+    tune_loader(args, lambda loader_config: build_data_module(config, loader_config))
+
+
+def _add_bench_model_arguments(parser: argparse.ArgumentParser) -> None:
+    from nix_cuda_test.model_benchmark import add_bench_model_arguments  # noqa: PLC0415
+
+    add_bench_model_arguments(parser)
+
+
+def _bench_model(_parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    from nix_cuda_test.model_benchmark import bench_model  # noqa: PLC0415
+
+    bench_model(args)
+
+
+def _add_bench_optimizer_arguments(parser: argparse.ArgumentParser) -> None:
+    from nix_cuda_test.optimizer_benchmark import add_bench_optimizer_arguments  # noqa: PLC0415
+
+    add_bench_optimizer_arguments(parser)
+
+
+def _bench_optimizer(_parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    from nix_cuda_test.optimizer_benchmark import bench_optimizer  # noqa: PLC0415
+
+    bench_optimizer(args)
+
+
+def _add_warm_compile_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    _add_train_arguments(parser)
+    parser.add_argument(
+        "--steps",
+        type=int,
+        default=2,
+        help="training and validation steps to run, compiling both (default : 2)",
+    )
+
+
+def _warm_compile_cache(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    from nix_cuda_test.training import train  # noqa: PLC0415
+
+    config = _run_config(parser, args)
+    if not config.perf.compile_cache_dir:
+        parser.error("--compile-cache-dir must not be empty")
+    config = config.model_copy(update={"perf": config.perf.model_copy(update={"compile": True})})
+    train(config, fast_dev_run=args.steps)
+
+
+def _add_find_batch_size_arguments(parser: argparse.ArgumentParser) -> None:
+    _add_train_arguments(parser)
+    _add_memory_budget_arguments(parser)
+
+
+def _find_batch_size(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    import torch  # noqa: PLC0415
+
+    from nix_cuda_test.batch_size_finder import find_batch_size  # noqa: PLC0415
+
+    config = _run_config(parser, args)
+    if config.trainer.memory_budget is None and not torch.cuda.is_available():
+        parser.error("--memory-budget is required when not running on CUDA")
+    find_batch_size(config)
+
+
+def _add_serve_arguments(parser: argparse.ArgumentParser) -> None:
+    from nix_cuda_test.inference import add_serve_arguments  # noqa: PLC0415
+
+    add_serve_arguments(parser)
+
+
+def _serve(_parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    from nix_cuda_test.inference import serve  # noqa: PLC0415
+
+    serve(args)
+
+
+def _add_pack_shards_arguments(parser: argparse.ArgumentParser) -> None:
+    from nix_cuda_test.sharded_data_module import add_pack_shards_arguments  # noqa: PLC0415
+
+    add_pack_shards_arguments(parser)
+
+
+def _pack_shards(_parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    from nix_cuda_test.sharded_data_module import pack_cifar10_shards  # noqa: PLC0415
+
+    pack_cifar10_shards(args)
+
+
+@dataclass(frozen=True, kw_only=True)
+class Command:
+    """
+    A subcommand: its help, a function adding its arguments to its parser, and a function running it with its parser
+    (to report usage errors) and the parsed arguments.
+
+    Commands whose arguments live next to their implementation import it in ``add_arguments``, and the others only in
+    ``run``, so only the chosen command pays for its imports.
+    """
+
+    help: str
+    add_arguments: Callable[[argparse.ArgumentParser], None]
+    run: Callable[[argparse.ArgumentParser, argparse.Namespace], None]
+
+
+COMMANDS: dict[str, Command] = {
+    "train": Command(
+        help="train the model (default)",
+        add_arguments=_add_train_command_arguments,
+        run=_train,
+    ),
+    "run": Command(
+        help="train from a config file with SECTION.FIELD=VALUE overrides, expanding sweeps into consecutive runs",
+        add_arguments=add_run_arguments,
+        run=_run,
+    ),
+    "bench-loader": Command(
+        help="compare per-sample and batch-indexed data loading throughput",
+        add_arguments=_add_bench_loader_arguments,
+        run=_bench_loader,
+    ),
+    "tune-loader": Command(
+        help="benchmark the data pipeline over a grid of DataLoader settings and save the fastest",
+        add_arguments=_add_tune_loader_arguments,
+        run=_tune_loader,
+    ),
+    "bench-model": Command(
+        help="benchmark forward and forward+backward of each model implementation on synthetic inputs",
+        add_arguments=_add_bench_model_arguments,
+        run=_bench_model,
+    ),
+    "bench-optimizer": Command(
+        help="benchmark the optimizer step time and memory of each optimizer implementation",
+        add_arguments=_add_bench_optimizer_arguments,
+        run=_bench_optimizer,
+    ),
+    "warm-compile-cache": Command(
+        help="compile the model with the training settings and run a few steps to fill the compile cache",
+        add_arguments=_add_warm_compile_cache_arguments,
+        run=_warm_compile_cache,
+    ),
+    "find-batch-size": Command(
+        help="search for the largest batch size whose training step fits in a memory budget",
+        add_arguments=_add_find_batch_size_arguments,
+        run=_find_batch_size,
+    ),
+    "serve": Command(
+        help="load-test micro-batched inference from a checkpoint and report per-request latency",
+        add_arguments=_add_serve_arguments,
+        run=_serve,
+    ),
+    "sweep-profiles": Command(
+        help="run bench-model under each performance profile and compare throughput",
+        add_arguments=add_sweep_profiles_arguments,
+        run=lambda _parser, args: sweep_profiles(args),
+    ),
+    "scaling-report": Command(
+        help="train data parallel at several world sizes and report throughput and scaling efficiency",
+        add_arguments=add_scaling_report_arguments,
+        run=lambda _parser, args: scaling_report(args),
+    ),
+    "pack-shards": Command(
+        help="pack CIFAR10 into shards for --shard-dir",
+        add_arguments=_add_pack_shards_arguments,
+        run=_pack_shards,
+    ),
+    "bench-startup": Command(
+        help="measure the CLI's startup time and imports, failing if over budget or if it loads PyTorch",
+        add_arguments=add_bench_startup_arguments,
+        run=lambda _parser, args: bench_startup(args),
+    ),
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Vision Transformer in PyTorch")
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+    for name, command in COMMANDS.items():
+        subparsers.add_parser(name, help=command.help)
+
+    # Training is the default command, so `nix-cuda-test --epochs 1` keeps working.
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in {*subparsers.choices, "-h", "--help"}:
+        argv = ["train", *argv]
+    # Only the chosen command's arguments are needed, and building the others would import their implementations.
+    if argv[0] in COMMANDS:
+        COMMANDS[argv[0]].add_arguments(subparsers.choices[argv[0]])
+
+    args = parser.parse_args(argv)
+    COMMANDS[args.command].run(subparsers.choices[args.command], args)
 
 
 if __name__ == "__main__":
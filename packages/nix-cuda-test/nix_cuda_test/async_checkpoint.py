@@ -0,0 +1,161 @@
+import os
+import shutil
+from collections.abc import Collection
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import torch
+from pytorch_lightning.plugins.io import CheckpointIO
+from safetensors.torch import load_file, save_file
+from torch import Tensor, nn
+
+STATE_FILE = "state.pt"
+
+
+def encoder_layer_names(model: nn.Module, layer_class: type[nn.Module]) -> frozenset[str]:
+    """
+    Returns the qualified names of the encoder layers of ``model`` (its ``layer_class`` submodules), e.g.,
+    ``module.module.1.module.3`` for the fourth layer of a ViT.
+    """
+    return frozenset(name for name, module in model.named_modules() if isinstance(module, layer_class))
+
+
+def shard_name(key: str, layer_names: Collection[str]) -> str:
+    """
+    Returns the name of the safetensors shard the state dict entry ``key`` is written to: one per encoder layer in
+    ``layer_names``, and one for everything outside the encoder layers (embeddings, head).
+    """
+    parts = key.split(".")
+    for end in range(len(parts) - 1, 0, -1):
+        prefix = ".".join(parts[:end])
+        if prefix in layer_names:
+            return f"model-{prefix}"
+    return "model"
+
+
+def _previous(path: Path) -> Path:
+    # Where the checkpoint at `path` is moved while its replacement is swapped in.
+    return path.with_name(f"{path.name}.old")
+
+
+def _checkpoint_dir(path: Path) -> Path:
+    # A job preempted between the two renames of `AsyncCheckpointIO._write` left its checkpoint at `_previous(path)`.
+    return _previous(path) if not path.exists() and _previous(path).is_dir() else path
+
+
+def read_checkpoint_dir(path: str | Path, map_location: Any = None) -> dict[str, Any]:
+    """
+    Reads a checkpoint written by ``AsyncCheckpointIO``.
+    """
+    path = _checkpoint_dir(Path(path))
+    checkpoint: dict[str, Any] = torch.load(path / STATE_FILE, map_location=map_location, weights_only=False)
+    state_dict: dict[str, Tensor] = {}
+    for shard in sorted(path.glob("*.safetensors")):
+        state_dict.update(load_file(shard))
+    checkpoint["state_dict"] = state_dict
+    return checkpoint
+
+
+@dataclass(kw_only=True, eq=False)
+class AsyncCheckpointIO(CheckpointIO):
+    """
+    Writes checkpoints without stalling training for the write.
+
+    Saving only copies every tensor of the checkpoint into pinned host buffers, which are allocated once and reused
+    (asynchronously on CUDA, followed by one synchronization), and hands the copy to a background thread. That thread
+    writes the model as one safetensors file per encoder layer (see ``shard_by_layer``) plus one for the rest, and the
+    optimizer, loop, and data module state with ``torch.save``. Files go to a temporary directory which replaces the
+    checkpoint only once complete, and the previous checkpoint is moved aside rather than deleted until then, so a job
+    preempted mid-write still has a complete checkpoint, which loading finds in either place.
+
+    At most one write is in flight: the next save, a load, a removal, or teardown waits for it, and re-raises any error
+    it hit. Checkpoints are directories; ``load_checkpoint`` also reads the regular single-file format.
+    """
+
+    # Non-args
+    # Qualified names of the encoder layers, each written to its own shard; set once the model is built.
+    layer_names: frozenset[str] = field(init=False, default=frozenset())
+    executor: ThreadPoolExecutor = field(init=False)
+    pending: Future[None] | None = field(init=False, default=None)
+    buffers: dict[str, Tensor] = field(init=False, default_factory=dict)
+
+    def __post_init__(self) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+
+    def shard_by_layer(self, model: nn.Module, layer_class: type[nn.Module]) -> None:
+        """
+        Writes each ``layer_class`` submodule of ``model`` to its own shard.
+        """
+        self.layer_names = encoder_layer_names(model, layer_class)
+
+    def wait(self) -> None:
+        pending, self.pending = self.pending, None
+        if pending is not None:
+            pending.result()
+
+    def _snapshot(self, value: Any, key: str) -> Any:
+        if isinstance(value, Tensor):
+            buffer = self.buffers.get(key)
+            if buffer is None or buffer.shape != value.shape or buffer.dtype != value.dtype:
+                buffer = torch.empty(value.shape, dtype=value.dtype, pin_memory=torch.cuda.is_available())
+                self.buffers[key] = buffer
+            buffer.copy_(value.detach(), non_blocking=True)
+            return buffer
+        if isinstance(value, dict):
+            return {k: self._snapshot(v, f"{key}/{k}") for k, v in value.items()}  # pyright: ignore
+        if type(value) in {list, tuple}:
+            return type(value)(self._snapshot(v, f"{key}/{i}") for i, v in enumerate(value))  # pyright: ignore
+        return value
+
+    @staticmethod
+    def _write(checkpoint: dict[str, Any], path: Path, layer_names: Collection[str]) -> None:
+        tmp = path.with_name(f"{path.name}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+
+        shards: dict[str, dict[str, Tensor]] = {}
+        for key, tensor in checkpoint.pop("state_dict", {}).items():
+            shards.setdefault(shard_name(key, layer_names), {})[key] = tensor
+        for name, tensors in shards.items():
+            save_file(tensors, tmp / f"{name}.safetensors")
+        torch.save(checkpoint, tmp / STATE_FILE)
+
+        # Either `path` or `previous` holds a complete checkpoint at every point.
+        previous = _previous(path)
+        if path.is_dir():
+            shutil.rmtree(previous, ignore_errors=True)
+            os.replace(path, previous)
+        os.replace(tmp, path)
+        shutil.rmtree(previous, ignore_errors=True)
+
+    def save_checkpoint(self, checkpoint: dict[str, Any], path: Any, storage_options: Any | None = None) -> None:
+        if storage_options is not None:
+            raise TypeError("AsyncCheckpointIO does not support storage_options")
+        # The buffers are reused, so the previous write must be done with them.
+        self.wait()
+        snapshot = self._snapshot(checkpoint, "")
+        if torch.cuda.is_available():
+            torch.cuda.current_stream().synchronize()
+        self.pending = self.executor.submit(self._write, snapshot, Path(path), self.layer_names)
+
+    def load_checkpoint(self, path: Any, map_location: Any | None = None) -> dict[str, Any]:
+        self.wait()
+        if _checkpoint_dir(Path(path)).is_dir():
+            return read_checkpoint_dir(path, map_location)
+        checkpoint: dict[str, Any] = torch.load(path, map_location=map_location, weights_only=False)
+        return checkpoint
+
+    def remove_checkpoint(self, path: Any) -> None:
+        self.wait()
+        path = Path(path)
+        shutil.rmtree(_previous(path), ignore_errors=True)
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+
+    def teardown(self) -> None:
+        self.wait()
+        self.executor.shutdown()
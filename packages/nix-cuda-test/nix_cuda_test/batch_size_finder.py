@@ -0,0 +1,170 @@
+from collections.abc import Callable
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any
+
+import pytorch_lightning as pl
+import torch
+import torch.nn.functional as F
+
+from nix_cuda_test.config import RunConfig
+from nix_cuda_test.models import build_model
+from nix_cuda_test.profiling import PeakMemoryMonitor
+
+
+def find_max_batch_size(fits: Callable[[int], bool], *, start: int = 1, limit: int = 2**16) -> int:
+    """
+    Returns the largest batch size in ``[start, limit]`` for which ``fits`` holds, or 0 if it doesn't even hold for
+    ``start``.
+
+    Assumes ``fits`` is monotonic: doubles the batch size until it stops fitting, then binary-searches between the last
+    size that fit and the first that didn't, so it makes O(log n) probes.
+    """
+    if not fits(start):
+        return 0
+
+    low = start  # Largest size known to fit
+    high = start * 2  # Smallest size known not to fit, once probed
+    while high <= limit and fits(high):
+        low, high = high, high * 2
+    if high > limit:
+        if fits(limit):
+            return limit
+        high = limit
+
+    while high - low > 1:
+        mid = (low + high) // 2
+        low, high = (mid, high) if fits(mid) else (low, mid)
+    return low
+
+
+@dataclass(kw_only=True)
+class StepMemoryProbe:
+    """
+    Decides whether a training step (forward, backward, and optimizer step) of ``model`` at a given batch size fits in
+    ``budget_bytes``.
+
+    On CUDA the step fits if it doesn't run out of memory and its peak allocated memory (including the model,
+    gradients, and optimizer state) is within the budget. Elsewhere the peak memory of the process is sampled while
+    the step runs; tracemalloc can't be used because it doesn't see PyTorch's allocator. The probe reuses the model and
+    optimizer, so the optimizer state is only allocated once. The forward pass runs under ``autocast_dtype`` autocast
+    if given, to match the precision of the run.
+    """
+
+    # Args
+    model: pl.LightningModule
+    budget_bytes: int
+    img_size: int
+    n_channels: int
+    num_classes: int
+    autocast_dtype: torch.dtype | None = None
+
+    # Non-args
+    optimizer: torch.optim.Optimizer = field(init=False)
+    peaks: dict[int, int | None] = field(init=False, default_factory=dict)
+
+    def __post_init__(self) -> None:
+        self.model.train()
+        optimizer = self.model.configure_optimizers()
+        assert isinstance(optimizer, torch.optim.Optimizer)
+        self.optimizer = optimizer
+
+    @property
+    def device(self) -> torch.device:
+        return self.model.device
+
+    def _step(self, batch_size: int) -> None:
+        autocast: Any = (
+            nullcontext()
+            if self.autocast_dtype is None
+            else torch.autocast(self.device.type, dtype=self.autocast_dtype)
+        )
+        images = torch.rand(batch_size, self.n_channels, self.img_size, self.img_size, device=self.device)
+        labels = torch.randint(0, self.num_classes, (batch_size,), device=self.device)
+        with autocast:
+            loss = F.cross_entropy(self.model(images), labels)
+        loss.backward()
+        self.optimizer.step()
+        self.optimizer.zero_grad(set_to_none=True)
+
+    def __call__(self, batch_size: int) -> bool:
+        if self.device.type == "cuda":
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats(self.device)
+            try:
+                self._step(batch_size)
+                torch.cuda.synchronize(self.device)
+            except torch.cuda.OutOfMemoryError:
+                self.optimizer.zero_grad(set_to_none=True)
+                self.peaks[batch_size] = None
+                return False
+            peak_bytes = torch.cuda.max_memory_allocated(self.device)
+        else:
+            with PeakMemoryMonitor(interval=0.005) as monitor:
+                self._step(batch_size)
+            peak_bytes = monitor.peak_bytes
+
+        self.peaks[batch_size] = peak_bytes
+        return peak_bytes <= self.budget_bytes
+
+
+def default_memory_budget(device: torch.device) -> int | None:
+    """
+    Returns 90% of the memory of a CUDA ``device``, leaving room for fragmentation, or None for other devices.
+    """
+    if device.type != "cuda":
+        return None
+    _, total_bytes = torch.cuda.mem_get_info(device)
+    return int(total_bytes * 0.9)
+
+
+def find_batch_size(config: RunConfig, *, verbose: bool = True) -> int:
+    """
+    Searches for the largest batch size whose training step fits in ``config.trainer.memory_budget`` with the model,
+    image size, and activation checkpointing policy given by ``config``, on the accelerator and in the precision the
+    run would use.
+    """
+    on_cuda = config.dist.accelerator != "cpu" and torch.cuda.is_available()
+    device = torch.device("cuda" if on_cuda else "cpu")
+    budget_bytes = config.trainer.memory_budget or default_memory_budget(device)
+    if budget_bytes is None:
+        raise ValueError("a memory budget is required when not running on CUDA")
+
+    with device:
+        model = build_model(
+            config.model.name,
+            dropout=config.model.dropout,
+            latent_size=config.model.latent_size,
+            lr=config.trainer.lr,
+            n_channels=config.model.n_channels,
+            num_classes=config.model.num_classes,
+            num_encoders=config.model.num_encoders,
+            num_heads=config.model.num_heads,
+            num_patches=config.model.num_patches,
+            patch_size=config.model.patch_size,
+            weight_decay=config.trainer.weight_decay,
+            optimizer_name=config.trainer.optimizer,
+            checkpoint_policy=config.model.activation_checkpointing,
+            class_token_only_last_layer=config.model.class_token_only_last_layer,
+        )
+    probe = StepMemoryProbe(
+        model=model,
+        budget_bytes=budget_bytes,
+        img_size=config.model.img_size,
+        n_channels=config.model.n_channels,
+        num_classes=config.model.num_classes,
+        autocast_dtype=torch.bfloat16 if on_cuda or config.perf.cpu_precision == "bf16-mixed" else None,
+    )
+    batch_size = find_max_batch_size(probe, limit=config.trainer.max_batch_size)
+
+    if verbose:
+        print(f"memory budget: {budget_bytes / 2**20:.0f} MiB on {device}")
+        for probed, peak_bytes in sorted(probe.peaks.items()):
+            peak = "out of memory" if peak_bytes is None else f"{peak_bytes / 2**20:.0f} MiB"
+            print(f"batch size {probed:>5}: {peak}")
+        print(f"largest batch size that fits: {batch_size}")
+
+    del probe, model
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+    return batch_size
@@ -0,0 +1,70 @@
+from dataclasses import dataclass, field
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor, nn
+
+# Per-channel statistics of the CIFAR10 training set.
+CIFAR10_MEAN = (0.4914, 0.4822, 0.4465)
+CIFAR10_STD = (0.2470, 0.2435, 0.2616)
+
+
+@dataclass(kw_only=True, eq=False)
+class BatchTransforms(nn.Module):
+    """
+    Batch-level replacement for ``Compose([Resize, ToTensor, ...])``.
+
+    Takes a whole batch of images (uint8 in [0, 255], or float in [0, 1]) shaped [B, C, H, W] and converts, resizes,
+    randomly flips, and normalizes it with one tensor op per step. Runs on whichever device the batch lives on, so it
+    works equally well on CPU and (after the batch has been transferred) on the GPU.
+    """
+
+    # Args
+    img_size: int
+    hflip_prob: float = 0.0
+    mean: tuple[float, ...] | None = None
+    std: tuple[float, ...] | None = None
+
+    # Non-args
+    mean_tensor: Tensor | None = field(init=False)
+    std_tensor: Tensor | None = field(init=False)
+
+    def __post_init__(self) -> None:
+        super().__init__()
+        if (self.mean is None) != (self.std is None):
+            raise ValueError("mean and std must be given together")
+
+        self.register_buffer(
+            "mean_tensor",
+            None if self.mean is None else torch.tensor(self.mean).view(1, -1, 1, 1),
+            persistent=False,
+        )
+        self.register_buffer(
+            "std_tensor",
+            None if self.std is None else torch.tensor(self.std).view(1, -1, 1, 1),
+            persistent=False,
+        )
+
+    def forward(self, images: Tensor) -> Tensor:
+        # images: [B, C, H, W]
+        if images.dtype == torch.uint8:
+            images = images.to(torch.float32).div_(255)
+
+        if images.shape[-2:] != (self.img_size, self.img_size):
+            # Matches torchvision's Resize(antialias=True) up to rounding.
+            images = F.interpolate(
+                images,
+                size=(self.img_size, self.img_size),
+                mode="bilinear",
+                align_corners=False,
+                antialias=True,
+            )
+
+        if self.training and self.hflip_prob > 0.0:
+            flip = torch.rand(images.size(0), 1, 1, 1, device=images.device) < self.hflip_prob
+            images = torch.where(flip, images.flip(-1), images)
+
+        if self.mean_tensor is not None and self.std_tensor is not None:
+            images = (images - self.mean_tensor) / self.std_tensor
+
+        return images
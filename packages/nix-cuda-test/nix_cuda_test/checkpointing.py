@@ -0,0 +1,77 @@
+import re
+from dataclasses import dataclass
+from typing import Literal
+
+CheckpointKind = Literal["none", "all", "every", "budget"]
+
+_UNITS = {"": 1, "B": 1, "KB": 10**3, "MB": 10**6, "GB": 10**9, "KIB": 2**10, "MIB": 2**20, "GIB": 2**30}
+
+
+def parse_bytes(spec: str) -> int:
+    """
+    Parses a byte count such as ``1073741824``, ``1.5GB``, or ``8GiB``.
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([A-Za-z]*)\s*", spec)
+    if match is None or match.group(2).upper() not in _UNITS:
+        raise ValueError(f"invalid byte count {spec!r}")
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+
+@dataclass(frozen=True, kw_only=True)
+class CheckpointPolicy:
+    """
+    Which encoder layers recompute their activations in the backward pass instead of keeping them.
+
+    Written as a string so it can be passed on the command line and stored in hyperparameters:
+
+    - ``none``: keep every layer's activations
+    - ``all``: checkpoint every layer
+    - ``every:K``: checkpoint every K-th layer (layers K-1, 2K-1, ...)
+    - ``budget:BYTES``: checkpoint as few layers as possible while keeping the estimated activation memory of the
+      stack under BYTES (e.g., ``budget:6GiB``); the estimate depends on the input, so the layers are chosen at every
+      forward pass
+    """
+
+    kind: CheckpointKind
+    every: int = 1
+    budget_bytes: int = 0
+
+    @classmethod
+    def parse(cls, spec: str) -> "CheckpointPolicy":
+        kind, _, value = spec.partition(":")
+        match kind:
+            case "none" | "all" if not value:
+                return cls(kind=kind)
+            case "every" if value.isdigit() and int(value) > 0:
+                return cls(kind="every", every=int(value))
+            case "budget" if value:
+                return cls(kind="budget", budget_bytes=parse_bytes(value))
+            case _:
+                raise ValueError(f"invalid checkpoint policy {spec!r}; expected none, all, every:K, or budget:BYTES")
+
+    def layers(self, num_layers: int, layer_bytes: int, input_bytes: int) -> frozenset[int]:
+        """
+        Returns the indices of the layers to checkpoint in a stack of ``num_layers``, where a layer keeps
+        ``layer_bytes`` of activations for the backward pass and only its ``input_bytes`` input when checkpointed.
+        """
+        match self.kind:
+            case "none":
+                return frozenset()
+            case "all":
+                return frozenset(range(num_layers))
+            case "every":
+                return frozenset(range(self.every - 1, num_layers, self.every))
+            case "budget":
+                # Keeping k layers costs k * layer_bytes + (num_layers - k) * input_bytes.
+                spare = self.budget_bytes - num_layers * input_bytes
+                kept = max(0, min(num_layers, spare // max(1, layer_bytes - input_bytes)))
+                # The earliest layers are checkpointed first.
+                return frozenset(range(num_layers - kept))
+
+
+def checkpoint_policy(spec: str) -> str:
+    """
+    Validates a checkpoint policy given on the command line, keeping it as a string.
+    """
+    CheckpointPolicy.parse(spec)
+    return spec
@@ -1,16 +1,277 @@
+import hashlib
+import math
+import os
+import shutil
+from collections.abc import Callable, Iterator
 from dataclasses import dataclass, field
+from pathlib import Path
 from typing import Any
 
+import numpy as np
+import numpy.typing as npt
 import pytorch_lightning as pl
-from torch.utils.data import DataLoader
+import torch
+from torch import Tensor
+from torch.utils.data import BatchSampler, DataLoader, Dataset, Sampler
 from torchvision.datasets import CIFAR10  # pyright: ignore[reportMissingTypeStubs]
-from torchvision.transforms import Compose  # pyright: ignore[reportMissingTypeStubs]
+from torchvision.transforms import Compose, PILToTensor  # pyright: ignore[reportMissingTypeStubs]
+
+from nix_cuda_test.batch_transforms import BatchTransforms
+from nix_cuda_test.loader_config import dataloader_kwargs
+from nix_cuda_test.prefetch import DevicePrefetcher
+from nix_cuda_test.resolution_schedule import ResolutionPhase, phase_for_epoch
+
+# Bump whenever the on-disk layout of the cache changes so stale caches are rebuilt.
+CACHE_FORMAT_VERSION = 1
+
+
+def cache_key(train: bool, transforms: Compose) -> str:  # pyright: ignore
+    """
+    Returns a key which changes whenever the cached images would change.
+
+    The repr of a torchvision ``Compose`` includes every transform along with its arguments (e.g., the size passed to
+    ``Resize``), so it is enough to distinguish between configurations.
+    """
+    split = "train" if train else "val"
+    description = f"{CACHE_FORMAT_VERSION}|{split}|{transforms!r}"
+    return f"{split}-{hashlib.sha256(description.encode()).hexdigest()[:16]}"
+
+
+@dataclass(kw_only=True)
+class CachedCIFAR10(Dataset[tuple[Tensor, int]]):
+    """
+    CIFAR10 with the transforms applied once and the resulting images stored as uint8 in a memory-mapped file.
+
+    The transforms must be deterministic and produce a float tensor with values in [0, 1] (as ``ToTensor`` does);
+    ``__getitem__`` returns the same tensor the transforms would have, without running them.
+    """
+
+    # Args
+    root: str
+    train: bool
+    transforms: Compose  # pyright: ignore
+    num_workers: int
+
+    # Non-args
+    cache_dir: Path = field(init=False)
+    images: npt.NDArray[np.uint8] = field(init=False)
+    labels: npt.NDArray[np.int64] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.cache_dir = Path(self.root) / "cifar-10-cache" / cache_key(self.train, self.transforms)
+        if not self.cache_dir.exists():
+            self._build()
+
+        # Copy-on-write mapping: slices are writable views of the file (so torch.from_numpy doesn't complain), but
+        # nothing is ever written back.
+        self.images = np.load(self.cache_dir / "images.npy", mmap_mode="c")
+        self.labels = np.load(self.cache_dir / "labels.npy")
+
+    def _build(self) -> None:
+        dataset = CIFAR10(
+            root=self.root,
+            train=self.train,
+            transform=self.transforms,
+            download=True,
+        )
+        loader: DataLoader[Any] = DataLoader(
+            dataset=dataset,
+            batch_size=256,
+            num_workers=self.num_workers,
+            shuffle=False,
+        )
+        num_samples = len(dataset)
+        sample: Tensor = dataset[0][0]
+
+        # Build in a private directory and rename it into place so concurrent builders (e.g., multiple ranks) never
+        # observe a partially written cache.
+        tmp_dir = self.cache_dir.with_name(f"{self.cache_dir.name}.tmp-{os.getpid()}")
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        images = np.lib.format.open_memmap(
+            tmp_dir / "images.npy",
+            mode="w+",
+            dtype=np.uint8,
+            shape=(num_samples, *sample.shape),
+        )
+        labels = np.empty(num_samples, dtype=np.int64)
+
+        offset = 0
+        for batch_images, batch_labels in loader:
+            if batch_images.min() < 0.0 or batch_images.max() > 1.0:
+                shutil.rmtree(tmp_dir)
+                raise ValueError("Cached transforms must produce values in [0, 1]; apply normalization afterwards.")
+            end = offset + batch_images.size(0)
+            images[offset:end] = batch_images.mul(255).round_().to(torch.uint8).numpy()
+            labels[offset:end] = batch_labels.numpy()
+            offset = end
+
+        images.flush()
+        del images
+        np.save(tmp_dir / "labels.npy", labels)
+
+        try:
+            tmp_dir.rename(self.cache_dir)
+        except OSError:
+            # Someone else finished first; their cache is equivalent to ours.
+            shutil.rmtree(tmp_dir)
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Pickling a memmap copies its contents; send the path instead and re-map on the other side (e.g., in spawned
+        # DataLoader workers).
+        state = self.__dict__.copy()
+        del state["images"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.images = np.load(self.cache_dir / "images.npy", mmap_mode="c")
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __getitem__(self, idx: int) -> tuple[Tensor, int]:
+        # torch.from_numpy is zero-copy over the mapped file; only the conversion to float allocates.
+        image = torch.from_numpy(self.images[idx]).to(torch.float32).div_(255)  # pyright: ignore
+        return image, int(self.labels[idx])
+
+
+@dataclass(kw_only=True)
+class BatchIndexedCIFAR10(Dataset[tuple[Tensor, Tensor]]):
+    """
+    CIFAR10 indexed by whole batches rather than by sample.
+
+    Meant to be driven by a ``BatchSampler`` with automatic batching disabled: each lookup receives the indices of an
+    entire batch and answers with a single fancy-index into the image array, returning uint8 images shaped
+    [B, C, H, W] and int64 labels shaped [B]. No per-sample ``__getitem__`` calls and no collation.
+    """
+
+    # Args
+    images: npt.NDArray[np.uint8]  # [N, C, H, W]
+    labels: npt.NDArray[np.int64]  # [N]
+
+    @classmethod
+    def from_cifar10(cls, dataset: CIFAR10) -> "BatchIndexedCIFAR10":  # pyright: ignore
+        # torchvision stores CIFAR10 as a single [N, H, W, C] array; transpose it once up front.
+        return cls(
+            images=np.ascontiguousarray(dataset.data.transpose(0, 3, 1, 2)),  # pyright: ignore
+            labels=np.asarray(dataset.targets, dtype=np.int64),  # pyright: ignore
+        )
+
+    @classmethod
+    def from_cache(cls, dataset: CachedCIFAR10) -> "BatchIndexedCIFAR10":
+        return cls(images=dataset.images, labels=dataset.labels)
+
+    def __getstate__(self) -> dict[str, Any]:
+        # As with CachedCIFAR10, don't pickle the contents of a memory-mapped file.
+        state = self.__dict__.copy()
+        if isinstance(self.images, np.memmap):
+            state["images"] = self.images.filename
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        if isinstance(state["images"], str):
+            state["images"] = np.load(state["images"], mmap_mode="c")
+        self.__dict__.update(state)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __getitem__(self, indices: list[int]) -> tuple[Tensor, Tensor]:  # type: ignore[override]
+        # Order within a batch doesn't matter; sorting makes reads from a memory-mapped file sequential.
+        idx = np.sort(np.asarray(indices))
+        return torch.from_numpy(self.images[idx]), torch.from_numpy(self.labels[idx])
+
+
+@dataclass(kw_only=True, eq=False)
+class ResumableSampler(Sampler[int]):
+    """
+    Yields this rank's share of a permutation of ``range(num_samples)`` (or of the identity, without ``shuffle``),
+    which depends only on ``seed`` and the epoch, so an epoch can be replayed exactly after a restart.
+
+    Rank ``rank`` of ``num_replicas`` takes every ``num_replicas``-th index. The indices are first truncated (with
+    ``drop_last``) or padded by repeating the first few so they divide evenly, as with ``DistributedSampler``.
+
+    Setting ``start`` skips that many of this rank's indices the next time the sampler is iterated, to continue an
+    epoch which was interrupted after the checkpoint was written.
+    """
+
+    # Args
+    num_samples: int
+    shuffle: bool
+    seed: int = 0
+    rank: int = 0
+    num_replicas: int = 1
+    drop_last: bool = False
+
+    # Non-args
+    epoch: int = field(init=False, default=0)
+    start: int = field(init=False, default=0)
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def _indices(self) -> list[int]:
+        if self.shuffle:
+            generator = torch.Generator().manual_seed(self.seed + self.epoch)
+            indices: list[int] = torch.randperm(self.num_samples, generator=generator).tolist()
+        else:
+            indices = list(range(self.num_samples))
+        if self.drop_last:
+            indices = indices[: self.num_samples // self.num_replicas * self.num_replicas]
+        else:
+            indices += indices[: -self.num_samples % self.num_replicas]
+        return indices[self.rank :: self.num_replicas]
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return self.num_samples // self.num_replicas
+        return math.ceil(self.num_samples / self.num_replicas)
+
+    def __iter__(self) -> Iterator[int]:
+        start, self.start = self.start, 0
+        return iter(self._indices()[start:])
+
+
+class EpochBatchSampler(BatchSampler):
+    """
+    BatchSampler which forwards ``set_epoch`` to the sampler it wraps.
+
+    Lightning sets the epoch on a DataLoader's ``sampler``, which with batch sampling is this BatchSampler and not the
+    ``ResumableSampler`` inside it.
+    """
+
+    def set_epoch(self, epoch: int) -> None:
+        set_epoch = getattr(self.sampler, "set_epoch", None)
+        if set_epoch is not None:
+            set_epoch(epoch)
 
 
 @dataclass(kw_only=True)
 class CIFARDataModule(pl.LightningDataModule):
     """
     DataModule for CIFAR10 dataset.
+
+    When ``cache`` is set, the transformed images are written once to a memory-mapped file under ``data_dir`` and read
+    back from it, instead of running the transforms for every sample on every epoch.
+
+    Per-sample transforms are optional: without them, samples are uint8 tensors shaped [C, H, W], which is what the
+    batch-level transforms expect. Those run in ``on_after_batch_transfer``, i.e., on whole batches and on the device
+    the batch was moved to.
+
+    With ``batch_sampling``, each batch is loaded with a single fancy-index into the in-memory (or cached) image array
+    instead of one ``__getitem__`` per sample plus a collate; per-sample transforms are unavailable in that mode.
+
+    With ``device_prefetch``, the dataloaders are wrapped in a ``DevicePrefetcher`` so the next batch is copied to the
+    training device while the current step runs; combine it with ``pin_memory`` on CUDA. ``worker_init_fn`` runs in
+    every DataLoader worker as it starts, e.g., a ``NumaWorkerPinning`` on CPU nodes.
+
+    With ``resolution_phases``, the batch transforms' image size and the batch size follow the phase of the current
+    epoch; the Trainer must then rebuild the dataloaders every epoch (``reload_dataloaders_every_n_epochs=1``).
+
+    Samples are drawn by a ``ResumableSampler``. When training on several ranks, every rank samples a disjoint slice
+    of the data, so the Trainer should be built with ``use_distributed_sampler=False``. The data module's state (saved
+    in every checkpoint) records how far into the epoch training got, and training resumed from a mid-epoch
+    checkpoint continues with the next unseen batch of the same permutation rather than restarting the epoch.
     """
 
     # Args
@@ -19,50 +280,160 @@ class CIFARDataModule(pl.LightningDataModule):
     drop_last: bool
     num_workers: int
     pin_memory: bool
-    train_transforms: Compose  # pyright: ignore
-    val_transforms: Compose  # pyright: ignore
+    train_transforms: Compose | None = None  # pyright: ignore
+    val_transforms: Compose | None = None  # pyright: ignore
+    train_batch_transforms: BatchTransforms | None = None
+    val_batch_transforms: BatchTransforms | None = None
+    prefetch_factor: int | None = None
+    persistent_workers: bool = False
+    device_prefetch: bool = False
+    worker_init_fn: Callable[[int], None] | None = None
+    resolution_phases: tuple[ResolutionPhase, ...] = ()
+    cache: bool = False
+    batch_sampling: bool = False
+    seed: int = 0
 
     # Non-args
-    train_dataset: CIFAR10 = field(init=False)  # pyright: ignore
-    val_dataset: CIFAR10 = field(init=False)  # pyright: ignore
+    train_dataset: Dataset[Any] = field(init=False)
+    val_dataset: Dataset[Any] = field(init=False)
+    # Training samples of the current epoch this rank has already trained on, from a restored checkpoint.
+    resume_samples: int = field(init=False, default=0)
 
     def __post_init__(self) -> None:
         super().__init__()
 
     def setup(self, stage: str | None = None) -> None:
-        self.train_dataset = CIFAR10(
+        # Lightning calls setup at every fit; keep the datasets of an earlier run when the data module is reused.
+        if hasattr(self, "train_dataset"):
+            return
+
+        if self.cache:
+            if self.train_transforms is None or self.val_transforms is None:
+                raise ValueError("cache requires per-sample transforms; there is nothing to cache otherwise")
+
+            self.train_dataset = CachedCIFAR10(
+                root=self.data_dir,
+                train=True,
+                transforms=self.train_transforms,
+                num_workers=self.num_workers,
+            )
+            self.val_dataset = CachedCIFAR10(
+                root=self.data_dir,
+                train=False,
+                transforms=self.val_transforms,
+                num_workers=self.num_workers,
+            )
+            if self.batch_sampling:
+                self.train_dataset = BatchIndexedCIFAR10.from_cache(self.train_dataset)
+                self.val_dataset = BatchIndexedCIFAR10.from_cache(self.val_dataset)
+            return
+
+        if self.batch_sampling and (self.train_transforms is not None or self.val_transforms is not None):
+            raise ValueError("batch_sampling skips per-sample transforms; use batch transforms or the cache instead")
+
+        train_dataset = CIFAR10(
             root=self.data_dir,
             train=True,
-            transform=self.train_transforms,
+            transform=self.train_transforms or PILToTensor(),
             download=True,
         )
-        self.val_dataset = CIFAR10(
+        val_dataset = CIFAR10(
             root=self.data_dir,
             train=False,
-            transform=self.val_transforms,
+            transform=self.val_transforms or PILToTensor(),
             download=True,
         )
+        if self.batch_sampling:
+            self.train_dataset = BatchIndexedCIFAR10.from_cifar10(train_dataset)
+            self.val_dataset = BatchIndexedCIFAR10.from_cifar10(val_dataset)
+        else:
+            self.train_dataset = train_dataset
+            self.val_dataset = val_dataset
 
-    # Depends on the type of train_transforms
-    def train_dataloader(self) -> DataLoader[Any]:
-        train_loader: DataLoader[Any] = DataLoader(
-            dataset=self.train_dataset,
-            batch_size=self.batch_size,
+    def _worker_kwargs(self) -> dict[str, Any]:
+        return dataloader_kwargs(
             num_workers=self.num_workers,
             pin_memory=self.pin_memory,
-            drop_last=self.drop_last,
-            shuffle=True,
+            prefetch_factor=self.prefetch_factor,
+            persistent_workers=self.persistent_workers,
+            worker_init_fn=self.worker_init_fn,
         )
-        return train_loader
 
-    # Depends on the type of val_transforms
-    def val_dataloader(self) -> DataLoader[Any]:
-        val_loader: DataLoader[Any] = DataLoader(
-            dataset=self.val_dataset,
-            batch_size=self.batch_size,
-            num_workers=self.num_workers,
-            pin_memory=self.pin_memory,
+    def on_after_batch_transfer(self, batch: Any, dataloader_idx: int) -> Any:
+        images, labels = batch
+        training = self.trainer is not None and self.trainer.training
+        transforms = self.train_batch_transforms if training else self.val_batch_transforms
+        if transforms is not None:
+            images = transforms.to(images.device)(images)
+        return images, labels
+
+    def state_dict(self) -> dict[str, Any]:
+        if self.trainer is None:
+            return {}
+        # Checkpoints are written after a batch's training step, so every processed batch counts as trained on.
+        batches = self.trainer.fit_loop.epoch_loop.batch_progress.current.processed
+        return {"epoch": self.trainer.current_epoch, "samples": batches * self.batch_size}
+
+    def load_state_dict(self, state_dict: dict[str, Any]) -> None:
+        # Lightning restores the data module before it builds the dataloaders, and the epoch along with it.
+        self.resume_samples = state_dict.get("samples", 0)
+
+    def _sampler(self, dataset: Dataset[Any], shuffle: bool) -> ResumableSampler:
+        # Each rank reads its own 1/world_size of the samples; Lightning sets the epoch to reshuffle them.
+        rank, world_size = (0, 1) if self.trainer is None else (self.trainer.global_rank, self.trainer.world_size)
+        return ResumableSampler(
+            num_samples=len(dataset),  # pyright: ignore[reportArgumentType]
+            shuffle=shuffle,
+            seed=self.seed,
+            rank=rank,
+            num_replicas=world_size,
             drop_last=self.drop_last,
-            shuffle=False,
         )
-        return val_loader
+
+    def _dataloader(self, dataset: Dataset[Any], shuffle: bool) -> DataLoader[Any]:
+        sampler = self._sampler(dataset, shuffle)
+        if shuffle:
+            sampler.start, self.resume_samples = self.resume_samples, 0
+        if not self.batch_sampling:
+            return DataLoader(
+                dataset=dataset,
+                batch_size=self.batch_size,
+                sampler=sampler,
+                **self._worker_kwargs(),
+                drop_last=self.drop_last,
+            )
+
+        # Disable automatic batching (batch_size=None) so each index list from the BatchSampler reaches the dataset
+        # intact and the resulting batch is passed through without collation.
+        return DataLoader(
+            dataset=dataset,
+            batch_size=None,
+            sampler=EpochBatchSampler(sampler, batch_size=self.batch_size, drop_last=self.drop_last),
+            **self._worker_kwargs(),
+        )
+
+    def _apply_resolution_phase(self) -> None:
+        # Lightning rebuilds the dataloaders at every epoch when training on a resolution schedule.
+        if not self.resolution_phases or self.trainer is None:
+            return
+        phase = phase_for_epoch(self.resolution_phases, self.trainer.current_epoch)
+        if phase.batch_size is not None:
+            self.batch_size = phase.batch_size
+        for transforms in (self.train_batch_transforms, self.val_batch_transforms):
+            if transforms is not None:
+                transforms.img_size = phase.img_size
+
+    def _maybe_prefetch(self, loader: DataLoader[Any]) -> DataLoader[Any] | DevicePrefetcher:
+        if not self.device_prefetch or self.trainer is None:
+            return loader
+        return DevicePrefetcher(loader, self.trainer.strategy.root_device)
+
+    # Depends on the type of train_transforms
+    def train_dataloader(self) -> DataLoader[Any] | DevicePrefetcher:
+        self._apply_resolution_phase()
+        return self._maybe_prefetch(self._dataloader(self.train_dataset, shuffle=True))
+
+    # Depends on the type of val_transforms
+    def val_dataloader(self) -> DataLoader[Any] | DevicePrefetcher:
+        self._apply_resolution_phase()
+        return self._maybe_prefetch(self._dataloader(self.val_dataset, shuffle=False))
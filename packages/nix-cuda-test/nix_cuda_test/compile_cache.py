@@ -0,0 +1,155 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Any
+
+from nix_cuda_test.checkpointing import parse_bytes
+
+DEFAULT_COMPILE_CACHE_DIR = "data/compile-cache"
+DEFAULT_COMPILE_CACHE_SIZE = "20GiB"
+
+_LAST_USED = ".last-used"
+
+# The model hyperparameters which change the compiled graph. The others (learning rate, weight decay, optimizer) only
+# affect the optimizer, so sweeping them reuses the same cache entry.
+GRAPH_HPARAMS = frozenset({
+    "checkpoint_policy",
+    "class_token_only_last_layer",
+    "dropout",
+    "fused_attention",
+    "latent_size",
+    "n_channels",
+    "num_classes",
+    "num_encoders",
+    "num_heads",
+    "num_patches",
+    "patch_size",
+    "token_drop",
+    "token_keep_ratios",
+})
+
+logger = logging.getLogger(__name__)
+
+
+def _portable(value: Any) -> bool:
+    if isinstance(value, list | tuple):
+        return all(_portable(item) for item in value)
+    return value is None or isinstance(value, str | int | float | bool)
+
+
+def inductor_config() -> dict[str, Any]:
+    """
+    Returns the current inductor settings that can be compared between runs.
+
+    Settings holding callables or other objects are left out, since their representation differs from process to
+    process.
+    """
+    import torch._inductor.config  # noqa: PLC0415
+
+    config: dict[str, Any] = torch._inductor.config.get_config_copy()  # type: ignore[attr-defined]
+    return {name: value for name, value in sorted(config.items()) if _portable(value)}
+
+
+def _triton_version() -> str | None:
+    try:
+        import triton  # noqa: PLC0415  # pyright: ignore[reportMissingImports]
+    except ImportError:
+        return None
+    version: str = triton.__version__
+    return version
+
+
+def compile_cache_key(model_name: str, hparams: dict[str, Any], precision: str) -> str:
+    """
+    Returns a key identifying the compiled artifacts of the model ``model_name`` with ``hparams`` at ``precision``,
+    under the current inductor settings, PyTorch and Triton builds, and device. Only the ``GRAPH_HPARAMS`` count.
+    """
+    import torch  # noqa: PLC0415
+
+    identity = {
+        "model": model_name,
+        "hparams": {name: value for name, value in hparams.items() if name in GRAPH_HPARAMS},
+        "precision": precision,
+        "inductor": inductor_config(),
+        "torch": torch.__version__,
+        "triton": _triton_version(),
+        "cuda": torch.version.cuda,
+        "device": torch.cuda.get_device_name() if torch.cuda.is_available() else "cpu",
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _directory_bytes(path: Path) -> int:
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file() and not file.is_symlink())
+
+
+def evict(root: Path, max_bytes: int, keep: Path) -> list[Path]:
+    """
+    Deletes the least recently used entries under ``root``, except ``keep``, until the cache fits in ``max_bytes``.
+    Returns the deleted entries.
+    """
+    entries = [entry for entry in root.iterdir() if entry.is_dir()]
+    sizes = {entry: _directory_bytes(entry) for entry in entries}
+    total = sum(sizes.values())
+
+    def last_used(entry: Path) -> float:
+        marker = entry / _LAST_USED
+        return marker.stat().st_mtime if marker.exists() else entry.stat().st_mtime
+
+    evicted: list[Path] = []
+    for entry in sorted(entries, key=last_used):
+        if total <= max_bytes:
+            break
+        if entry == keep:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= sizes[entry]
+        evicted.append(entry)
+    return evicted
+
+
+def use_compile_cache(root: str | Path, key: str, max_bytes: int) -> Path:
+    """
+    Points inductor's FX graph and autotuning caches and Triton's kernel cache at ``root/key``, so later runs with the
+    same key reuse the compiled kernels and autotuning results instead of redoing them.
+
+    Must be called before the first compilation. Marks the entry as used and evicts the least recently used other
+    entries to keep ``root`` within ``max_bytes``.
+    """
+    import torch._inductor.config  # noqa: PLC0415
+
+    entry = Path(root) / key
+    entry.mkdir(parents=True, exist_ok=True)
+    (entry / _LAST_USED).touch()
+
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = str((entry / "inductor").absolute())
+    os.environ["TRITON_CACHE_DIR"] = str((entry / "triton").absolute())
+    torch._inductor.config.fx_graph_cache = True
+    torch._inductor.config.autotune_local_cache = True
+
+    for evicted in evict(Path(root), max_bytes, keep=entry):
+        logger.info("evicted compile cache entry %s", evicted.name)
+    return entry
+
+
+def add_compile_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--compile-cache-dir",
+        type=str,
+        default=DEFAULT_COMPILE_CACHE_DIR,
+        help=(
+            "persistent cache for compiled kernels and autotuning results, one entry per model and inductor config; "
+            f"pass an empty string to use PyTorch's default cache (default : {DEFAULT_COMPILE_CACHE_DIR})"
+        ),
+    )
+    parser.add_argument(
+        "--compile-cache-size",
+        type=parse_bytes,
+        default=DEFAULT_COMPILE_CACHE_SIZE,
+        metavar="BYTES",
+        help=f"evict least recently used entries beyond this size (default : {DEFAULT_COMPILE_CACHE_SIZE})",
+    )
@@ -0,0 +1,313 @@
+import argparse
+import copy
+import itertools
+import json
+import tomllib
+from pathlib import Path
+from typing import Any, Literal
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+
+from nix_cuda_test.checkpointing import CheckpointPolicy, parse_bytes
+from nix_cuda_test.compile_cache import DEFAULT_COMPILE_CACHE_DIR, DEFAULT_COMPILE_CACHE_SIZE
+from nix_cuda_test.distributed import SHARDED_STRATEGIES, CommHook, StrategyName
+from nix_cuda_test.loader_config import DEFAULT_LOADER_CONFIG_PATH
+from nix_cuda_test.models import ModelName, TokenDropMode, default_model_name
+from nix_cuda_test.optim import OptimizerName, default_optimizer_name
+from nix_cuda_test.perf_profiles import default_perf_profile
+from nix_cuda_test.resolution_schedule import parse_resolution_schedule
+
+
+class _Section(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
+
+class ModelConfig(_Section):
+    name: ModelName = Field(default_factory=default_model_name)
+    patch_size: int = 16
+    latent_size: int = 768
+    n_channels: int = 3
+    num_heads: int = 12
+    num_encoders: int = 12
+    dropout: float = 0.1
+    img_size: int = 224
+    # NOTE: CIFAR10 has 10 classes, but Transformer Engine requires we use a multiple of eight.
+    num_classes: int = 16
+    activation_checkpointing: str = "none"
+    token_keep_ratios: tuple[float, ...] = (1.0,)
+    token_drop: TokenDropMode = "random"
+    class_token_only_last_layer: bool = False
+
+    @field_validator("activation_checkpointing")
+    @classmethod
+    def _check_policy(cls, value: str) -> str:
+        CheckpointPolicy.parse(value)
+        return value
+
+    @field_validator("token_keep_ratios")
+    @classmethod
+    def _check_keep_ratios(cls, value: tuple[float, ...]) -> tuple[float, ...]:
+        if not value or not all(0.0 < ratio <= 1.0 for ratio in value):
+            raise ValueError("token_keep_ratios must be one or more ratios in (0, 1]")
+        return value
+
+    @property
+    def num_patches(self) -> int:
+        return (self.img_size // self.patch_size) ** 2
+
+
+class DataConfig(_Section):
+    batch_size: int = 64
+    cache_data: bool = False
+    batch_transforms: bool = False
+    random_flip: bool = False
+    normalize: bool = False
+    loader_config: str = DEFAULT_LOADER_CONFIG_PATH
+    num_workers: int | None = None
+    pin_memory: bool | None = None
+    prefetch_factor: int | None = None
+    persistent_workers: bool | None = None
+    device_prefetch: bool = False
+    batch_sampling: bool = False
+    shard_dir: str | None = None
+    numa_pinning: bool = False
+
+    @model_validator(mode="after")
+    def _check_combinations(self) -> "DataConfig":
+        if (self.random_flip or self.normalize or self.batch_sampling) and not self.batch_transforms:
+            raise ValueError("random_flip, normalize, and batch_sampling require batch_transforms")
+        if self.shard_dir is not None and not self.batch_transforms:
+            raise ValueError("shard_dir requires batch_transforms")
+        if self.shard_dir is not None and (self.cache_data or self.batch_sampling):
+            raise ValueError("shard_dir cannot be combined with cache_data or batch_sampling")
+        return self
+
+
+class TrainerConfig(_Section):
+    epochs: int = 10
+    lr: float = 1e-4
+    weight_decay: float = 3e-2
+    optimizer: OptimizerName = Field(default_factory=default_optimizer_name)
+    step_metrics: str | None = None
+    resume_from: str | None = None
+    checkpoint_every_n_steps: int | None = None
+    async_checkpoint: bool = False
+    profiler: Literal["simple", "advanced", "pytorch"] | None = None
+    auto_batch_size: bool = False
+    memory_budget: int | None = None
+    max_batch_size: int = 4096
+    resolution_schedule: tuple[str, ...] = ()
+
+    @field_validator("memory_budget", mode="before")
+    @classmethod
+    def _parse_budget(cls, value: Any) -> Any:
+        return parse_bytes(value) if isinstance(value, str) else value
+
+    @field_validator("resolution_schedule")
+    @classmethod
+    def _check_schedule(cls, value: tuple[str, ...]) -> tuple[str, ...]:
+        parse_resolution_schedule(value)
+        return value
+
+
+class PerfConfig(_Section):
+    compile: bool = False
+    compile_cache_dir: str = DEFAULT_COMPILE_CACHE_DIR
+    compile_cache_size: int = parse_bytes(DEFAULT_COMPILE_CACHE_SIZE)
+    perf_profile: str = Field(default_factory=default_perf_profile)
+    perf_profiles: str | None = None
+    intra_op_threads: int | None = None
+    inter_op_threads: int | None = None
+    cpu_precision: Literal["bf16-mixed", "32-true"] = "bf16-mixed"
+
+    @field_validator("compile_cache_size", mode="before")
+    @classmethod
+    def _parse_size(cls, value: Any) -> Any:
+        return parse_bytes(value) if isinstance(value, str) else value
+
+
+class DistributedConfig(_Section):
+    strategy: StrategyName = "auto"
+    accelerator: Literal["auto", "cpu", "gpu"] = "auto"
+    devices: int | Literal["auto"] = "auto"
+    num_nodes: int = 1
+    process_group_backend: Literal["nccl", "gloo"] | None = None
+    bucket_cap_mb: float = 25.0
+    gradient_as_bucket_view: bool = True
+    static_graph: bool = False
+    comm_hook: CommHook = "none"
+    powersgd_rank: int = 1
+    powersgd_start_iter: int = 2
+
+    @model_validator(mode="after")
+    def _check_comm_hook(self) -> "DistributedConfig":
+        if self.comm_hook != "none" and self.strategy != "ddp":
+            raise ValueError("comm_hook requires the ddp strategy")
+        return self
+
+
+# The defaults a run with ``dist.accelerator = "cpu"`` gets for the fields which otherwise depend on the device.
+CPU_DEFAULTS: tuple[tuple[str, str, Any], ...] = (
+    ("model", "name", "vit"),
+    ("trainer", "optimizer", "adamw-foreach"),
+    ("perf", "perf_profile", "cpu"),
+)
+
+
+class RunConfig(_Section):
+    """
+    Everything a training run depends on, in five sections: the model, the data pipeline, the trainer, performance
+    settings, and distribution across processes. Field names match the command line flags (``model.latent_size`` is
+    ``--latent-size``), except ``model.name``, which is ``--model``.
+    """
+
+    model: ModelConfig = Field(default_factory=ModelConfig)
+    data: DataConfig = Field(default_factory=DataConfig)
+    trainer: TrainerConfig = Field(default_factory=TrainerConfig)
+    perf: PerfConfig = Field(default_factory=PerfConfig)
+    dist: DistributedConfig = Field(default_factory=DistributedConfig)
+
+    @model_validator(mode="before")
+    @classmethod
+    def _cpu_defaults(cls, data: Any) -> Any:
+        # The device-dependent defaults pick the CUDA settings whenever CUDA is available, so a run explicitly on the
+        # CPU gets the CPU ones instead, for every field it leaves unset.
+        dist = data.get("dist") if isinstance(data, dict) else None
+        if not isinstance(dist, dict) or dist.get("accelerator") != "cpu":
+            return data
+        data = dict(data)
+        for section, name, value in CPU_DEFAULTS:
+            fields = data.get(section, {})
+            if isinstance(fields, dict) and name not in fields:
+                data[section] = {**fields, name: value}
+        return data
+
+    @model_validator(mode="after")
+    def _check_checkpointing(self) -> "RunConfig":
+        if self.trainer.async_checkpoint and self.dist.strategy in SHARDED_STRATEGIES:
+            raise ValueError("async_checkpoint cannot be combined with fsdp or fsdp2, which write per-rank shards")
+        return self
+
+    @model_validator(mode="after")
+    def _check_resolution_schedule(self) -> "RunConfig":
+        phases = parse_resolution_schedule(self.trainer.resolution_schedule)
+        if phases and (not self.data.batch_transforms or self.data.cache_data):
+            raise ValueError("resolution_schedule requires batch_transforms to resize on the device, and no cache_data")
+        if any(phase.img_size % self.model.patch_size for phase in phases):
+            raise ValueError("every resolution_schedule image size must be a multiple of patch_size")
+        return self
+
+    @model_validator(mode="after")
+    def _check_cpu(self) -> "RunConfig":
+        if self.dist.accelerator == "cpu" and self.model.name == "te-vit":
+            raise ValueError("the te-vit model requires CUDA; use the vit model on the CPU")
+        return self
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "RunConfig":
+        """
+        Builds a config from parsed flags, taking every field whose flag the parser defined and was given a value; a
+        flag left at None keeps the field's default.
+        """
+        sections: dict[str, dict[str, Any]] = {}
+        for name, info in cls.model_fields.items():
+            section: type[BaseModel] = info.annotation  # type: ignore[assignment]
+            sections[name] = {
+                field: value for field in section.model_fields if (value := getattr(args, field, None)) is not None
+            }
+        return cls.model_validate(sections)
+
+
+def parse_value(raw: str) -> Any:
+    """
+    Parses an override value as a TOML value (``512``, ``0.1``, ``true``, ``[1, 2]``, ``"x"``), falling back to the
+    raw string so ``perf.perf_profile=cpu`` needs no quotes.
+    """
+    try:
+        return tomllib.loads(f"value = {raw}")["value"]
+    except tomllib.TOMLDecodeError:
+        return raw
+
+
+def _split_override(override: str) -> tuple[str, Any]:
+    key, sep, raw = override.partition("=")
+    if not sep or "." not in key:
+        raise ValueError(f"invalid override {override!r}; expected SECTION.FIELD=VALUE")
+    return key.strip(), parse_value(raw.strip())
+
+
+def set_path(data: dict[str, Any], key: str, value: Any) -> None:
+    section, _, name = key.partition(".")
+    data.setdefault(section, {})[name] = value
+
+
+def load_config_file(path: str | Path) -> tuple[dict[str, Any], dict[str, list[Any]]]:
+    """
+    Reads a run config from a TOML or JSON file, returning its sections and its ``sweep`` table, which maps
+    ``SECTION.FIELD`` keys to lists of values.
+    """
+    path = Path(path)
+    text = path.read_text(encoding="utf-8")
+    data: dict[str, Any] = json.loads(text) if path.suffix == ".json" else tomllib.loads(text)
+    sweep: dict[str, list[Any]] = data.pop("sweep", {})
+    return data, sweep
+
+
+def expand_sweep(base: dict[str, Any], sweep: dict[str, list[Any]]) -> list[RunConfig]:
+    """
+    Returns one validated config per point of the grid spanned by ``sweep``, in order, each starting from ``base``.
+    Every config is validated before any run starts.
+    """
+    keys = list(sweep)
+    configs: list[RunConfig] = []
+    for values in itertools.product(*(sweep[key] for key in keys)):
+        data = copy.deepcopy(base)
+        for key, value in zip(keys, values, strict=True):
+            set_path(data, key, value)
+        configs.append(RunConfig.model_validate(data))
+    return configs
+
+
+def add_run_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="TOML or JSON run config, optionally with a [sweep] table of SECTION.FIELD = [values] (default : none)",
+    )
+    parser.add_argument(
+        "--sweep",
+        type=str,
+        action="append",
+        default=[],
+        metavar="SECTION.FIELD=[VALUES]",
+        help="sweep a field over a list of values, e.g. 'model.latent_size=[384, 768]'; repeat for a grid",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print the expanded configs without running them",
+    )
+    parser.add_argument(
+        "overrides",
+        nargs="*",
+        metavar="SECTION.FIELD=VALUE",
+        help="override a config field, e.g. data.batch_size=128 perf.compile=true",
+    )
+
+
+def run_configs_from_args(args: argparse.Namespace) -> list[RunConfig]:
+    """
+    Builds the configs of a ``run`` invocation: the config file, then overrides, then the sweep grid of the file
+    extended by ``--sweep``.
+    """
+    base, sweep = load_config_file(args.config) if args.config is not None else ({}, {})
+    for override in args.overrides:
+        set_path(base, *_split_override(override))
+    for entry in args.sweep:
+        key, values = _split_override(entry)
+        if not isinstance(values, list):
+            raise ValueError(f"sweep values for {key} must be a list, e.g. {key}=[1, 2]")
+        sweep[key] = values
+    return expand_sweep(base, sweep)
@@ -0,0 +1,74 @@
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+import torch
+from lightning_fabric.utilities.seed import pl_worker_init_function
+
+NUMA_NODES_DIR = Path("/sys/devices/system/node")
+
+
+def parse_cpu_list(spec: str) -> frozenset[int]:
+    """
+    Parses a kernel CPU list such as ``0-3,8-11`` or ``5``.
+    """
+    cpus: set[int] = set()
+    for part in spec.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return frozenset(cpus)
+
+
+def numa_node_cpus() -> list[frozenset[int]]:
+    """
+    Returns the CPUs of each NUMA node this process may run on, skipping nodes without any of them. Without NUMA
+    information (e.g., outside Linux), all of the process's CPUs count as one node.
+    """
+    allowed = frozenset(os.sched_getaffinity(0))
+    nodes = [
+        parse_cpu_list((node / "cpulist").read_text()) & allowed
+        for node in sorted(NUMA_NODES_DIR.glob("node[0-9]*"), key=lambda node: int(node.name.removeprefix("node")))
+    ]
+    return [cpus for cpus in nodes if cpus] or [allowed]
+
+
+@dataclass(frozen=True, kw_only=True)
+class NumaWorkerPinning:
+    """
+    DataLoader ``worker_init_fn`` which pins each worker to the CPUs of one NUMA node, assigning workers to the nodes
+    round-robin.
+
+    A worker's pages are then allocated on the node it runs on and stay there, instead of following the scheduler
+    across sockets, and the workers spread evenly over the nodes available to the training process. The nodes are
+    read when the pinning is created, in the training process, so restricting that process (e.g., with ``numactl`` or
+    one rank per socket) restricts its workers too.
+
+    Lightning only seeds the workers of DataLoaders without a ``worker_init_fn``, so this seeds them in its place.
+    """
+
+    node_cpus: tuple[frozenset[int], ...]
+
+    @classmethod
+    def for_current_process(cls) -> "NumaWorkerPinning":
+        return cls(node_cpus=tuple(numa_node_cpus()))
+
+    def __call__(self, worker_id: int) -> None:
+        os.sched_setaffinity(0, self.node_cpus[worker_id % len(self.node_cpus)])
+        if int(os.environ.get("PL_SEED_WORKERS", "0")):
+            pl_worker_init_function(worker_id)
+
+
+def configure_threads(intra_op_threads: int | None, inter_op_threads: int | None) -> None:
+    """
+    Sets the number of threads PyTorch uses within an op (e.g., a matmul split across cores) and to run independent
+    ops concurrently, keeping PyTorch's defaults for those which are None.
+
+    The inter-op pool can only be sized before it first runs work, so call this before building the model; it is left
+    alone when it already has the requested size, e.g., for the later runs of a sweep.
+    """
+    if intra_op_threads is not None:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads is not None and inter_op_threads != torch.get_num_interop_threads():
+        torch.set_num_interop_threads(inter_op_threads)
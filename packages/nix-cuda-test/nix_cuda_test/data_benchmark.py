@@ -0,0 +1,223 @@
+import argparse
+import itertools
+import operator
+import os
+import time
+from collections.abc import Callable, Iterable
+from typing import Any
+
+import pytorch_lightning as pl
+import torch
+
+from nix_cuda_test.cifar_data_module import CIFARDataModule
+from nix_cuda_test.loader_config import DEFAULT_LOADER_CONFIG_PATH, LoaderConfig
+from nix_cuda_test.profiling import PeakMemoryMonitor
+
+
+def measure_throughput(loader: Iterable[Any], num_batches: int, warmup_batches: int = 5) -> float:
+    """
+    Returns the number of samples per second produced by ``loader``, ignoring the first ``warmup_batches`` batches
+    (which include worker start-up).
+    """
+    num_samples = 0
+    start = time.perf_counter()
+    for batch_idx, (images, _) in enumerate(loader):
+        if batch_idx == warmup_batches:
+            num_samples = 0
+            start = time.perf_counter()
+        num_samples += images.size(0)
+        if batch_idx + 1 == warmup_batches + num_batches:
+            break
+
+    return num_samples / (time.perf_counter() - start)
+
+
+def add_bench_loader_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--batch-size", type=int, default=64, help="batch size (default : 64)")
+    parser.add_argument("--num-workers", type=int, default=4, help="number of DataLoader workers (default : 4)")
+    parser.add_argument(
+        "--num-batches",
+        type=int,
+        default=500,
+        help="number of batches to time after warm-up (default : 500)",
+    )
+    parser.add_argument("--data-dir", type=str, default="data", help="dataset directory (default : data)")
+
+
+def bench_loader(args: argparse.Namespace) -> None:
+    """
+    Compares the per-sample ``__getitem__`` + collate path against batch-indexed loading.
+
+    Both paths produce the same raw uint8 batches, so only the cost of loading is measured.
+    """
+    results: dict[str, float] = {}
+    for name, batch_sampling in [("per-sample", False), ("batch-indexed", True)]:
+        data_module = CIFARDataModule(
+            batch_sampling=batch_sampling,
+            batch_size=args.batch_size,
+            data_dir=args.data_dir,
+            drop_last=True,
+            num_workers=args.num_workers,
+            pin_memory=False,
+        )
+        data_module.setup("fit")
+        results[name] = measure_throughput(data_module.train_dataloader(), num_batches=args.num_batches)
+
+    baseline = results["per-sample"]
+    for name, samples_per_sec in results.items():
+        print(f"{name:>14}: {samples_per_sec:12.1f} samples/s ({samples_per_sec / baseline:.2f}x)")
+
+
+def measure_epochs(
+    data_module: pl.LightningDataModule,
+    epochs: int,
+    num_batches: int,
+    device: torch.device,
+) -> float:
+    """
+    Returns samples per second over all but the first of ``epochs`` short epochs of ``num_batches`` batches.
+
+    Each epoch starts a fresh iterator, so the cost of (re)starting workers is included, as it is during training.
+    Batches are moved to ``device`` and passed through the datamodule's batch transforms.
+    """
+    loader = data_module.train_dataloader()
+    num_samples = 0
+    start = time.perf_counter()
+    for epoch in range(epochs):
+        if epoch == 1:
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            num_samples = 0
+            start = time.perf_counter()
+        for batch_idx, host_batch in enumerate(loader):
+            batch = [tensor.to(device, non_blocking=True) for tensor in host_batch]
+            images, _ = data_module.on_after_batch_transfer(batch, 0)
+            num_samples += images.size(0)
+            if batch_idx + 1 == num_batches:
+                break
+
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return num_samples / (time.perf_counter() - start)
+
+
+def _parse_bool(value: str) -> bool:
+    match value.lower():
+        case "true" | "1" | "yes":
+            return True
+        case "false" | "0" | "no":
+            return False
+        case _:
+            raise argparse.ArgumentTypeError(f"expected a boolean, got {value!r}")
+
+
+def add_tune_loader_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--num-workers-grid",
+        type=int,
+        nargs="+",
+        default=[0, 2, 4, 8, 16, 32],
+        help="values of num_workers to try; values above the CPU count are skipped (default : 0 2 4 8 16 32)",
+    )
+    parser.add_argument(
+        "--pin-memory-grid",
+        type=_parse_bool,
+        nargs="+",
+        default=[False, True],
+        help="values of pin_memory to try; true is skipped without CUDA (default : false true)",
+    )
+    parser.add_argument(
+        "--prefetch-factor-grid",
+        type=int,
+        nargs="+",
+        default=[2, 4],
+        help="values of prefetch_factor to try (default : 2 4)",
+    )
+    parser.add_argument(
+        "--persistent-workers-grid",
+        type=_parse_bool,
+        nargs="+",
+        default=[False, True],
+        help="values of persistent_workers to try (default : false true)",
+    )
+    parser.add_argument(
+        "--tune-epochs",
+        type=int,
+        default=3,
+        help="short epochs per configuration; the first one is warm-up (default : 3)",
+    )
+    parser.add_argument(
+        "--tune-batches",
+        type=int,
+        default=100,
+        help="batches per short epoch (default : 100)",
+    )
+    parser.add_argument(
+        "--write-config",
+        type=str,
+        nargs="?",
+        const=DEFAULT_LOADER_CONFIG_PATH,
+        default=None,
+        help=(
+            "write the fastest configuration to this file, which `train` picks up "
+            f"(default : {DEFAULT_LOADER_CONFIG_PATH})"
+        ),
+    )
+
+
+def _loader_grid(args: argparse.Namespace) -> list[LoaderConfig]:
+    max_workers = os.cpu_count() or 1
+    pin_memory_grid = [pin for pin in args.pin_memory_grid if not pin or torch.cuda.is_available()]
+    configs: list[LoaderConfig] = []
+    for num_workers, pin_memory in itertools.product(args.num_workers_grid, pin_memory_grid):
+        if num_workers > max_workers:
+            continue
+        if num_workers == 0:
+            # prefetch_factor and persistent_workers only apply to worker processes.
+            configs.append(LoaderConfig(num_workers=0, pin_memory=pin_memory))
+            continue
+        configs.extend(
+            LoaderConfig(
+                num_workers=num_workers,
+                pin_memory=pin_memory,
+                prefetch_factor=prefetch_factor,
+                persistent_workers=persistent_workers,
+            )
+            for prefetch_factor, persistent_workers in itertools.product(
+                args.prefetch_factor_grid, args.persistent_workers_grid
+            )
+        )
+    return configs
+
+
+def tune_loader(args: argparse.Namespace, build: Callable[[LoaderConfig], pl.LightningDataModule]) -> None:
+    """
+    Benchmarks the data pipeline alone (no model) for every combination of DataLoader settings in the grid, printing
+    samples/sec and the peak memory of the process tree, and optionally saves the fastest configuration.
+    """
+    grid = _loader_grid(args)
+    if not grid:
+        raise ValueError(
+            f"no DataLoader settings to try: every worker count exceeds the {os.cpu_count() or 1} CPUs, or the grids "
+            "are empty"
+        )
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    results: list[tuple[LoaderConfig, float, int]] = []
+    print(f"{'workers':>7} {'pin':>5} {'prefetch':>8} {'persist':>7} {'samples/s':>12} {'peak MiB':>9}")
+    for config in grid:
+        data_module = build(config)
+        data_module.setup("fit")
+        with PeakMemoryMonitor() as monitor:
+            samples_per_sec = measure_epochs(data_module, args.tune_epochs, args.tune_batches, device)
+        results.append((config, samples_per_sec, monitor.peak_bytes))
+        print(
+            f"{config.num_workers:>7} {config.pin_memory!s:>5} {config.prefetch_factor!s:>8} "
+            f"{config.persistent_workers!s:>7} {samples_per_sec:>12.1f} {monitor.peak_bytes / 2**20:>9.0f}"
+        )
+
+    best, best_samples_per_sec, _ = max(results, key=operator.itemgetter(1))
+    print(f"fastest: {best} at {best_samples_per_sec:.1f} samples/s")
+    if args.write_config is not None:
+        best.save(args.write_config)
+        print(f"wrote {args.write_config}")
@@ -0,0 +1,189 @@
+import argparse
+from typing import TYPE_CHECKING, Any, Literal
+
+# Lightning and torch are imported where they are used, so defining the command line doesn't load them.
+if TYPE_CHECKING:
+    from pytorch_lightning.strategies import Strategy
+    from torch import nn
+
+StrategyName = Literal["auto", "ddp", "fsdp", "fsdp2"]
+CommHook = Literal["none", "fp16", "bf16", "powersgd"]
+
+STRATEGIES: tuple[StrategyName, ...] = ("auto", "ddp", "fsdp", "fsdp2")
+SHARDED_STRATEGIES: frozenset[StrategyName] = frozenset({"fsdp", "fsdp2"})
+COMM_HOOKS: tuple[CommHook, ...] = ("none", "fp16", "bf16", "powersgd")
+
+
+def comm_hook_kwargs(comm_hook: CommHook, *, powersgd_rank: int, powersgd_start_iter: int) -> dict[str, Any]:
+    """
+    Returns the ``DDPStrategy`` arguments registering the gradient communication hook called ``comm_hook``.
+
+    ``fp16`` and ``bf16`` halve the bytes all-reduced by casting gradient buckets; ``powersgd`` sends a low-rank
+    approximation of each bucket after ``powersgd_start_iter`` plain all-reduces, with error feedback.
+    """
+    from torch.distributed.algorithms.ddp_comm_hooks import default_hooks, powerSGD_hook  # noqa: PLC0415
+
+    match comm_hook:
+        case "none":
+            return {}
+        case "fp16":
+            return {"ddp_comm_hook": default_hooks.fp16_compress_hook}
+        case "bf16":
+            return {"ddp_comm_hook": default_hooks.bf16_compress_hook}
+        case "powersgd":
+            return {
+                "ddp_comm_hook": powerSGD_hook.powerSGD_hook,
+                "ddp_comm_state": powerSGD_hook.PowerSGDState(
+                    process_group=None,
+                    matrix_approximation_rank=powersgd_rank,
+                    start_powerSGD_iter=powersgd_start_iter,
+                ),
+            }
+
+
+def world_size(*, accelerator: str, devices: int | str, num_nodes: int) -> int:
+    """
+    Returns the number of processes Lightning will launch for these Trainer arguments.
+    """
+    import torch  # noqa: PLC0415
+
+    if devices != "auto":
+        return int(devices) * num_nodes
+    on_cuda = accelerator != "cpu" and torch.cuda.is_available()
+    return (torch.cuda.device_count() if on_cuda else 1) * num_nodes
+
+
+def fully_shard_layers(module: "nn.Module", layer_class: "type[nn.Module]", mesh: Any) -> None:
+    """
+    Shards ``module`` with FSDP2 over the 1D device ``mesh``, each ``layer_class`` (one encoder layer) as its own unit
+    and everything else (embeddings, head) as the root unit.
+
+    Parameters, gradients, and optimizer state are split across the ranks of ``mesh``; a layer's parameters are
+    all-gathered just before it runs and freed again after it, so only one layer is held in full at a time.
+    """
+    from torch.distributed.fsdp import fully_shard  # noqa: PLC0415
+
+    for submodule in module.modules():
+        if isinstance(submodule, layer_class):
+            fully_shard(submodule, mesh=mesh)
+    fully_shard(module, mesh=mesh)
+
+
+def build_strategy(
+    strategy: StrategyName,
+    *,
+    world_size: int,
+    process_group_backend: str | None,
+    bucket_cap_mb: float,
+    gradient_as_bucket_view: bool,
+    static_graph: bool,
+    comm_hook: CommHook,
+    powersgd_rank: int,
+    powersgd_start_iter: int,
+    layer_class: "type[nn.Module]",
+) -> "Strategy | str":
+    """
+    Builds the Lightning strategy called ``strategy``.
+
+    ``ddp`` buckets gradients into ``bucket_cap_mb`` chunks which are all-reduced while the backward pass continues,
+    optionally compressed by ``comm_hook``. ``fsdp`` shards parameters, gradients, and optimizer state, wrapping each
+    ``layer_class`` (one encoder layer) as its own unit. ``fsdp2`` does the same with per-parameter sharding: it gives
+    the model a ``world_size``-wide data parallel mesh, which the model shards itself over in ``configure_model``
+    (see ``fully_shard_layers``). ``auto`` leaves the choice to Lightning.
+
+    Both sharded strategies save checkpoints as one shard per rank, written and read in parallel, rather than gathering
+    the full state on rank zero.
+    """
+    from pytorch_lightning.strategies import DDPStrategy, FSDPStrategy, ModelParallelStrategy  # noqa: PLC0415
+
+    match strategy:
+        case "auto":
+            return "auto"
+        case "ddp":
+            return DDPStrategy(
+                process_group_backend=process_group_backend,
+                bucket_cap_mb=bucket_cap_mb,
+                gradient_as_bucket_view=gradient_as_bucket_view,
+                static_graph=static_graph,
+                **comm_hook_kwargs(comm_hook, powersgd_rank=powersgd_rank, powersgd_start_iter=powersgd_start_iter),
+            )
+        case "fsdp" | "fsdp2" if comm_hook != "none":
+            raise ValueError("communication hooks are only supported with the ddp strategy")
+        case "fsdp":
+            return FSDPStrategy(
+                process_group_backend=process_group_backend,
+                auto_wrap_policy={layer_class},
+                state_dict_type="sharded",
+            )
+        case "fsdp2":
+            return ModelParallelStrategy(
+                data_parallel_size=world_size,
+                tensor_parallel_size=1,
+                process_group_backend=process_group_backend,
+                save_distributed_checkpoint=True,
+            )
+
+
+def _devices(value: str) -> int | str:
+    return value if value == "auto" else int(value)
+
+
+def add_distributed_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--strategy",
+        choices=STRATEGIES,
+        default="auto",
+        help="data parallel strategy (default : auto)",
+    )
+    parser.add_argument(
+        "--accelerator",
+        choices=["auto", "cpu", "gpu"],
+        default="auto",
+        help=(
+            "accelerator to train on; cpu also switches the device-dependent defaults to the vit model, the "
+            "adamw-foreach optimizer, and the cpu perf profile (default : auto)"
+        ),
+    )
+    parser.add_argument(
+        "--devices",
+        type=_devices,
+        default="auto",
+        help="devices (or CPU processes) per node (default : auto)",
+    )
+    parser.add_argument("--num-nodes", type=int, default=1, help="number of nodes (default : 1)")
+    parser.add_argument(
+        "--process-group-backend",
+        choices=["nccl", "gloo"],
+        default=None,
+        help="torch.distributed backend (default : nccl on CUDA, gloo on CPU)",
+    )
+    parser.add_argument(
+        "--bucket-cap-mb",
+        type=float,
+        default=25.0,
+        help="size of the DDP gradient buckets all-reduced during the backward pass (default : 25)",
+    )
+    parser.add_argument(
+        "--gradient-as-bucket-view",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="make gradients views into the DDP buckets, saving a copy (default : true)",
+    )
+    parser.add_argument(
+        "--static-graph",
+        action="store_true",
+        help="tell DDP the set of used parameters never changes, enabling more overlap",
+    )
+    parser.add_argument(
+        "--comm-hook",
+        choices=COMM_HOOKS,
+        default="none",
+        help="compress DDP gradient communication (default : none)",
+    )
+    parser.add_argument("--powersgd-rank", type=int, default=1, help="PowerSGD approximation rank (default : 1)")
+    parser.add_argument(
+        "--powersgd-start-iter",
+        type=int,
+        default=2,
+        help="plain all-reduces before PowerSGD compression starts (default : 2)",
+    )
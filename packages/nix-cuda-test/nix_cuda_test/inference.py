@@ -0,0 +1,219 @@
+import argparse
+import math
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from queue import Empty, Queue
+
+import pytorch_lightning as pl
+import torch
+from torch import Tensor
+
+from nix_cuda_test.async_checkpoint import read_checkpoint_dir
+from nix_cuda_test.batch_transforms import BatchTransforms
+from nix_cuda_test.models import MODEL_NAMES, default_model_name, model_class
+from nix_cuda_test.profiling import summarize
+
+
+@dataclass(kw_only=True)
+class _Request:
+    image: Tensor
+    enqueued_at: float
+    future: Future[Tensor] = field(default_factory=Future)
+
+
+@dataclass(kw_only=True)
+class MicroBatcher:
+    """
+    Groups individually submitted images into batches for ``predict``.
+
+    A batch is dispatched as soon as it holds ``max_batch_size`` images or ``max_wait_s`` has passed since its first
+    image arrived, whichever comes first. ``predict`` runs on a single background thread and receives the stacked
+    images; row ``i`` of its output resolves the future of the ``i``-th request in the batch. The latency of every
+    request (from ``submit`` to its result being available) and the size of every batch are recorded.
+    """
+
+    # Args
+    predict: Callable[[Tensor], Tensor]
+    max_batch_size: int
+    max_wait_s: float
+
+    # Non-args
+    latencies_s: list[float] = field(init=False, default_factory=list)
+    batch_sizes: list[int] = field(init=False, default_factory=list)
+    queue: Queue[_Request | None] = field(init=False, default_factory=Queue)
+    thread: threading.Thread = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, image: Tensor) -> Future[Tensor]:
+        request = _Request(image=image, enqueued_at=time.perf_counter())
+        self.queue.put(request)
+        return request.future
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+
+    def _collect(self, first: _Request) -> tuple[list[_Request], bool]:
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def _run(self) -> None:
+        closed = False
+        while not closed:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch, closed = self._collect(first)
+            try:
+                outputs = self.predict(torch.stack([request.image for request in batch]))
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            self.batch_sizes.append(len(batch))
+            for request, output in zip(batch, outputs, strict=True):
+                self.latencies_s.append(done - request.enqueued_at)
+                request.future.set_result(output)
+
+
+def add_serve_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--model",
+        choices=MODEL_NAMES,
+        default=None,
+        help="model implementation (default : te-vit on CUDA, else vit)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=None,
+        help="Lightning checkpoint to load (default : randomly initialized model with default settings)",
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cuda" if torch.cuda.is_available() else "cpu",
+        help="device to run on (default : cuda if available, else cpu)",
+    )
+    parser.add_argument("--max-batch-size", type=int, default=32, help="largest micro-batch (default : 32)")
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=5.0,
+        help="longest time a request waits for its micro-batch to fill (default : 5)",
+    )
+    parser.add_argument("--num-requests", type=int, default=2000, help="requests to send (default : 2000)")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="clients sending requests concurrently, each waiting for its previous answer (default : 16)",
+    )
+
+
+def load_model(args: argparse.Namespace, device: torch.device) -> pl.LightningModule:
+    # Transformer Engine needs CUDA, including when it's available but not the --device.
+    model_name = args.model or (default_model_name() if device.type == "cuda" else "vit")
+    cls = model_class(model_name)
+    if args.checkpoint is not None and Path(args.checkpoint).is_dir():
+        # Written with --async-checkpoint.
+        checkpoint = read_checkpoint_dir(args.checkpoint)
+        with device:
+            model = cls(**checkpoint["hyper_parameters"])
+        model.load_state_dict(checkpoint["state_dict"])
+        return model
+    if args.checkpoint is not None:
+        return cls.load_from_checkpoint(args.checkpoint, map_location=device)
+
+    with device:
+        return cls(
+            dropout=0.0,
+            latent_size=768,
+            lr=1e-4,
+            n_channels=3,
+            num_classes=16,
+            num_encoders=12,
+            num_heads=12,
+            num_patches=(224 // 16) ** 2,
+            patch_size=16,
+            weight_decay=0.0,
+        )
+
+
+def serve(args: argparse.Namespace) -> None:
+    """
+    Load-tests micro-batched inference: ``concurrency`` clients each send raw uint8 32x32 images one at a time and
+    wait for the predicted class, until ``num_requests`` have been answered. Reports throughput, per-request latency
+    percentiles, and the mean batch size.
+    """
+    device = torch.device(args.device)
+    model = load_model(args, device).eval()
+    hparams = model.hparams
+    img_size = math.isqrt(hparams["num_patches"]) * hparams["patch_size"]
+    preprocess = BatchTransforms(img_size=img_size).eval().to(device)
+    autocast = torch.autocast(device.type, dtype=torch.bfloat16) if device.type == "cuda" else nullcontext()
+
+    @torch.inference_mode()
+    def predict(images: Tensor) -> Tensor:
+        with autocast:
+            logits: Tensor = model.predict_step(preprocess(images.to(device, non_blocking=True)), 0)
+        return logits.argmax(dim=-1).cpu()
+
+    batcher = MicroBatcher(predict=predict, max_batch_size=args.max_batch_size, max_wait_s=args.max_wait_ms / 1e3)
+
+    # Warm up (e.g., cuDNN autotuning) before measuring.
+    for _ in range(3):
+        batcher.submit(torch.randint(0, 256, (3, 32, 32), dtype=torch.uint8)).result()
+    batcher.latencies_s.clear()
+    batcher.batch_sizes.clear()
+
+    remaining = args.num_requests
+    lock = threading.Lock()
+
+    def client() -> None:
+        nonlocal remaining
+        while True:
+            with lock:
+                if remaining == 0:
+                    return
+                remaining -= 1
+            batcher.submit(torch.randint(0, 256, (3, 32, 32), dtype=torch.uint8)).result()
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    batcher.close()
+
+    latency = summarize(batcher.latencies_s)
+    print(f"requests: {args.num_requests} in {elapsed:.2f}s ({args.num_requests / elapsed:.1f} images/s)")
+    print(f"mean batch size: {sum(batcher.batch_sizes) / len(batcher.batch_sizes):.1f}")
+    print(
+        f"latency ms: mean {latency['mean'] * 1e3:.2f}, p50 {latency['p50'] * 1e3:.2f}, "
+        f"p95 {latency['p95'] * 1e3:.2f}, p99 {latency['p99'] * 1e3:.2f}"
+    )
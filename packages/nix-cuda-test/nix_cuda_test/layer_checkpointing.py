@@ -0,0 +1,53 @@
+from collections.abc import Callable
+
+import torch
+from torch import Tensor
+from torch.utils.checkpoint import checkpoint
+
+
+def activation_element_size(x: Tensor) -> int:
+    """
+    Bytes per element of the activations computed from ``x``, accounting for autocast.
+    """
+    if torch.is_autocast_enabled(x.device.type):
+        return torch.get_autocast_dtype(x.device.type).itemsize
+    return x.element_size()
+
+
+def estimate_layer_activation_bytes(x: Tensor, num_heads: int, *, attention_matrix: bool) -> int:
+    """
+    Estimates the activation memory a transformer layer keeps for the backward pass, given its input ``x`` shaped
+    [B, S, H].
+
+    Uses the estimate from Korthikanti et al., "Reducing Activation Recomputation in Large Transformer Models":
+    ``S * B * H * (34 + 5 * A * S / H)`` bytes for 16-bit activations, where the second term is the attention matrix
+    (scores, softmax, and dropout mask). Fused attention kernels don't materialize it, so it is only counted when
+    ``attention_matrix`` is set. The result is scaled for other activation sizes.
+    """
+    B, S, H = x.shape
+    per_token = 34 * H + (5 * num_heads * S if attention_matrix else 0)
+    return B * S * per_token * activation_element_size(x) // 2
+
+
+def run_layers(
+    layers: list[torch.nn.Module],
+    x: Tensor,
+    checkpointed: frozenset[int],
+    checkpoint_fn: Callable[[torch.nn.Module, Tensor], Tensor] | None = None,
+) -> Tensor:
+    """
+    Runs ``x`` through ``layers`` in order, checkpointing the layers whose indices are in ``checkpointed``.
+
+    Checkpointing only happens when gradients are being recorded. ``checkpoint_fn`` defaults to
+    ``torch.utils.checkpoint.checkpoint`` without reentrancy.
+    """
+    if not torch.is_grad_enabled():
+        checkpointed = frozenset()
+    for i, layer in enumerate(layers):
+        if i not in checkpointed:
+            x = layer(x)
+        elif checkpoint_fn is not None:
+            x = checkpoint_fn(layer, x)
+        else:
+            x = checkpoint(layer, x, use_reentrant=False)
+    return x
@@ -0,0 +1,59 @@
+import json
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+# Where `tune-loader --write-config` stores its result by default, and where `train` looks for it.
+DEFAULT_LOADER_CONFIG_PATH = "data/loader-config.json"
+
+
+@dataclass(kw_only=True, frozen=True)
+class LoaderConfig:
+    """
+    The DataLoader settings which depend on the machine rather than on the model.
+    """
+
+    num_workers: int
+    pin_memory: bool
+    prefetch_factor: int | None = None
+    persistent_workers: bool = False
+
+    @classmethod
+    def load(cls, path: str | Path) -> "LoaderConfig":
+        return cls(**json.loads(Path(path).read_text(encoding="utf-8")))
+
+    def save(self, path: str | Path) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(asdict(self), indent=2), encoding="utf-8")
+
+    def dataloader_kwargs(self) -> dict[str, Any]:
+        """
+        Keyword arguments for ``DataLoader``, dropping the ones it rejects when loading in the main process.
+        """
+        return dataloader_kwargs(
+            num_workers=self.num_workers,
+            pin_memory=self.pin_memory,
+            prefetch_factor=self.prefetch_factor,
+            persistent_workers=self.persistent_workers,
+        )
+
+
+def dataloader_kwargs(
+    *,
+    num_workers: int,
+    pin_memory: bool,
+    prefetch_factor: int | None,
+    persistent_workers: bool,
+    worker_init_fn: Callable[[int], None] | None = None,
+) -> dict[str, Any]:
+    if num_workers == 0:
+        return {"num_workers": 0, "pin_memory": pin_memory}
+
+    return {
+        "num_workers": num_workers,
+        "pin_memory": pin_memory,
+        "prefetch_factor": prefetch_factor,
+        "persistent_workers": persistent_workers,
+        "worker_init_fn": worker_init_fn,
+    }
@@ -0,0 +1,252 @@
+import argparse
+import importlib.metadata
+import itertools
+import json
+import platform
+import time
+from collections.abc import Callable
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any
+
+import torch
+from torch import Tensor, nn
+
+from nix_cuda_test.checkpointing import checkpoint_policy
+from nix_cuda_test.models import MODEL_NAMES, build_model
+from nix_cuda_test.perf_profiles import add_perf_profile_arguments, apply_perf_profile
+from nix_cuda_test.profiling import PeakMemoryMonitor, process_tree_memory_bytes, summarize
+
+COMPILE_MODES = ("eager", "compiled")
+PASSES = ("forward", "forward-backward")
+
+
+def add_bench_model_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--models", choices=MODEL_NAMES, nargs="+", default=list(MODEL_NAMES))
+    parser.add_argument("--compile-modes", choices=COMPILE_MODES, nargs="+", default=list(COMPILE_MODES))
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[64])
+    parser.add_argument("--patch-sizes", type=int, nargs="+", default=[16])
+    parser.add_argument("--latent-sizes", type=int, nargs="+", default=[768])
+    parser.add_argument("--depths", type=int, nargs="+", default=[12], help="values of num_encoders")
+    parser.add_argument(
+        "--checkpoint-policies",
+        type=checkpoint_policy,
+        nargs="+",
+        default=["none"],
+        help="activation checkpointing policies to compare: none, all, every:K, or budget:BYTES (default : none)",
+    )
+    parser.add_argument(
+        "--token-keep-ratios",
+        type=float,
+        nargs="+",
+        default=[1.0],
+        help="shares of patch tokens kept in the forward+backward pass to compare (default : 1)",
+    )
+    parser.add_argument(
+        "--num-heads",
+        type=int,
+        default=None,
+        help="attention heads (default : latent size / 64)",
+    )
+    parser.add_argument("--img-size", type=int, default=224, help="image size (default : 224)")
+    parser.add_argument("--num-classes", type=int, default=16, help="number of classes (default : 16)")
+    parser.add_argument(
+        "--dtype",
+        choices=["float32", "bfloat16"],
+        default=None,
+        help="autocast dtype (default : bfloat16 on CUDA, float32 on CPU)",
+    )
+    parser.add_argument("--warmup", type=int, default=5, help="untimed iterations per case (default : 5)")
+    parser.add_argument("--iters", type=int, default=20, help="timed iterations per case (default : 20)")
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="append one JSON object per case to this file (JSON lines), for diffing between builds",
+    )
+    add_perf_profile_arguments(parser, default_help="none, keeping PyTorch defaults")
+
+
+def environment() -> dict[str, Any]:
+    """
+    Describes the software and hardware a benchmark ran on, so results from different builds can be told apart.
+    """
+    env: dict[str, Any] = {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "cuda": torch.version.cuda,
+        "cudnn": torch.backends.cudnn.version() if torch.backends.cudnn.is_available() else None,
+        "device": torch.cuda.get_device_name() if torch.cuda.is_available() else platform.processor(),
+    }
+    try:
+        # Read the installed version without importing Transformer Engine, which takes seconds.
+        env["transformer_engine"] = importlib.metadata.version("transformer-engine")
+    except importlib.metadata.PackageNotFoundError:
+        env["transformer_engine"] = None
+    return env
+
+
+def time_iterations(fn: Callable[[], None], warmup: int, iters: int, device: torch.device) -> list[float]:
+    """
+    Returns the wall time in seconds of each of ``iters`` calls to ``fn``, after ``warmup`` untimed calls.
+    """
+    synchronize = torch.cuda.synchronize if device.type == "cuda" else (lambda: None)
+    for _ in range(warmup):
+        fn()
+    synchronize()
+
+    latencies: list[float] = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        synchronize()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _bench_case(
+    model: nn.Module,
+    images: Tensor,
+    labels: Tensor,
+    *,
+    pass_: str,
+    args: argparse.Namespace,
+    autocast: Callable[[], Any],
+) -> dict[str, Any]:
+    device = images.device
+    criterion = nn.CrossEntropyLoss()
+
+    def forward() -> None:
+        with torch.no_grad(), autocast():
+            model(images)
+
+    def forward_backward() -> None:
+        with autocast():
+            loss = criterion(model(images), labels)
+        loss.backward()
+        model.zero_grad(set_to_none=True)
+
+    fn = forward if pass_ == "forward" else forward_backward
+    model.train(pass_ == "forward-backward")
+
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+        latencies = time_iterations(fn, args.warmup, args.iters, device)
+        peak_memory_bytes = torch.cuda.max_memory_allocated(device)
+    else:
+        # Report the growth over the memory in use before the case ran (the model, inputs, and torch itself).
+        baseline_bytes = process_tree_memory_bytes()
+        with PeakMemoryMonitor(interval=0.01) as monitor:
+            latencies = time_iterations(fn, args.warmup, args.iters, device)
+        peak_memory_bytes = max(0, monitor.peak_bytes - baseline_bytes)
+
+    latency = summarize(latencies)
+    return {
+        "latency_s": latency,
+        "images_per_s": images.size(0) / latency["p50"],
+        "peak_memory_bytes": peak_memory_bytes,
+    }
+
+
+def bench_model(args: argparse.Namespace) -> None:
+    """
+    Benchmarks forward and forward+backward passes of each model implementation on synthetic inputs, across a grid of
+    batch size, patch size, latent size, depth, activation checkpointing policy, and token keep ratio, both eagerly and
+    compiled. Tokens are only dropped in training, so the keep ratio only affects forward+backward.
+
+    Comparing checkpointing policies at several batch sizes shows the memory saved against the step time lost, i.e.,
+    the largest batch that fits and what it costs.
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dtype_name = args.dtype or ("bfloat16" if device.type == "cuda" else "float32")
+    dtype = getattr(torch, dtype_name)
+
+    def autocast() -> Any:
+        return nullcontext() if dtype == torch.float32 else torch.autocast(device.type, dtype=dtype)
+
+    env = environment()
+    if args.perf_profile is not None:
+        env["perf_settings"] = apply_perf_profile(args.perf_profile, args.perf_profiles).effective_settings()
+    output = None if args.output is None else Path(args.output).open("a", encoding="utf-8")
+    header = (
+        f"{'model':>6} {'mode':>8} {'pass':>16} {'batch':>5} {'patch':>5} {'latent':>6} {'depth':>5} {'ckpt':>14} "
+        f"{'keep':>5} {'p50 ms':>9} {'p95 ms':>9} {'img/s':>9} {'peak MiB':>9}"
+    )
+    print(header)
+    for model_name, compile_mode, batch_size, patch_size, latent_size, depth, policy, keep_ratio in itertools.product(
+        args.models,
+        args.compile_modes,
+        args.batch_sizes,
+        args.patch_sizes,
+        args.latent_sizes,
+        args.depths,
+        args.checkpoint_policies,
+        args.token_keep_ratios,
+    ):
+        if model_name == "te-vit" and device.type != "cuda":
+            print(f"skipping {model_name}: Transformer Engine requires CUDA")
+            continue
+
+        config = {
+            "model": model_name,
+            "compile": compile_mode,
+            "batch_size": batch_size,
+            "patch_size": patch_size,
+            "latent_size": latent_size,
+            "num_encoders": depth,
+            "checkpoint_policy": policy,
+            "token_keep_ratio": keep_ratio,
+            "num_heads": args.num_heads or max(1, latent_size // 64),
+            "img_size": args.img_size,
+            "dtype": dtype_name,
+            "perf_profile": args.perf_profile,
+        }
+        torch._dynamo.reset()  # type: ignore[no-untyped-call]
+        with device:
+            wrapped = build_model(
+                model_name,
+                dropout=0.0,
+                latent_size=latent_size,
+                lr=1e-4,
+                n_channels=3,
+                num_classes=args.num_classes,
+                num_encoders=depth,
+                num_heads=config["num_heads"],
+                num_patches=(args.img_size // patch_size) ** 2,
+                patch_size=patch_size,
+                weight_decay=0.0,
+                checkpoint_policy=policy,
+            )
+            images = torch.rand(batch_size, 3, args.img_size, args.img_size)
+            labels = torch.randint(0, args.num_classes, (batch_size,))
+        wrapped.module.set_token_keep_ratio(keep_ratio)  # pyright: ignore
+
+        model: nn.Module = wrapped
+        if compile_mode == "compiled":
+            model = torch.compile(wrapped)  # type: ignore[assignment]
+
+        for pass_ in PASSES:
+            try:
+                result = _bench_case(model, images, labels, pass_=pass_, args=args, autocast=autocast)
+            except torch.cuda.OutOfMemoryError:
+                result = {"oom": True}
+
+            record = {**config, "pass": pass_, **result, "env": env}
+            if output is not None:
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+            if "oom" in result:
+                print(f"{model_name:>6} {compile_mode:>8} {pass_:>16} {batch_size:>5} ... out of memory")
+                continue
+            print(
+                f"{model_name:>6} {compile_mode:>8} {pass_:>16} {batch_size:>5} {patch_size:>5} {latent_size:>6} "
+                f"{depth:>5} {policy:>14} {keep_ratio:>5.2f} {result['latency_s']['p50'] * 1e3:>9.2f} "
+                f"{result['latency_s']['p95'] * 1e3:>9.2f} {result['images_per_s']:>9.1f} "
+                f"{result['peak_memory_bytes'] / 2**20:>9.0f}"
+            )
+
+        del model, wrapped, images, labels
+
+    if output is not None:
+        output.close()
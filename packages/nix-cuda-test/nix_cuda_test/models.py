@@ -0,0 +1,61 @@
+from typing import TYPE_CHECKING, Any, Literal
+
+# The model implementations (and torch with them) are imported only when requested.
+if TYPE_CHECKING:
+    import pytorch_lightning as pl
+    from torch import nn
+
+ModelName = Literal["te-vit", "vit"]
+MODEL_NAMES: tuple[ModelName, ...] = ("te-vit", "vit")
+
+# How the patch tokens kept when dropping tokens in training are chosen; see utils.drop_tokens.
+TokenDropMode = Literal["random", "structured"]
+TOKEN_DROP_MODES: tuple[TokenDropMode, ...] = ("random", "structured")
+
+
+def model_class(name: ModelName) -> "type[pl.LightningModule]":
+    """
+    Returns the wrapped model class called ``name``.
+
+    Each implementation is imported only when requested, so the pure PyTorch model doesn't need Transformer Engine.
+    """
+    match name:
+        case "te-vit":
+            from nix_cuda_test.wrapped_te_vit import WrappedTEViT  # noqa: PLC0415
+
+            return WrappedTEViT
+        case "vit":
+            from nix_cuda_test.wrapped_vit import WrappedViT  # noqa: PLC0415
+
+            return WrappedViT
+
+
+def default_model_name() -> ModelName:
+    """
+    Transformer Engine needs CUDA, so the pure PyTorch model is the default without it.
+    """
+    import torch  # noqa: PLC0415
+
+    return "te-vit" if torch.cuda.is_available() else "vit"
+
+
+def encoder_layer_class(name: ModelName) -> "type[nn.Module]":
+    """
+    Returns the class of a single encoder layer of the model called ``name``, e.g., to shard or wrap layer by layer.
+    """
+    match name:
+        case "te-vit":
+            import transformer_engine.pytorch as te  # noqa: PLC0415
+
+            return te.TransformerLayer
+        case "vit":
+            from nix_cuda_test.utils import EncoderBlock  # noqa: PLC0415
+
+            return EncoderBlock
+
+
+def build_model(name: ModelName, **kwargs: Any) -> "pl.LightningModule":
+    """
+    Builds the wrapped model called ``name``, passing ``kwargs`` to its constructor.
+    """
+    return model_class(name)(**kwargs)
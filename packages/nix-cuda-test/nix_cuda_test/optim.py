@@ -0,0 +1,64 @@
+from typing import TYPE_CHECKING, Any, Literal
+
+# torch is imported where it is used, so the run config can refer to the optimizers without loading it.
+if TYPE_CHECKING:
+    from torch import nn
+    from torch.optim.optimizer import Optimizer
+
+OptimizerName = Literal["adamw-foreach", "adamw-fused", "adamw-8bit"]
+OPTIMIZERS: tuple[OptimizerName, ...] = ("adamw-foreach", "adamw-fused", "adamw-8bit")
+
+# Parameters which are exempt from weight decay in addition to every bias and normalization weight.
+NO_DECAY_NAMES = frozenset({"class_token", "pos_embedding"})
+
+
+def default_optimizer_name() -> OptimizerName:
+    import torch  # noqa: PLC0415
+
+    return "adamw-fused" if torch.cuda.is_available() else "adamw-foreach"
+
+
+def parameter_groups(module: "nn.Module", weight_decay: float) -> list[dict[str, Any]]:
+    """
+    Splits the trainable parameters of ``module`` into a group decayed by ``weight_decay`` and a group which isn't.
+
+    Biases and normalization weights (every parameter with at most one dimension), the class token, and the positional
+    embedding are not decayed: shrinking them towards zero only hurts the model.
+    """
+    decay: list[nn.Parameter] = []
+    no_decay: list[nn.Parameter] = []
+    for name, param in module.named_parameters():
+        if not param.requires_grad:
+            continue
+        if param.ndim <= 1 or name.rpartition(".")[2] in NO_DECAY_NAMES:
+            no_decay.append(param)
+        else:
+            decay.append(param)
+    return [
+        {"params": decay, "weight_decay": weight_decay},
+        {"params": no_decay, "weight_decay": 0.0},
+    ]
+
+
+def build_optimizer(name: OptimizerName, groups: list[dict[str, Any]], *, lr: float) -> "Optimizer":
+    """
+    Builds the AdamW implementation called ``name`` over the parameter ``groups``.
+
+    ``adamw-foreach`` updates all parameters of a group with a few multi-tensor kernels instead of several kernels per
+    parameter; ``adamw-fused`` goes further and does the whole update in a single kernel per group. ``adamw-8bit``
+    keeps both moments in 8 bits (bitsandbytes), a quarter of the fp32 optimizer state.
+    """
+    from torch.optim.adamw import AdamW  # noqa: PLC0415
+
+    match name:
+        case "adamw-foreach":
+            return AdamW(groups, lr=lr, foreach=True)
+        case "adamw-fused":
+            return AdamW(groups, lr=lr, fused=True)
+        case "adamw-8bit":
+            try:
+                import bitsandbytes as bnb  # noqa: PLC0415  # pyright: ignore[reportMissingImports]
+            except ImportError:
+                raise ValueError("the adamw-8bit optimizer requires bitsandbytes") from None
+            optimizer: Optimizer = bnb.optim.AdamW8bit(groups, lr=lr)
+            return optimizer
@@ -0,0 +1,120 @@
+import argparse
+import itertools
+import json
+from pathlib import Path
+
+import torch
+from torch.optim.optimizer import Optimizer
+
+from nix_cuda_test.model_benchmark import environment, time_iterations
+from nix_cuda_test.models import MODEL_NAMES, build_model
+from nix_cuda_test.optim import OPTIMIZERS
+from nix_cuda_test.profiling import summarize
+
+
+def optimizer_state_bytes(optimizer: Optimizer) -> int:
+    return sum(
+        value.numel() * value.element_size()
+        for state in optimizer.state.values()
+        for value in state.values()
+        if isinstance(value, torch.Tensor)
+    )
+
+
+def add_bench_optimizer_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--models", choices=MODEL_NAMES, nargs="+", default=list(MODEL_NAMES))
+    parser.add_argument("--optimizers", choices=OPTIMIZERS, nargs="+", default=list(OPTIMIZERS))
+    parser.add_argument("--latent-sizes", type=int, nargs="+", default=[768])
+    parser.add_argument("--depths", type=int, nargs="+", default=[12], help="values of num_encoders")
+    parser.add_argument("--patch-size", type=int, default=16, help="patch size (default : 16)")
+    parser.add_argument("--img-size", type=int, default=224, help="image size (default : 224)")
+    parser.add_argument("--num-classes", type=int, default=16, help="number of classes (default : 16)")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed steps per case (default : 5)")
+    parser.add_argument("--iters", type=int, default=20, help="timed steps per case (default : 20)")
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="append one JSON object per case to this file (JSON lines), for diffing between builds",
+    )
+
+
+def bench_optimizer(args: argparse.Namespace) -> None:
+    """
+    Times ``optimizer.step()`` of each optimizer on each model, with gradients filled in once so only the update is
+    measured, and reports the optimizer state size and the memory the step needs on top of it.
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    env = environment()
+    output = None if args.output is None else Path(args.output).open("a", encoding="utf-8")
+    print(
+        f"{'model':>6} {'optimizer':>13} {'latent':>6} {'depth':>5} {'params M':>8} "
+        f"{'p50 ms':>9} {'p95 ms':>9} {'state MiB':>9} {'step MiB':>9}"
+    )
+    for model_name, optimizer_name, latent_size, depth in itertools.product(
+        args.models, args.optimizers, args.latent_sizes, args.depths
+    ):
+        if model_name == "te-vit" and device.type != "cuda":
+            print(f"skipping {model_name}: Transformer Engine requires CUDA")
+            continue
+
+        with device:
+            model = build_model(
+                model_name,
+                dropout=0.0,
+                latent_size=latent_size,
+                lr=1e-4,
+                n_channels=3,
+                num_classes=args.num_classes,
+                num_encoders=depth,
+                num_heads=max(1, latent_size // 64),
+                num_patches=(args.img_size // args.patch_size) ** 2,
+                patch_size=args.patch_size,
+                weight_decay=3e-2,
+                optimizer_name=optimizer_name,
+            )
+        try:
+            optimizer = model.configure_optimizers()
+        except ValueError as e:
+            print(f"skipping {optimizer_name}: {e}")
+            continue
+        assert isinstance(optimizer, Optimizer)
+        params = [param for param in model.parameters() if param.requires_grad]
+        for param in params:
+            param.grad = torch.randn_like(param)
+
+        # The first step allocates the optimizer state; time the steady state after it.
+        optimizer.step()
+        state_bytes = optimizer_state_bytes(optimizer)
+        step_bytes: int | None = None
+        if device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(device)
+            step_bytes = -torch.cuda.memory_allocated(device)
+        latency = summarize(time_iterations(optimizer.step, args.warmup, args.iters, device))
+        if step_bytes is not None:
+            # Temporaries of the update itself, e.g., the unfused implementations' intermediate tensors.
+            step_bytes += torch.cuda.max_memory_allocated(device)
+
+        record = {
+            "model": model_name,
+            "optimizer": optimizer_name,
+            "latent_size": latent_size,
+            "num_encoders": depth,
+            "num_parameters": sum(param.numel() for param in params),
+            "latency_s": latency,
+            "state_bytes": state_bytes,
+            "step_bytes": step_bytes,
+            "env": env,
+        }
+        if output is not None:
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+        step_mib = "n/a" if step_bytes is None else f"{step_bytes / 2**20:.0f}"
+        print(
+            f"{model_name:>6} {optimizer_name:>13} {latent_size:>6} {depth:>5} {record['num_parameters'] / 1e6:>8.1f} "
+            f"{latency['p50'] * 1e3:>9.2f} {latency['p95'] * 1e3:>9.2f} {state_bytes / 2**20:>9.0f} {step_mib:>9}"
+        )
+        del model, optimizer, params
+
+    if output is not None:
+        output.close()
@@ -0,0 +1,272 @@
+import argparse
+import inspect
+import json
+import logging
+import subprocess
+import sys
+import tempfile
+import tomllib
+from collections.abc import Callable
+from dataclasses import dataclass
+from importlib.resources import files
+from pathlib import Path
+from typing import Any
+
+PERF_PROFILES_FILE = "perf_profiles.toml"
+
+_AUTO = "auto"
+
+# Values accepted by setting functions which take one of a few strings.
+_CHOICES: dict[str, tuple[str, ...]] = {
+    "set_float32_matmul_precision": ("highest", "high", "medium"),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def _resolve_auto(path: str) -> Any:
+    import torch  # noqa: PLC0415
+
+    match path:
+        case "_inductor.config.cuda.arch":
+            if not torch.cuda.is_available():
+                return None
+            major, minor = torch.cuda.get_device_capability()
+            return f"{major}{minor}"
+        case "_inductor.config.cuda.version":
+            return torch.version.cuda
+        case _:
+            raise ValueError(f"{path} does not accept {_AUTO!r}")
+
+
+def _lookup(path: str) -> tuple[Any, str]:
+    """
+    Returns the object holding the attribute at ``path`` (relative to ``torch``) and the attribute's name.
+    """
+    # Imported for the settings under torch._inductor.config, which isn't loaded by `import torch`.
+    import torch._inductor.config  # noqa: PLC0415
+
+    *parents, name = path.split(".")
+    owner: Any = torch
+    for i, part in enumerate(parents):
+        try:
+            owner = getattr(owner, part)
+        except AttributeError:
+            raise ValueError(f"{path}: torch.{'.'.join(parents[: i + 1])} does not exist") from None
+    if not hasattr(owner, name):
+        raise ValueError(f"{path}: torch.{path} does not exist")
+    return owner, name
+
+
+def _check_type(path: str, expected: type, value: Any) -> None:
+    # TOML integers are fine where floats are expected.
+    if not isinstance(value, expected) and not (expected is float and isinstance(value, int)):
+        raise ValueError(f"{path}: expected {expected.__name__}, got {value!r}")
+
+
+def _check_call(path: str, function: Callable[..., Any], value: Any) -> None:
+    """
+    Checks that ``function`` can be called with ``value`` alone, and that ``value`` has the type of the parameter
+    it binds to, when that is annotated with a class.
+    """
+    if path in _CHOICES and value not in _CHOICES[path]:
+        raise ValueError(f"{path}: expected one of {', '.join(_CHOICES[path])}, got {value!r}")
+    try:
+        signature = inspect.signature(function, eval_str=True)
+    except (NameError, TypeError, ValueError):
+        # Builtins without a signature, or annotations which can't be resolved: checked when applied.
+        return
+    try:
+        bound = signature.bind(value)
+    except TypeError:
+        raise ValueError(f"{path}: torch.{path} can't be called with {value!r} alone") from None
+    annotation = signature.parameters[next(iter(bound.arguments))].annotation
+    if isinstance(annotation, type) and annotation is not inspect.Parameter.empty:
+        _check_type(path, annotation, value)
+
+
+@dataclass(frozen=True, kw_only=True)
+class Setting:
+    path: str
+    value: Any
+    apply: Callable[[], None]
+
+
+@dataclass(frozen=True, kw_only=True)
+class PerfProfile:
+    """
+    A named set of PyTorch backend and compiler settings, validated when built and applied as a unit.
+    """
+
+    name: str
+    description: str
+    settings: tuple[Setting, ...]
+
+    @classmethod
+    def from_table(cls, name: str, table: dict[str, Any]) -> "PerfProfile":
+        """
+        Builds a profile from its TOML table, resolving "auto" values and checking that every setting exists and gets
+        a value of the right type, so a bad profile fails before anything is changed.
+        """
+        unknown = set(table) - {"description", "settings"}
+        if unknown:
+            raise ValueError(f"profile {name}: unknown keys {sorted(unknown)}")
+
+        settings: list[Setting] = []
+        errors: list[str] = []
+        for path, raw_value in table.get("settings", {}).items():
+            try:
+                settings.append(cls._setting(path, raw_value))
+            except ValueError as e:
+                errors.append(str(e))
+        if errors:
+            raise ValueError(f"profile {name} is invalid:\n  " + "\n  ".join(errors))
+        return cls(name=name, description=table.get("description", ""), settings=tuple(settings))
+
+    @staticmethod
+    def _setting(path: str, raw_value: Any) -> Setting:
+        value = _resolve_auto(path) if raw_value == _AUTO else raw_value
+        owner, name = _lookup(path)
+        target = getattr(owner, name)
+
+        if callable(target) and not isinstance(target, type):
+            _check_call(path, target, value)
+            return Setting(path=path, value=value, apply=lambda: target(value))
+
+        if target is not None and value is not None:
+            _check_type(path, type(target), value)
+        return Setting(path=path, value=value, apply=lambda: setattr(owner, name, value))
+
+    def apply(self) -> None:
+        for setting in self.settings:
+            setting.apply()
+
+    def effective_settings(self) -> dict[str, Any]:
+        """
+        Returns every setting of the profile with its value after applying it ("auto" resolved, attributes read back).
+        """
+        effective: dict[str, Any] = {}
+        for setting in self.settings:
+            owner, name = _lookup(setting.path)
+            current = getattr(owner, name)
+            effective[setting.path] = setting.value if callable(current) else current
+        return effective
+
+
+def load_perf_profiles(path: str | Path | None = None) -> dict[str, dict[str, Any]]:
+    """
+    Reads the profile tables from ``path``, or from the profiles shipped with the package.
+    """
+    if path is None:
+        text = files("nix_cuda_test").joinpath(PERF_PROFILES_FILE).read_text(encoding="utf-8")
+    else:
+        text = Path(path).read_text(encoding="utf-8")
+    profiles: dict[str, dict[str, Any]] = tomllib.loads(text).get("profiles", {})
+    return profiles
+
+
+def load_perf_profile(name: str, path: str | Path | None = None) -> PerfProfile:
+    profiles = load_perf_profiles(path)
+    if name not in profiles:
+        raise ValueError(f"unknown performance profile {name!r}; available: {', '.join(profiles)}")
+    return PerfProfile.from_table(name, profiles[name])
+
+
+def apply_perf_profile(name: str, path: str | Path | None = None) -> PerfProfile:
+    """
+    Validates and applies the profile called ``name``, logging its effective settings, and resets Dynamo so nothing
+    compiled under earlier settings is reused.
+    """
+    import torch  # noqa: PLC0415
+
+    profile = load_perf_profile(name, path)
+    profile.apply()
+    torch._dynamo.reset()  # type: ignore[no-untyped-call]
+    logger.info("performance profile %s: %s", profile.name, json.dumps(profile.effective_settings(), indent=2))
+    return profile
+
+
+def add_perf_profile_arguments(parser: argparse.ArgumentParser, *, default_help: str) -> None:
+    # The default depends on the device, so it is left to the caller (see default_perf_profile) rather than resolved
+    # here, which would import torch just to build the parser.
+    parser.add_argument(
+        "--perf-profile",
+        type=str,
+        default=None,
+        help=f"performance profile of backend and compiler settings to apply (default : {default_help})",
+    )
+    parser.add_argument(
+        "--perf-profiles",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="TOML file to read performance profiles from (default : the profiles shipped with the package)",
+    )
+
+
+def default_perf_profile() -> str:
+    import torch  # noqa: PLC0415
+
+    return "max-autotune" if torch.cuda.is_available() else "cpu"
+
+
+def add_sweep_profiles_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--profiles",
+        type=str,
+        nargs="+",
+        default=None,
+        help="profiles to compare (default : every profile in the file)",
+    )
+    parser.add_argument(
+        "--perf-profiles",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="TOML file to read performance profiles from (default : the profiles shipped with the package)",
+    )
+    parser.add_argument(
+        "bench_model_args",
+        nargs=argparse.REMAINDER,
+        help="arguments passed on to bench-model, after --",
+    )
+
+
+def sweep_profiles(args: argparse.Namespace) -> None:
+    """
+    Runs bench-model once per profile, each in a fresh process so no global setting or compiled artifact leaks between
+    profiles, and compares throughput.
+    """
+    names = args.profiles or list(load_perf_profiles(args.perf_profiles))
+    for name in names:
+        # Fail on an invalid profile before spending time on the others.
+        load_perf_profile(name, args.perf_profiles)
+
+    bench_model_args = [arg for arg in args.bench_model_args if arg != "--"]
+    results: list[dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            output = Path(tmp) / f"{name}.jsonl"
+            command = [sys.executable, "-m", "nix_cuda_test", "bench-model", "--perf-profile", name]
+            if args.perf_profiles is not None:
+                command += ["--perf-profiles", args.perf_profiles]
+            command += [*bench_model_args, "--output", str(output)]
+            print(f"profile {name}: {' '.join(command)}", flush=True)
+            completed = subprocess.run(command, check=False)
+            if completed.returncode != 0 or not output.exists():
+                print(f"profile {name} failed with exit code {completed.returncode}")
+                continue
+            results.extend(json.loads(line) for line in output.read_text(encoding="utf-8").splitlines())
+
+    print(
+        f"{'profile':>14} {'model':>6} {'mode':>8} {'pass':>16} {'batch':>5} {'p50 ms':>9} {'img/s':>9} {'peak MiB':>9}"
+    )
+    for record in results:
+        prefix = f"{record['perf_profile']:>14} {record['model']:>6} {record['compile']:>8} {record['pass']:>16} "
+        if "oom" in record:
+            print(f"{prefix}{record['batch_size']:>5} ... out of memory")
+            continue
+        print(
+            f"{prefix}{record['batch_size']:>5} {record['latency_s']['p50'] * 1e3:>9.2f} "
+            f"{record['images_per_s']:>9.1f} {record['peak_memory_bytes'] / 2**20:>9.0f}"
+        )
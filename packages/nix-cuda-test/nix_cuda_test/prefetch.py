@@ -0,0 +1,110 @@
+import threading
+from collections.abc import Iterable, Iterator
+from queue import Full, Queue
+from typing import Any, TypeVar
+
+import torch
+from lightning_utilities.core.apply_func import apply_to_collection
+from torch import Tensor
+from torch.utils.data import DataLoader
+
+T = TypeVar("T")
+
+_END = object()
+
+
+def read_ahead(iterable: Iterable[T], depth: int) -> Iterator[T]:
+    """
+    Yields the items of ``iterable``, producing up to ``depth`` of them ahead of the consumer on a background thread.
+
+    The buffer is bounded, so at most ``depth + 1`` items exist at any time (plus the one the consumer holds).
+    Exceptions raised while producing are re-raised in the consumer. Closing the returned generator stops the thread.
+    """
+    queue: Queue[object] = Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item: object) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(e)
+            return
+        put(_END)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while (item := queue.get()) is not _END:
+            if isinstance(item, BaseException):
+                raise item
+            yield item  # type: ignore[misc]
+    finally:
+        stop.set()
+        thread.join()
+
+
+class DevicePrefetcher:
+    """
+    Wraps a DataLoader so batch ``n + 1`` is already on its way to ``device`` while batch ``n`` is in use.
+
+    On CUDA, batches are copied on a side stream and the consuming stream waits on that copy only when it picks up
+    the batch; the copy overlaps with compute when the DataLoader pins memory. Elsewhere, batches are fetched (and
+    moved) on a background thread with a single batch of read-ahead. Either way at most two batches are staged.
+
+    Attributes not defined here (``sampler``, ``dataset``, ...) are forwarded to the wrapped DataLoader so Lightning
+    can still find the sampler to set its epoch.
+    """
+
+    def __init__(self, loader: DataLoader[Any], device: torch.device) -> None:
+        self.loader = loader
+        self.device = device
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes missing from the instance; guard against recursion before __init__ ran.
+        if name == "loader":
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+    def __len__(self) -> int:
+        return len(self.loader)
+
+    def _to_device(self, batch: Any) -> Any:
+        return apply_to_collection(batch, Tensor, lambda tensor: tensor.to(self.device, non_blocking=True))
+
+    def __iter__(self) -> Iterator[Any]:
+        if self.device.type != "cuda":
+            yield from read_ahead(map(self._to_device, self.loader), depth=1)
+            return
+
+        stream = torch.cuda.Stream(self.device)
+        batches = iter(self.loader)
+
+        def stage() -> Any:
+            try:
+                batch = next(batches)
+            except StopIteration:
+                return None
+            with torch.cuda.stream(stream):
+                return self._to_device(batch)
+
+        next_batch = stage()
+        while next_batch is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_stream(stream)
+            batch = next_batch
+            # The tensors were allocated on the side stream; tell the caching allocator they're used on this one too,
+            # so their memory isn't handed out again before the step is done with them.
+            apply_to_collection(batch, Tensor, lambda tensor: tensor.record_stream(current_stream))
+            next_batch = stage()
+            yield batch
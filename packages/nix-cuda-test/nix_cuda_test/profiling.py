@@ -0,0 +1,123 @@
+import math
+import os
+import threading
+from collections.abc import Sequence
+from pathlib import Path
+from types import TracebackType
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def _children_by_pid() -> dict[int, list[int]]:
+    children: dict[int, list[int]] = {}
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # The command name may contain spaces, so split after its closing parenthesis.
+            fields = stat.read_text(encoding="utf-8").rpartition(")")[2].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat.parent.name))
+    return children
+
+
+def _memory_bytes(pid: int) -> int:
+    """
+    Returns the proportional set size (PSS) of ``pid``, falling back to its RSS on kernels without smaps_rollup.
+
+    PSS splits shared pages between the processes sharing them, so summing it over forked DataLoader workers doesn't
+    count the copy-on-write parent memory once per worker.
+    """
+    try:
+        for line in Path(f"/proc/{pid}/smaps_rollup").read_text(encoding="utf-8").splitlines():
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return int(Path(f"/proc/{pid}/statm").read_text(encoding="utf-8").split()[1]) * _PAGE_SIZE
+    except OSError:
+        return 0
+
+
+def process_tree_memory_bytes(pid: int | None = None) -> int:
+    """
+    Returns the memory used by ``pid`` (default: this process) and all of its descendants.
+    """
+    children = _children_by_pid()
+    pending = [os.getpid() if pid is None else pid]
+    total = 0
+    while pending:
+        current = pending.pop()
+        total += _memory_bytes(current)
+        pending.extend(children.get(current, []))
+    return total
+
+
+class PeakMemoryMonitor:
+    """
+    Context manager which samples the memory of this process and its descendants (e.g., DataLoader workers) on a
+    background thread and records the peak.
+
+    Unlike ``ru_maxrss``, the peak covers only the body of the ``with`` statement and includes live child processes.
+    Memory is sampled when entering, every ``interval`` seconds, and when exiting, so a body shorter than ``interval``
+    still gets its start and end compared. Linux only.
+    """
+
+    def __init__(self, interval: float = 0.1) -> None:
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while True:
+            self.peak_bytes = max(self.peak_bytes, process_tree_memory_bytes())
+            if self._stop.wait(self.interval):
+                self.peak_bytes = max(self.peak_bytes, process_tree_memory_bytes())
+                return
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> int:
+        """
+        Stop sampling and return the peak memory in bytes.
+        """
+        self._stop.set()
+        self._thread.join()
+        return self.peak_bytes
+
+    def __enter__(self) -> "PeakMemoryMonitor":
+        self.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.stop()
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """
+    Returns the ``q``-th percentile (0 <= q <= 100) of ``values``, interpolating linearly between closest ranks.
+    """
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    lower = math.floor(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(values: Sequence[float]) -> dict[str, float]:
+    return {
+        "mean": sum(values) / len(values) if values else math.nan,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
@@ -0,0 +1,58 @@
+import itertools
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+# Fields of a phase which includes its batch size, EPOCH:IMG_SIZE:BATCH_SIZE.
+_FIELDS_WITH_BATCH_SIZE = 3
+
+
+@dataclass(frozen=True, kw_only=True)
+class ResolutionPhase:
+    """
+    A phase of progressive-resolution training: from epoch ``start_epoch`` on, images are resized to ``img_size`` and
+    batched by ``batch_size`` (or by the run's batch size, when None).
+
+    Written as ``EPOCH:IMG_SIZE[:BATCH_SIZE]`` so it can be passed on the command line, e.g., ``0:112:256`` followed
+    by ``6:224`` trains six epochs at 112px in batches of 256 and the rest at 224px.
+    """
+
+    start_epoch: int
+    img_size: int
+    batch_size: int | None = None
+
+    @classmethod
+    def parse(cls, spec: str) -> "ResolutionPhase":
+        parts = spec.split(":")
+        if len(parts) not in {2, 3} or not all(part.isdigit() for part in parts) or int(parts[1]) == 0:
+            raise ValueError(f"invalid resolution phase {spec!r}; expected EPOCH:IMG_SIZE or EPOCH:IMG_SIZE:BATCH_SIZE")
+        batch_size = int(parts[2]) if len(parts) == _FIELDS_WITH_BATCH_SIZE else None
+        if batch_size == 0:
+            raise ValueError(f"invalid resolution phase {spec!r}; the batch size must be positive")
+        return cls(start_epoch=int(parts[0]), img_size=int(parts[1]), batch_size=batch_size)
+
+
+def resolution_phase(spec: str) -> str:
+    """
+    Validates a resolution phase given on the command line, keeping it as a string.
+    """
+    ResolutionPhase.parse(spec)
+    return spec
+
+
+def parse_resolution_schedule(specs: Sequence[str]) -> tuple[ResolutionPhase, ...]:
+    """
+    Parses the phases of a schedule, which must start at epoch 0 and in increasing order of epoch.
+    """
+    phases = tuple(ResolutionPhase.parse(spec) for spec in specs)
+    if phases and phases[0].start_epoch != 0:
+        raise ValueError("the first resolution phase must start at epoch 0")
+    if any(earlier.start_epoch >= later.start_epoch for earlier, later in itertools.pairwise(phases)):
+        raise ValueError("resolution phases must start at increasing epochs")
+    return phases
+
+
+def phase_for_epoch(phases: Sequence[ResolutionPhase], epoch: int) -> ResolutionPhase:
+    """
+    Returns the phase ``epoch`` belongs to: the last one which started at or before it.
+    """
+    return [phase for phase in phases if phase.start_epoch <= epoch][-1]
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any
+
+from nix_cuda_test.distributed import STRATEGIES
+
+
+def add_scaling_report_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--world-sizes",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4],
+        help="numbers of processes to train with, the first being the baseline (default : 1 2 4)",
+    )
+    parser.add_argument(
+        "--strategy",
+        choices=[strategy for strategy in STRATEGIES if strategy != "auto"],
+        default="ddp",
+        help="data parallel strategy to scale (default : ddp)",
+    )
+    parser.add_argument(
+        "--accelerator",
+        choices=["cpu", "gpu"],
+        default="cpu",
+        help="train in CPU processes over gloo or on GPUs over NCCL (default : cpu)",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="file to write the report to as JSON (default : none)",
+    )
+    parser.add_argument(
+        "overrides",
+        nargs="*",
+        metavar="SECTION.FIELD=VALUE",
+        help="run config overrides applied to every run, e.g. dist.bucket_cap_mb=50 model.num_encoders=2",
+    )
+
+
+def _run(world_size: int, args: argparse.Namespace, metrics_path: Path) -> dict[str, Any] | None:
+    command = [sys.executable, "-m", "nix_cuda_test", "run", *args.overrides]
+    command += [
+        f"dist.strategy={args.strategy}",
+        f"dist.accelerator={args.accelerator}",
+        f"dist.devices={world_size}",
+        f"dist.process_group_backend={'gloo' if args.accelerator == 'cpu' else 'nccl'}",
+        f'trainer.step_metrics="{metrics_path}"',
+    ]
+    env = dict(os.environ)
+    if args.accelerator == "cpu":
+        # Split the cores between the processes instead of oversubscribing them.
+        env["OMP_NUM_THREADS"] = str(max(1, (os.cpu_count() or 1) // world_size))
+    print(f"world size {world_size}: {' '.join(command)}", flush=True)
+    completed = subprocess.run(command, env=env, check=False)
+    if completed.returncode != 0 or not metrics_path.exists():
+        print(f"world size {world_size} failed with exit code {completed.returncode}")
+        return None
+    epochs: list[dict[str, Any]] = json.loads(metrics_path.read_text(encoding="utf-8"))["epochs"]
+    # The last epoch is the steadiest: workers, caches, and compiled graphs are warm by then.
+    return epochs[-1]["summary"]
+
+
+def scaling_report(args: argparse.Namespace) -> None:
+    """
+    Trains with the chosen data parallel strategy once per world size, each in a fresh process group, and reports how
+    throughput scales.
+
+    Every rank trains on batches of ``data.batch_size`` from its own slice of the data, so per-rank images/s should
+    stay flat and total images/s grow linearly; scaling efficiency is total images/s over the baseline's scaled by the
+    number of processes. Rising ``data_wait_s`` points at the input pipeline, rising ``step_s`` at communication.
+    Exits with an error after the report if any world size failed.
+    """
+    baseline: tuple[int, float] | None = None
+    rows: list[dict[str, Any]] = []
+    failed: list[int] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for world_size in args.world_sizes:
+            summary = _run(world_size, args, Path(tmp) / f"{world_size}.json")
+            if summary is None:
+                failed.append(world_size)
+                continue
+            per_rank = summary["images_per_s"]["p50"]
+            total = per_rank * world_size
+            if baseline is None:
+                baseline = (world_size, total)
+            base_world_size, base_total = baseline
+            rows.append({
+                "world_size": world_size,
+                "images_per_s_per_rank": per_rank,
+                "images_per_s": total,
+                "efficiency": total / (base_total * world_size / base_world_size),
+                "step_s_p50": summary["step_s"]["p50"],
+                "data_wait_s_p50": summary["data_wait_s"]["p50"],
+            })
+
+    print(f"{'ranks':>5} {'img/s/rank':>11} {'img/s':>10} {'efficiency':>10} {'step ms':>9} {'data wait ms':>12}")
+    for row in rows:
+        print(
+            f"{row['world_size']:>5} {row['images_per_s_per_rank']:>11.1f} {row['images_per_s']:>10.1f} "
+            f"{row['efficiency']:>10.1%} {row['step_s_p50'] * 1e3:>9.2f} {row['data_wait_s_p50'] * 1e3:>12.2f}"
+        )
+
+    if args.output is not None:
+        Path(args.output).write_text(json.dumps(rows, indent=2), encoding="utf-8")
+    if failed:
+        sys.exit(f"failed world sizes: {', '.join(map(str, failed))}")
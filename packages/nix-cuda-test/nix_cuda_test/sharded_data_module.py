@@ -0,0 +1,327 @@
+import argparse
+import itertools
+import json
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+import pytorch_lightning as pl
+import torch
+from torch import Tensor
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+from torchvision.datasets import CIFAR10  # pyright: ignore[reportMissingTypeStubs]
+
+from nix_cuda_test.batch_transforms import BatchTransforms
+from nix_cuda_test.loader_config import dataloader_kwargs
+from nix_cuda_test.prefetch import DevicePrefetcher, read_ahead
+from nix_cuda_test.resolution_schedule import ResolutionPhase, phase_for_epoch
+
+MANIFEST_NAME = "manifest.json"
+
+
+def pack_shards(
+    images: npt.NDArray[np.uint8],
+    labels: npt.NDArray[np.int64],
+    out_dir: Path,
+    shard_size: int,
+) -> None:
+    """
+    Packs ``images`` ([N, C, H, W]) and ``labels`` ([N]) into fixed-size shards under ``out_dir``.
+
+    Each shard is a pair of ``.npy`` files; ``manifest.json`` lists the shards in order along with their sizes.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    shards: list[dict[str, Any]] = []
+    for shard_idx, start in enumerate(range(0, len(labels), shard_size)):
+        name = f"shard-{shard_idx:05d}"
+        end = min(start + shard_size, len(labels))
+        np.save(out_dir / f"{name}.images.npy", np.ascontiguousarray(images[start:end]))
+        np.save(out_dir / f"{name}.labels.npy", labels[start:end])
+        shards.append({"name": name, "num_samples": end - start})
+
+    manifest = {
+        "image_shape": list(images.shape[1:]),
+        "num_samples": len(labels),
+        "shards": shards,
+    }
+    (out_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+
+
+def add_pack_shards_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--data-dir", type=str, default="data", help="dataset directory (default : data)")
+    parser.add_argument(
+        "--out-dir",
+        type=str,
+        default="data/cifar-10-shards",
+        help="directory to write the train and val shards to (default : data/cifar-10-shards)",
+    )
+    parser.add_argument("--shard-size", type=int, default=4096, help="samples per shard (default : 4096)")
+
+
+def pack_cifar10_shards(args: argparse.Namespace) -> None:
+    for split, train in [("train", True), ("val", False)]:
+        dataset = CIFAR10(root=args.data_dir, train=train, download=True)
+        pack_shards(
+            images=np.ascontiguousarray(dataset.data.transpose(0, 3, 1, 2)),  # pyright: ignore
+            labels=np.asarray(dataset.targets, dtype=np.int64),  # pyright: ignore
+            out_dir=Path(args.out_dir) / split,
+            shard_size=args.shard_size,
+        )
+
+
+@dataclass(kw_only=True)
+class ShardedDataset(IterableDataset[tuple[Tensor, int]]):
+    """
+    Streams samples from the shards written by ``pack_shards``.
+
+    Every epoch the shard order is permuted with a generator seeded by ``(seed, epoch)``, so all DataLoader workers
+    agree on it; rank ``rank`` of ``world_size`` takes every ``world_size``-th shard, and worker ``i`` of ``n`` every
+    ``n``-th shard of those. With several ranks, only full shards are read, as many as divide evenly between them, so
+    every rank yields the same number of samples. Each worker reads at most ``prefetch_shards`` shards ahead of itself
+    on a background thread and shuffles samples through a buffer of ``shuffle_buffer_size``, so memory use depends on
+    those two settings and not on the size of the dataset. For a fixed number of workers, the order samples are
+    produced in is fully determined by ``seed`` and the epoch.
+
+    That makes an interrupted epoch resumable: after ``resume_after(epoch, batches)``, iterating that epoch skips what
+    the first ``batches`` batches of ``batch_size`` contained. The DataLoader takes batches from its workers in turn,
+    so each worker skips the batches it produced, and the rest of the epoch matches the original run.
+
+    Samples are uint8 images shaped [C, H, W] together with their labels.
+    """
+
+    # Args
+    shard_dir: Path
+    shuffle: bool
+    seed: int = 0
+    shuffle_buffer_size: int = 8192
+    prefetch_shards: int = 2
+    rank: int = 0
+    world_size: int = 1
+    batch_size: int = 1
+
+    # Non-args
+    manifest: dict[str, Any] = field(init=False)
+    # These live in shared memory so that updates reach (persistent) DataLoader workers.
+    epoch: Tensor = field(init=False)
+    # The epoch and number of batches to skip in it, or -1 and 0.
+    resume: Tensor = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.manifest = json.loads((self.shard_dir / MANIFEST_NAME).read_text())
+        self.epoch = torch.zeros((), dtype=torch.int64).share_memory_()
+        self.resume = torch.tensor([-1, 0], dtype=torch.int64).share_memory_()
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch.fill_(epoch)
+
+    def resume_after(self, epoch: int, batches: int) -> None:
+        self.resume.copy_(torch.tensor([epoch, batches]))
+
+    def _skipped_samples(self, epoch: int, worker_id: int, num_workers: int) -> int:
+        resume_epoch, batches = self.resume.tolist()
+        if resume_epoch != epoch or batches <= worker_id:
+            return 0
+        # Batches worker_id, worker_id + num_workers, ... of the first ``batches`` came from this worker.
+        return -(-(batches - worker_id) // num_workers) * self.batch_size
+
+    def _shard_names(self) -> list[str]:
+        shards: list[dict[str, Any]] = self.manifest["shards"]
+        if self.world_size == 1:
+            return [shard["name"] for shard in shards]
+        # Every rank must produce the same number of samples, or the ranks which run out first stop taking part in
+        # the collectives the others are waiting on. Only full shards are used, as many as divide evenly.
+        shard_size = max(shard["num_samples"] for shard in shards)
+        names = [shard["name"] for shard in shards if shard["num_samples"] == shard_size]
+        return names[: len(names) // self.world_size * self.world_size]
+
+    def __len__(self) -> int:
+        if self.world_size == 1:
+            return self.manifest["num_samples"]
+        shard_size = max(shard["num_samples"] for shard in self.manifest["shards"])
+        return len(self._shard_names()) // self.world_size * shard_size
+
+    def _load_shard(self, name: str) -> tuple[npt.NDArray[np.uint8], npt.NDArray[np.int64]]:
+        # Read the whole shard; this is the I/O the background thread overlaps with training.
+        return np.load(self.shard_dir / f"{name}.images.npy"), np.load(self.shard_dir / f"{name}.labels.npy")
+
+    def __iter__(self) -> Iterator[tuple[Tensor, int]]:
+        epoch = int(self.epoch.item())
+        worker_info = get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        samples = self._samples(epoch, worker_id, num_workers)
+        return itertools.islice(samples, self._skipped_samples(epoch, worker_id, num_workers), None)
+
+    def _samples(self, epoch: int, worker_id: int, num_workers: int) -> Iterator[tuple[Tensor, int]]:
+        names = self._shard_names()
+        if self.shuffle:
+            order = np.random.default_rng((self.seed, epoch)).permutation(len(names))
+            names = [names[i] for i in order]
+        names = names[self.rank :: self.world_size][worker_id::num_workers]
+
+        shards = read_ahead((self._load_shard(name) for name in names), depth=self.prefetch_shards)
+        if not self.shuffle:
+            for images, labels in shards:
+                for i in range(len(labels)):
+                    yield torch.from_numpy(images[i]), int(labels[i])
+            return
+
+        rng = np.random.default_rng((self.seed, epoch, self.rank, worker_id))
+        buffer: list[tuple[Tensor, int]] = []
+        for images, labels in shards:
+            for i in rng.permutation(len(labels)):
+                # Copy the image out of the shard: a view would keep the whole shard alive for as long as the sample
+                # sits in the buffer.
+                sample = torch.from_numpy(images[i].copy()), int(labels[i])
+                if len(buffer) < self.shuffle_buffer_size:
+                    buffer.append(sample)
+                    continue
+                j = int(rng.integers(len(buffer)))
+                buffer[j], sample = sample, buffer[j]
+                yield sample
+
+        for i in rng.permutation(len(buffer)):
+            yield buffer[i]
+
+
+class EpochDataLoader(DataLoader[Any]):
+    """
+    DataLoader which tells its ``ShardedDataset`` which epoch is starting each time it is iterated.
+
+    Lightning only forwards epochs to samplers, which iterable datasets don't have.
+    """
+
+    def __init__(self, *args: Any, epoch_fn: Callable[[], int] | None = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.epoch_fn = epoch_fn
+        self.num_iterations = 0
+
+    def __iter__(self) -> Any:
+        dataset = self.dataset
+        if isinstance(dataset, ShardedDataset):
+            dataset.set_epoch(self.num_iterations if self.epoch_fn is None else self.epoch_fn())
+        self.num_iterations += 1
+        return super().__iter__()
+
+
+@dataclass(kw_only=True)
+class ShardedDataModule(pl.LightningDataModule):
+    """
+    Streaming counterpart of ``CIFARDataModule`` for datasets which don't fit in host memory.
+
+    Reads the ``train`` and ``val`` shard directories under ``shard_dir`` (see ``pack_shards``). Samples are raw uint8
+    images, so batch transforms are required to produce model inputs.
+    """
+
+    # Args
+    batch_size: int
+    shard_dir: str
+    drop_last: bool
+    num_workers: int
+    pin_memory: bool
+    train_batch_transforms: BatchTransforms
+    val_batch_transforms: BatchTransforms
+    prefetch_factor: int | None = None
+    persistent_workers: bool = False
+    device_prefetch: bool = False
+    worker_init_fn: Callable[[int], None] | None = None
+    resolution_phases: tuple[ResolutionPhase, ...] = ()
+    seed: int = 0
+    shuffle_buffer_size: int = 8192
+    prefetch_shards: int = 2
+
+    # Non-args
+    train_dataset: ShardedDataset = field(init=False)
+    val_dataset: ShardedDataset = field(init=False)
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+    def setup(self, stage: str | None = None) -> None:
+        rank, world_size = (0, 1) if self.trainer is None else (self.trainer.global_rank, self.trainer.world_size)
+        self.train_dataset = ShardedDataset(
+            shard_dir=Path(self.shard_dir) / "train",
+            shuffle=True,
+            seed=self.seed,
+            shuffle_buffer_size=self.shuffle_buffer_size,
+            prefetch_shards=self.prefetch_shards,
+            rank=rank,
+            world_size=world_size,
+            batch_size=self.batch_size,
+        )
+        self.val_dataset = ShardedDataset(
+            shard_dir=Path(self.shard_dir) / "val",
+            shuffle=False,
+            prefetch_shards=self.prefetch_shards,
+            rank=rank,
+            world_size=world_size,
+        )
+
+    def state_dict(self) -> dict[str, Any]:
+        if self.trainer is None:
+            return {}
+        # Checkpoints are written after a batch's training step, so every processed batch counts as trained on.
+        batches = self.trainer.fit_loop.epoch_loop.batch_progress.current.processed
+        return {"epoch": self.trainer.current_epoch, "batches": batches}
+
+    def load_state_dict(self, state_dict: dict[str, Any]) -> None:
+        # Lightning restores the data module after setup and before it builds the dataloaders.
+        if "epoch" in state_dict:
+            self.train_dataset.resume_after(state_dict["epoch"], state_dict["batches"])
+
+    def _worker_kwargs(self) -> dict[str, Any]:
+        return dataloader_kwargs(
+            num_workers=self.num_workers,
+            pin_memory=self.pin_memory,
+            prefetch_factor=self.prefetch_factor,
+            persistent_workers=self.persistent_workers,
+            worker_init_fn=self.worker_init_fn,
+        )
+
+    def on_after_batch_transfer(self, batch: Any, dataloader_idx: int) -> Any:
+        images, labels = batch
+        training = self.trainer is not None and self.trainer.training
+        transforms = self.train_batch_transforms if training else self.val_batch_transforms
+        return transforms.to(images.device)(images), labels
+
+    def _current_epoch(self) -> int:
+        return 0 if self.trainer is None else self.trainer.current_epoch
+
+    def _apply_resolution_phase(self) -> None:
+        # Lightning rebuilds the dataloaders at every epoch when training on a resolution schedule.
+        if not self.resolution_phases or self.trainer is None:
+            return
+        phase = phase_for_epoch(self.resolution_phases, self.trainer.current_epoch)
+        if phase.batch_size is not None:
+            self.batch_size = self.train_dataset.batch_size = phase.batch_size
+        self.train_batch_transforms.img_size = self.val_batch_transforms.img_size = phase.img_size
+
+    def _maybe_prefetch(self, loader: DataLoader[Any]) -> DataLoader[Any] | DevicePrefetcher:
+        if not self.device_prefetch or self.trainer is None:
+            return loader
+        return DevicePrefetcher(loader, self.trainer.strategy.root_device)
+
+    def train_dataloader(self) -> DataLoader[Any] | DevicePrefetcher:
+        self._apply_resolution_phase()
+        return self._maybe_prefetch(
+            EpochDataLoader(
+                dataset=self.train_dataset,
+                batch_size=self.batch_size,
+                **self._worker_kwargs(),
+                drop_last=self.drop_last,
+                epoch_fn=self._current_epoch if self.trainer is not None else None,
+            )
+        )
+
+    def val_dataloader(self) -> DataLoader[Any] | DevicePrefetcher:
+        self._apply_resolution_phase()
+        return self._maybe_prefetch(
+            EpochDataLoader(
+                dataset=self.val_dataset,
+                batch_size=self.batch_size,
+                **self._worker_kwargs(),
+                drop_last=self.drop_last,
+            )
+        )
@@ -0,0 +1,135 @@
+import argparse
+import json
+import operator
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+# Modules which take seconds to import (and, for Transformer Engine, need CUDA), so only a command that runs a model or
+# a data pipeline may load them.
+HEAVY_MODULES = frozenset({"torch", "pytorch_lightning", "lightning_fabric", "torchvision", "transformer_engine"})
+
+# A line of `python -X importtime` output: self and cumulative microseconds, then the module name indented by depth.
+_IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+
+def parse_import_times(stderr: str) -> list[dict[str, Any]]:
+    """
+    Parses the output of ``python -X importtime`` into one record per imported module, with its self and cumulative
+    import time in milliseconds and its nesting depth (0 for modules imported by the program itself).
+    """
+    records: list[dict[str, Any]] = []
+    for line in stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        records.append({
+            "module": module,
+            "self_ms": int(self_us) / 1e3,
+            "cumulative_ms": int(cumulative_us) / 1e3,
+            "depth": len(indent) // 2,
+        })
+    return records
+
+
+def heavy_imports(imports: list[dict[str, Any]]) -> list[str]:
+    """
+    Returns the ``HEAVY_MODULES`` among the packages of the records from ``parse_import_times``.
+    """
+    return sorted({record["module"].partition(".")[0] for record in imports} & HEAVY_MODULES)
+
+
+def add_bench_startup_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--commands",
+        nargs="+",
+        default=["train", "run", "warm-compile-cache", "find-batch-size", "scaling-report"],
+        help=(
+            "commands whose --help to time; the benchmarks define their arguments next to their implementation and "
+            "so import PyTorch (default : train run warm-compile-cache find-batch-size scaling-report)"
+        ),
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="runs per command, keeping the fastest (default : 3)",
+    )
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=1000.0,
+        help="wall time a command's --help may take (default : 1000)",
+    )
+    parser.add_argument("--top", type=int, default=5, help="heaviest imports to list per command (default : 5)")
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="file to write the results to as JSON (default : none)",
+    )
+
+
+def time_command(command: str) -> tuple[float, list[dict[str, Any]]]:
+    """
+    Runs ``command --help`` in a fresh interpreter under ``-X importtime``, returning its wall time in milliseconds
+    and its imports (see ``parse_import_times``).
+    """
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "nix_cuda_test", command, "--help"],
+        capture_output=True,
+        check=False,
+        text=True,
+    )
+    wall_ms = (time.perf_counter() - start) * 1e3
+    if completed.returncode != 0:
+        raise RuntimeError(f"`{command} --help` failed with exit code {completed.returncode}:\n{completed.stderr}")
+    return wall_ms, parse_import_times(completed.stderr)
+
+
+def bench_startup(args: argparse.Namespace) -> None:
+    """
+    Runs ``--help`` of each command in a fresh interpreter under ``-X importtime`` and reports the wall time and the
+    heaviest imports.
+
+    Parsing the command line is all a sweep job does before its first failure or its first step, so it must not import
+    PyTorch, Lightning, or Transformer Engine. Exits with an error if a command is over ``--budget-ms`` or imports any
+    of them, so it can gate CI.
+    """
+    results: list[dict[str, Any]] = []
+    failures: list[str] = []
+    for command in args.commands:
+        runs = [time_command(command) for _ in range(args.repeats)]
+        wall_ms, imports = min(runs, key=operator.itemgetter(0))
+        heavy = heavy_imports(imports)
+        top_level = sorted(
+            (record for record in imports if record["depth"] == 0),
+            key=operator.itemgetter("cumulative_ms"),
+            reverse=True,
+        )
+        results.append({
+            "command": command,
+            "wall_ms": wall_ms,
+            "import_ms": sum(record["cumulative_ms"] for record in top_level),
+            "heavy_modules": heavy,
+            "top_imports": top_level[: args.top],
+        })
+
+        print(f"{command}: {wall_ms:.0f} ms wall, {results[-1]['import_ms']:.0f} ms importing")
+        for record in top_level[: args.top]:
+            print(f"  {record['cumulative_ms']:>8.1f} ms  {record['module']}")
+        if wall_ms > args.budget_ms:
+            failures.append(f"{command} took {wall_ms:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+        if heavy:
+            failures.append(f"{command} imported {', '.join(heavy)}")
+
+    if args.output is not None:
+        Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    if failures:
+        sys.exit("\n".join(failures))
@@ -0,0 +1,179 @@
+import csv
+import json
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import pytorch_lightning as pl
+import torch
+from torch import Tensor
+from torch.optim.optimizer import Optimizer
+
+from nix_cuda_test.profiling import PeakMemoryMonitor, summarize
+
+METRICS = (
+    "data_wait_s",
+    "forward_s",
+    "backward_s",
+    "optimizer_s",
+    "step_s",
+    "images_per_s",
+    "tokens_per_s",
+    "peak_memory_bytes",
+)
+
+
+@dataclass(kw_only=True)
+class StepMetrics(pl.Callback):
+    """
+    Records timings and throughput for every training step and reports percentiles per epoch.
+
+    For each step:
+
+    - ``data_wait_s``: from the end of the previous step (or the start of the epoch) to the start of this one, i.e.,
+      time spent waiting on the DataLoader and the host-to-device copy
+    - ``forward_s``, ``backward_s``, ``optimizer_s``: time in the training step, the backward pass, and the optimizer
+      step (including gradient clipping and the precision plugin's bookkeeping)
+    - ``step_s``, ``images_per_s``, ``tokens_per_s``: wall time of the step and the resulting throughput, counting
+      the tokens the encoder actually saw (fewer at a lower resolution or when dropping tokens), as reported by the
+      model's ``train_sequence_length``
+    - ``peak_memory_bytes``: peak CUDA memory allocated during the step or, on CPU, the peak memory of the process and
+      its DataLoader workers sampled during the step (see ``PeakMemoryMonitor``)
+
+    At the end of each epoch the mean, p50, p95, and p99 of every metric are logged and, when ``output_path`` is set,
+    written to it (as CSV if it ends in ``.csv``, otherwise as JSON including the per-step records). The median
+    ``images_per_s`` is also shown in the progress bar.
+
+    CUDA work is asynchronous, so with ``synchronize`` (the default) the device is synchronized at every boundary to
+    attribute time correctly; this costs a little throughput.
+    """
+
+    # Args
+    output_path: str | None = None
+    synchronize: bool = True
+
+    # Non-args
+    epochs: list[dict[str, Any]] = field(init=False, default_factory=list)
+    steps: list[dict[str, float]] = field(init=False, default_factory=list)
+    marks: dict[str, float] = field(init=False, default_factory=dict)
+    last_step_end: float = field(init=False, default=0.0)
+    memory_monitor: PeakMemoryMonitor | None = field(init=False, default=None)
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+    def _now(self, pl_module: pl.LightningModule) -> float:
+        if self.synchronize and pl_module.device.type == "cuda":
+            torch.cuda.synchronize(pl_module.device)
+        return time.perf_counter()
+
+    def on_train_epoch_start(self, trainer: pl.Trainer, pl_module: pl.LightningModule) -> None:
+        self.steps = []
+        self.last_step_end = self._now(pl_module)
+
+    def on_train_batch_start(
+        self,
+        trainer: pl.Trainer,
+        pl_module: pl.LightningModule,
+        batch: Any,
+        batch_idx: int,
+    ) -> None:
+        if pl_module.device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(pl_module.device)
+        else:
+            self.memory_monitor = PeakMemoryMonitor(interval=0.01)
+            self.memory_monitor.start()
+        self.marks = {"start": self._now(pl_module)}
+
+    def on_before_backward(self, trainer: pl.Trainer, pl_module: pl.LightningModule, loss: Tensor) -> None:
+        self.marks["backward"] = self._now(pl_module)
+
+    def on_after_backward(self, trainer: pl.Trainer, pl_module: pl.LightningModule) -> None:
+        self.marks["after_backward"] = self._now(pl_module)
+
+    def on_before_optimizer_step(
+        self,
+        trainer: pl.Trainer,
+        pl_module: pl.LightningModule,
+        optimizer: Optimizer,
+    ) -> None:
+        self.marks["optimizer"] = self._now(pl_module)
+
+    def on_train_batch_end(
+        self,
+        trainer: pl.Trainer,
+        pl_module: pl.LightningModule,
+        outputs: Any,
+        batch: Any,
+        batch_idx: int,
+    ) -> None:
+        end = self._now(pl_module)
+        start = self.marks["start"]
+        backward = self.marks.get("backward", end)
+        after_backward = self.marks.get("after_backward", backward)
+        # No optimizer step happens while gradients are being accumulated.
+        optimizer = self.marks.get("optimizer", end)
+
+        images: Tensor = batch[0]
+        num_images = images.size(0)
+        train_sequence_length = getattr(pl_module, "train_sequence_length", None)
+        num_tokens = float("nan") if train_sequence_length is None else num_images * train_sequence_length(images)
+        step_s = end - start
+        if self.memory_monitor is None:
+            peak_memory_bytes = torch.cuda.max_memory_allocated(pl_module.device)
+        else:
+            peak_memory_bytes = self.memory_monitor.stop()
+            self.memory_monitor = None
+
+        self.steps.append({
+            "data_wait_s": start - self.last_step_end,
+            "forward_s": backward - start,
+            "backward_s": after_backward - backward,
+            "optimizer_s": end - optimizer,
+            "step_s": step_s,
+            "images_per_s": num_images / step_s,
+            "tokens_per_s": num_tokens / step_s,
+            "peak_memory_bytes": float(peak_memory_bytes),
+        })
+        self.last_step_end = end
+
+    def on_train_epoch_end(self, trainer: pl.Trainer, pl_module: pl.LightningModule) -> None:
+        if not self.steps:
+            return
+
+        summary = {metric: summarize([step[metric] for step in self.steps]) for metric in METRICS}
+        self.epochs.append({
+            "epoch": trainer.current_epoch,
+            "num_steps": len(self.steps),
+            "summary": summary,
+            "steps": self.steps,
+        })
+        for metric in ("data_wait_s", "step_s", "images_per_s", "tokens_per_s"):
+            for stat in ("p50", "p95", "p99"):
+                pl_module.log(f"step_metrics/{metric}_{stat}", summary[metric][stat], rank_zero_only=True)
+        pl_module.log("images_per_s", summary["images_per_s"]["p50"], prog_bar=True, rank_zero_only=True)
+
+        if self.output_path is not None and trainer.is_global_zero:
+            self.write(Path(self.output_path))
+
+    def write(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix != ".csv":
+            path.write_text(json.dumps({"epochs": self.epochs}, indent=2), encoding="utf-8")
+            return
+
+        with path.open("w", encoding="utf-8", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["epoch", "num_steps", "metric", "mean", "p50", "p95", "p99"])
+            for epoch in self.epochs:
+                for metric, stats in epoch["summary"].items():
+                    writer.writerow([
+                        epoch["epoch"],
+                        epoch["num_steps"],
+                        metric,
+                        stats["mean"],
+                        stats["p50"],
+                        stats["p95"],
+                        stats["p99"],
+                    ])
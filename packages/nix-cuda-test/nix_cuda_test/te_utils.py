@@ -1,3 +1,4 @@
+import functools
 from dataclasses import dataclass, field
 
 import pytorch_lightning as pl
@@ -6,6 +7,40 @@ import transformer_engine.pytorch as te
 import transformer_engine.pytorch.jit as te_jit
 from torch import Tensor, nn
 
+from nix_cuda_test.checkpointing import CheckpointPolicy
+from nix_cuda_test.layer_checkpointing import estimate_layer_activation_bytes, run_layers
+from nix_cuda_test.models import TokenDropMode
+from nix_cuda_test.utils import drop_tokens, embed_patches, resize_pos_embedding
+
+
+@te_jit.no_torch_dynamo(recursive=True)
+def _te_checkpoint(layer: nn.Module, x: Tensor) -> Tensor:
+    # TE's checkpoint keeps the FP8 scaling state and RNG state consistent between the forward pass and the
+    # recomputation; like the layers themselves, it's kept out of Dynamo's way.
+    out: Tensor = te.checkpoint(layer, x)  # pyright: ignore
+    return out
+
+
+def _class_token_only_forward(layer: te.TransformerLayer, hidden_states: Tensor) -> Tensor:
+    """
+    Runs ``layer`` as ``te.TransformerLayer.forward`` does for the encoder layers of ``TEEncoderStack`` (pre-norm, no
+    mask, sequential attention and MLP), but keeps only the class token once attention is done, so the residual adds,
+    the MLP's layer norm, and the MLP itself only cover it: [B, 1+num_patches, latent_size] -> [B, 1, latent_size].
+
+    TE fuses the layer norm into the QKV projection, with no way to project only some of the queries, so attention
+    itself still runs over every token.
+    """
+    hidden_states = hidden_states.contiguous()
+    if torch.is_autocast_enabled():
+        hidden_states = hidden_states.to(torch.get_autocast_dtype("cuda"))
+    attention_output, attention_bias = layer.self_attention(hidden_states)
+    class_token = layer._bias_dropout_add(  # pyright: ignore[reportPrivateUsage]
+        attention_output[:, :1], attention_bias, hidden_states[:, :1], layer.drop_path
+    )
+    mlp_output, mlp_bias = layer.layernorm_mlp(class_token)
+    output: Tensor = layer._bias_dropout_add(mlp_output, mlp_bias, class_token, layer.drop_path)  # pyright: ignore
+    return output
+
 
 @dataclass(kw_only=True, eq=False)
 class TEInputEmbedding(pl.LightningModule):
@@ -14,6 +49,8 @@ class TEInputEmbedding(pl.LightningModule):
     n_channels: int
     num_patches: int
     patch_size: int
+    fused: bool = True  # Use embed_patches instead of the reference Unfold path
+    token_drop: TokenDropMode = "random"  # See drop_tokens
 
     # Non-args
     class_token: nn.Parameter = field(init=False)
@@ -21,6 +58,8 @@ class TEInputEmbedding(pl.LightningModule):
     linear_proj: te.Linear = field(init=False)
     pos_embedding: nn.Parameter = field(init=False)
     unfold: nn.Unfold = field(init=False)
+    # Share of the patch tokens kept in training; set every epoch from the model's schedule.
+    token_keep_ratio: float = field(init=False, default=1.0)
 
     def __post_init__(self) -> None:
         super().__init__()
@@ -44,7 +83,25 @@ class TEInputEmbedding(pl.LightningModule):
         )
 
     def forward(self, input_data: Tensor) -> Tensor:
-        # input_data: [B, C, H, W]
+        embeddings = self.embed(input_data)  # -> [B, 1+num_patches, latent_size]
+        # Evaluation always sees every token.
+        if self.training and self.token_keep_ratio < 1.0:
+            embeddings = drop_tokens(embeddings, self.token_keep_ratio, self.token_drop)
+        return embeddings
+
+    def embed(self, input_data: Tensor) -> Tensor:
+        # input_data: [B, C, H, W], at any resolution; the positional embedding is resampled to its grid of patches.
+        H, W = input_data.shape[-2:]
+        pos_embedding = resize_pos_embedding(self.pos_embedding, (H // self.patch_size, W // self.patch_size))
+        if self.fused:
+            return embed_patches(
+                input_data,
+                patch_size=self.patch_size,
+                linear_proj=self.linear_proj,
+                class_token=self.class_token,
+                pos_embedding=pos_embedding,
+            )  # -> [B, 1+num_patches, latent_size]
+
         B = input_data.size(0)
 
         # 1) Patchify
@@ -59,7 +116,7 @@ class TEInputEmbedding(pl.LightningModule):
         embeddings = torch.cat([class_token, embeddings], dim=1)  # -> [B, 1+num_patches, latent_size]
 
         # 4) Add positional embedding
-        embeddings += self.pos_embedding[:, : embeddings.size(1), :]  # -> [B, 1+num_patches, latent_size]
+        embeddings += pos_embedding[:, : embeddings.size(1), :]  # -> [B, 1+num_patches, latent_size]
 
         return embeddings
 
@@ -71,12 +128,16 @@ class TEEncoderStack(pl.LightningModule):
     latent_size: int
     num_heads: int
     num_encoders: int
+    checkpoint_policy: str = "none"  # See CheckpointPolicy
+    class_token_only_last_layer: bool = False  # See _class_token_only_forward
 
     # Non-args
     module: nn.Module = field(init=False)
+    policy: CheckpointPolicy = field(init=False)
 
     def __post_init__(self) -> None:
         super().__init__()
+        self.policy = CheckpointPolicy.parse(self.checkpoint_policy)
         monkey_patched_layers = []
         for layer_number in range(self.num_encoders):
             layer = te.TransformerLayer(
@@ -98,7 +159,12 @@ class TEEncoderStack(pl.LightningModule):
                 drop_path_rate=self.dropout,  # Stochastic depth
                 layer_number=layer_number + 1,  # Must be positive integer
             )
-            layer.forward = te_jit.no_torch_dynamo(recursive=True)(layer.forward)  # pyright: ignore
+            forward = layer.forward
+            if self.class_token_only_last_layer and layer_number == self.num_encoders - 1:
+                # Replacing forward rather than calling the function from the stack keeps the layer's hooks, e.g.,
+                # FSDP's.
+                forward = functools.partial(_class_token_only_forward, layer)
+            layer.forward = te_jit.no_torch_dynamo(recursive=True)(forward)  # pyright: ignore
             monkey_patched_layers.append(layer)
 
         self.module = nn.Sequential(*monkey_patched_layers)
@@ -106,4 +172,17 @@ class TEEncoderStack(pl.LightningModule):
     def forward(self, emb_patches: Tensor) -> Tensor:
         # emb_patches: [B, 1+num_patches, latent_size]
         # Run through the encoders and then take the class token
-        return self.module(emb_patches)[:, 0]  # -> shape: [B, latent_size]
+        checkpointed = self.policy.layers(
+            num_layers=self.num_encoders,
+            # TE uses fused attention kernels, which don't keep the attention matrix.
+            layer_bytes=estimate_layer_activation_bytes(emb_patches, self.num_heads, attention_matrix=False),
+            input_bytes=emb_patches.numel() * emb_patches.element_size(),
+        )
+        layers = list(self.module)
+        if not self.class_token_only_last_layer:
+            return run_layers(layers, emb_patches, checkpointed, _te_checkpoint)[:, 0]  # -> [B, latent_size]
+
+        # The last layer only computes the class token, so it keeps little for the backward pass and is never
+        # checkpointed.
+        x = run_layers(layers[:-1], emb_patches, checkpointed, _te_checkpoint)
+        return layers[-1](x)[:, 0]  # -> [B, latent_size]
@@ -3,6 +3,7 @@ from dataclasses import dataclass, field
 import pytorch_lightning as pl
 from torch import Tensor, nn
 
+from nix_cuda_test.models import TokenDropMode
 from nix_cuda_test.te_utils import TEEncoderStack, TEInputEmbedding
 
 
@@ -17,6 +18,9 @@ class TEViT(pl.LightningModule):
     num_heads: int
     num_patches: int
     patch_size: int
+    checkpoint_policy: str = "none"
+    class_token_only_last_layer: bool = False
+    token_drop: TokenDropMode = "random"
 
     # Non-args
     module: nn.Module = field(init=False)
@@ -29,12 +33,15 @@ class TEViT(pl.LightningModule):
                 n_channels=self.n_channels,
                 num_patches=self.num_patches,
                 patch_size=self.patch_size,
+                token_drop=self.token_drop,
             ),
             TEEncoderStack(
                 dropout=self.dropout,
                 latent_size=self.latent_size,
                 num_heads=self.num_heads,
                 num_encoders=self.num_encoders,
+                checkpoint_policy=self.checkpoint_policy,
+                class_token_only_last_layer=self.class_token_only_last_layer,
             ),
             # Classifier
             nn.Linear(
@@ -43,5 +50,12 @@ class TEViT(pl.LightningModule):
             ),
         )
 
+    def set_token_keep_ratio(self, ratio: float) -> None:
+        """
+        Sets the share of patch tokens the embedding keeps in training; evaluation always uses every token.
+        """
+        embedding: TEInputEmbedding = self.module[0]  # type: ignore[assignment]
+        embedding.token_keep_ratio = ratio
+
     def forward(self, test_input: Tensor) -> Tensor:
         return self.module(test_input)
@@ -0,0 +1,325 @@
+import argparse
+import dataclasses
+import json
+import logging
+from pathlib import Path
+
+import torch
+from pytorch_lightning.callbacks import Callback, ModelCheckpoint
+from pytorch_lightning.plugins import Precision
+from pytorch_lightning.trainer.trainer import Trainer
+from torchvision.transforms import Compose, Resize, ToTensor  # type: ignore[import]
+
+from nix_cuda_test.async_checkpoint import AsyncCheckpointIO
+from nix_cuda_test.batch_size_finder import find_batch_size
+from nix_cuda_test.batch_transforms import CIFAR10_MEAN, CIFAR10_STD, BatchTransforms
+from nix_cuda_test.cifar_data_module import CIFARDataModule
+from nix_cuda_test.compile_cache import compile_cache_key, use_compile_cache
+from nix_cuda_test.config import DataConfig, RunConfig, run_configs_from_args
+from nix_cuda_test.cpu_tuning import NumaWorkerPinning, configure_threads
+from nix_cuda_test.distributed import SHARDED_STRATEGIES, build_strategy, world_size
+from nix_cuda_test.loader_config import LoaderConfig
+from nix_cuda_test.models import build_model, encoder_layer_class
+from nix_cuda_test.perf_profiles import apply_perf_profile
+from nix_cuda_test.resolution_schedule import parse_resolution_schedule
+from nix_cuda_test.sharded_data_module import ShardedDataModule
+from nix_cuda_test.step_metrics import StepMetrics
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_loader_config(data: DataConfig) -> LoaderConfig:
+    if Path(data.loader_config).exists():
+        config = LoaderConfig.load(data.loader_config)
+    else:
+        # Without per-sample resizing, workers only decode and collate 32x32 uint8 images, so a handful of them is
+        # plenty.
+        config = LoaderConfig(
+            num_workers=4 if data.batch_transforms else 32,
+            pin_memory=False,
+            persistent_workers=True,
+        )
+
+    overrides = {
+        name: getattr(data, name)
+        for name in ("num_workers", "pin_memory", "prefetch_factor", "persistent_workers")
+        if getattr(data, name) is not None
+    }
+    return dataclasses.replace(config, **overrides)
+
+
+def build_data_module(
+    config: RunConfig,
+    loader_config: LoaderConfig,
+) -> CIFARDataModule | ShardedDataModule:
+    data, img_size = config.data, config.model.img_size
+    # With batch transforms, per-sample transforms are only needed to fill the cache; otherwise the workers just hand
+    # over uint8 images.
+    transforms = (
+        None
+        if data.batch_transforms and not data.cache_data
+        else Compose([
+            Resize(size=(img_size, img_size), antialias=True),  # type: ignore[assignment]
+            ToTensor(),
+        ])
+    )
+
+    train_batch_transforms: BatchTransforms | None = None
+    val_batch_transforms: BatchTransforms | None = None
+    if data.batch_transforms:
+        mean, std = (CIFAR10_MEAN, CIFAR10_STD) if data.normalize else (None, None)
+        train_batch_transforms = BatchTransforms(
+            img_size=img_size,
+            hflip_prob=0.5 if data.random_flip else 0.0,
+            mean=mean,
+            std=std,
+        )
+        val_batch_transforms = BatchTransforms(img_size=img_size, mean=mean, std=std)
+
+    worker_init_fn = NumaWorkerPinning.for_current_process() if data.numa_pinning else None
+    resolution_phases = tuple(
+        dataclasses.replace(phase, batch_size=phase.batch_size or data.batch_size)
+        for phase in parse_resolution_schedule(config.trainer.resolution_schedule)
+    )
+
+    if data.shard_dir is not None:
+        assert train_batch_transforms is not None and val_batch_transforms is not None
+        return ShardedDataModule(
+            batch_size=data.batch_size,
+            device_prefetch=data.device_prefetch,
+            drop_last=True,
+            num_workers=loader_config.num_workers,
+            persistent_workers=loader_config.persistent_workers,
+            pin_memory=loader_config.pin_memory,
+            prefetch_factor=loader_config.prefetch_factor,
+            shard_dir=data.shard_dir,
+            train_batch_transforms=train_batch_transforms,
+            val_batch_transforms=val_batch_transforms,
+            worker_init_fn=worker_init_fn,
+            resolution_phases=resolution_phases,
+        )
+
+    return CIFARDataModule(
+        batch_sampling=data.batch_sampling,
+        batch_size=data.batch_size,
+        cache=data.cache_data,
+        data_dir="data",
+        device_prefetch=data.device_prefetch,
+        drop_last=True,
+        num_workers=loader_config.num_workers,
+        persistent_workers=loader_config.persistent_workers,
+        pin_memory=loader_config.pin_memory,
+        prefetch_factor=loader_config.prefetch_factor,
+        train_batch_transforms=train_batch_transforms,
+        train_transforms=transforms,
+        val_batch_transforms=val_batch_transforms,
+        val_transforms=transforms,
+        worker_init_fn=worker_init_fn,
+        resolution_phases=resolution_phases,
+    )
+
+
+def _precision(config: RunConfig) -> tuple[list[Precision], str | None]:
+    """
+    Returns the precision plugins and precision flag for the Trainer.
+
+    Transformer Engine's precision plugin can't be combined with the sharded strategies, which need their own; TE
+    layers then run under plain BF16 autocast. Transformer Engine is only imported for the te-vit model.
+    """
+    if config.model.name == "te-vit" and config.dist.strategy not in SHARDED_STRATEGIES:
+        from pytorch_lightning.plugins import TransformerEnginePrecision  # noqa: PLC0415
+        from transformer_engine.common.recipe import DelayedScaling  # noqa: PLC0415
+
+        precision = TransformerEnginePrecision(
+            weights_dtype=torch.bfloat16,
+            # NOTE: Both of these require Hopper or newer.
+            recipe=DelayedScaling(
+                fp8_dpa=False,
+                fp8_mha=False,
+            ),
+            replace_layers=True,
+        )
+        return [precision], None
+
+    # On the CPU, bf16-mixed runs under CPU autocast, which pays off on cores with native BF16 (AVX512-BF16, AMX).
+    return [], "bf16-mixed" if _on_cuda(config) else config.perf.cpu_precision
+
+
+def _on_cuda(config: RunConfig) -> bool:
+    return config.dist.accelerator != "cpu" and torch.cuda.is_available()
+
+
+def _callbacks(config: RunConfig) -> list[Callback]:
+    callbacks: list[Callback] = []
+    # Timing steps on the CPU needs no synchronization, so throughput is always reported there.
+    if config.trainer.step_metrics is not None or not _on_cuda(config):
+        callbacks.append(StepMetrics(output_path=config.trainer.step_metrics))
+    if config.trainer.checkpoint_every_n_steps is not None:
+        callbacks.append(ModelCheckpoint(every_n_train_steps=config.trainer.checkpoint_every_n_steps))
+    return callbacks
+
+
+def train(
+    config: RunConfig,
+    *,
+    fast_dev_run: int | bool = False,
+    data_module: CIFARDataModule | ShardedDataModule | None = None,
+) -> None:
+    """
+    Trains the model described by ``config``. Pass ``data_module`` to reuse one built by an earlier run with the same
+    data settings.
+    """
+    from lightning_fabric.fabric import Fabric  # noqa: PLC0415
+
+    Fabric.seed_everything(42, workers=True)
+    configure_threads(config.perf.intra_op_threads, config.perf.inter_op_threads)
+
+    perf_profile = apply_perf_profile(config.perf.perf_profile, config.perf.perf_profiles)
+
+    # te_attention._log_level = 2
+    # te_attention.fa_logger.setLevel(logging.DEBUG)
+
+    if data_module is None:
+        data_module = build_data_module(config, resolve_loader_config(config.data))
+
+    plugins, precision = _precision(config)
+    checkpoint_io = AsyncCheckpointIO() if config.trainer.async_checkpoint else None
+    layer_class = encoder_layer_class(config.model.name)
+    dist = config.dist
+    trainer = Trainer(
+        accelerator=dist.accelerator,
+        accumulate_grad_batches=1,
+        benchmark=True,
+        deterministic=False,
+        devices=dist.devices,
+        num_nodes=dist.num_nodes,
+        callbacks=_callbacks(config),
+        max_epochs=config.trainer.epochs,
+        plugins=plugins if checkpoint_io is None else [*plugins, checkpoint_io],
+        precision=precision,
+        strategy=build_strategy(
+            dist.strategy,
+            world_size=world_size(accelerator=dist.accelerator, devices=dist.devices, num_nodes=dist.num_nodes),
+            process_group_backend=dist.process_group_backend,
+            bucket_cap_mb=dist.bucket_cap_mb,
+            gradient_as_bucket_view=dist.gradient_as_bucket_view,
+            static_graph=dist.static_graph,
+            comm_hook=dist.comm_hook,
+            powersgd_rank=dist.powersgd_rank,
+            powersgd_start_iter=dist.powersgd_start_iter,
+            layer_class=layer_class,
+        ),
+        # The data modules shard the data across ranks themselves.
+        use_distributed_sampler=False,
+        profiler=config.trainer.profiler,
+        # The data module picks the image and batch size of each epoch's resolution phase when building dataloaders.
+        reload_dataloaders_every_n_epochs=1 if config.trainer.resolution_schedule else 0,
+        fast_dev_run=fast_dev_run,
+    )
+    if trainer.logger is not None:
+        trainer.logger.log_hyperparams({
+            "run_config": config.model_dump(),
+            "perf_profile": perf_profile.name,
+            **{f"perf/{path}": value for path, value in perf_profile.effective_settings().items()},
+        })
+
+    # init the model directly on the device and with parameters in half-precision
+    with trainer.init_module():
+        model = build_model(
+            config.model.name,
+            dropout=config.model.dropout,
+            latent_size=config.model.latent_size,
+            lr=config.trainer.lr,
+            n_channels=config.model.n_channels,
+            num_classes=config.model.num_classes,
+            num_encoders=config.model.num_encoders,
+            num_heads=config.model.num_heads,
+            num_patches=config.model.num_patches,
+            patch_size=config.model.patch_size,
+            weight_decay=config.trainer.weight_decay,
+            optimizer_name=config.trainer.optimizer,
+            checkpoint_policy=config.model.activation_checkpointing,
+            class_token_only_last_layer=config.model.class_token_only_last_layer,
+            token_keep_ratios=config.model.token_keep_ratios,
+            token_drop=config.model.token_drop,
+        )
+
+        # NOTE: didn't see a performance improvement with `fuse_wgrad_accumulation` on the 4090.
+        # Did see a large decrease in training and validation accuracy.
+
+    if checkpoint_io is not None:
+        checkpoint_io.shard_by_layer(model, layer_class)
+
+    if config.perf.compile:
+        if config.perf.compile_cache_dir:
+            entry = use_compile_cache(
+                config.perf.compile_cache_dir,
+                compile_cache_key(config.model.name, dict(model.hparams), precision=str(trainer.precision)),
+                max_bytes=config.perf.compile_cache_size,
+            )
+            logger.info("using compile cache %s", entry)
+        num_phases = len(config.trainer.resolution_schedule)
+        if num_phases > 1:
+            # Compile one static graph per input shape (phase, and keep ratio in training) rather than switching to a
+            # dynamic-shape graph at the first change, and keep all of them cached: each is traced once per run and
+            # reused from the compile cache by the next.
+            num_graphs = num_phases * (len(set(config.model.token_keep_ratios)) + 1)
+            torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, num_graphs)
+            model = torch.compile(model, dynamic=False)  # type: ignore[assignment]
+        else:
+            model = torch.compile(model)  # type: ignore[assignment]
+
+    trainer.fit(
+        datamodule=data_module,
+        model=model,  # type: ignore[arg-type]
+        ckpt_path=config.trainer.resume_from,
+    )
+
+
+def with_auto_batch_size(parser: argparse.ArgumentParser, config: RunConfig) -> RunConfig:
+    if not config.trainer.auto_batch_size:
+        return config
+    if config.trainer.memory_budget is None and not _on_cuda(config):
+        parser.error("auto_batch_size requires memory_budget when not running on CUDA")
+    batch_size = find_batch_size(config)
+    if batch_size == 0:
+        parser.error("not even a batch of one fits in memory_budget")
+    return config.model_copy(update={"data": config.data.model_copy(update={"batch_size": batch_size})})
+
+
+def with_step_metrics_suffix(config: RunConfig, run_index: int) -> RunConfig:
+    """
+    Suffixes ``trainer.step_metrics`` with the 1-based ``run_index`` of a sweep point (``metrics.json`` becomes
+    ``metrics-run2.json``), so the runs of a sweep don't overwrite each other's metrics.
+    """
+    if config.trainer.step_metrics is None:
+        return config
+    path = Path(config.trainer.step_metrics)
+    step_metrics = str(path.with_stem(f"{path.stem}-run{run_index}"))
+    return config.model_copy(update={"trainer": config.trainer.model_copy(update={"step_metrics": step_metrics})})
+
+
+def run(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    """
+    Trains every config of a sweep in turn, in this process. Runs with the same data settings share a data module, so
+    the datasets (and the memory-mapped cache, when enabled) are loaded once. Each run writes its step metrics to its
+    own file.
+    """
+    try:
+        configs = run_configs_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if len(configs) > 1:
+        configs = [with_step_metrics_suffix(config, i + 1) for i, config in enumerate(configs)]
+
+    data_modules: dict[str, CIFARDataModule | ShardedDataModule] = {}
+    for i, swept_config in enumerate(configs):
+        print(f"run {i + 1}/{len(configs)}: {swept_config.model_dump_json()}", flush=True)
+        if args.dry_run:
+            continue
+
+        config = with_auto_batch_size(parser, swept_config)
+        data_key = json.dumps([config.data.model_dump(), config.model.img_size, config.trainer.resolution_schedule])
+        if data_key not in data_modules:
+            data_modules[data_key] = build_data_module(config, resolve_loader_config(config.data))
+        train(config, data_module=data_modules[data_key])
@@ -1,9 +1,128 @@
+import math
 from dataclasses import dataclass, field
 
 import pytorch_lightning as pl
 import torch
+import torch.nn.functional as F
 from torch import Tensor, nn
 
+from nix_cuda_test.checkpointing import CheckpointPolicy
+from nix_cuda_test.layer_checkpointing import estimate_layer_activation_bytes, run_layers
+from nix_cuda_test.models import TokenDropMode
+
+
+def patchify(input_data: Tensor, patch_size: int) -> Tensor:
+    """
+    Cuts images into non-overlapping patches in a single copy, leaving room for the class token.
+
+    Takes images shaped [B, C, H, W] and returns [B, 1 + num_patches, C * patch_size^2]; row 0 is all zeros and rows
+    1... hold the flattened patches in row-major order. Features are ordered (C, kh, kw) as with ``nn.Unfold``, so
+    projection weights are interchangeable between the two.
+    """
+    B, C, H, W = input_data.shape
+    H_p, W_p = H // patch_size, W // patch_size
+
+    patches = input_data.new_empty(size=(B, 1 + H_p * W_p, C * patch_size * patch_size))
+    patches[:, 0].zero_()
+    # [B, C, H_p, p, W_p, p] -> [B, H_p, W_p, C, p, p], written straight into the preallocated rows.
+    patches[:, 1:].view(B, H_p, W_p, C, patch_size, patch_size).copy_(
+        input_data[:, :, : H_p * patch_size, : W_p * patch_size]
+        .reshape(B, C, H_p, patch_size, W_p, patch_size)
+        .permute(0, 2, 4, 1, 3, 5)
+    )
+    return patches
+
+
+def embed_patches(
+    input_data: Tensor,
+    patch_size: int,
+    linear_proj: nn.Module,
+    class_token: Tensor,
+    pos_embedding: Tensor,
+) -> Tensor:
+    """
+    Fused equivalent of unfold -> transpose -> project -> prepend class token -> add positional embedding.
+
+    The zero row ``patchify`` reserves for the class token projects to just the bias, so the projection already
+    produces the full [B, 1 + num_patches, latent_size] output. Swapping that bias for the class token and adding
+    the positional embedding is a single in-place add of a [1, 1 + num_patches, latent_size] tensor, which doesn't
+    depend on the batch size. Compared to the unfold path this saves a strided copy of the patches and the
+    ``torch.cat`` copy of the embeddings.
+    """
+    patches = patchify(input_data, patch_size)  # -> [B, 1+num_patches, C*patch_size^2]
+    embeddings: Tensor = linear_proj(patches)  # -> [B, 1+num_patches, latent_size]
+
+    num_tokens = embeddings.size(1)
+    bias: Tensor | None = getattr(linear_proj, "bias", None)
+    class_offset = class_token if bias is None else class_token - bias.view(1, 1, -1)
+    token_offset = pos_embedding[:, :num_tokens, :] + torch.cat(  # -> [1, 1+num_patches, latent_size]
+        [class_offset, class_offset.new_zeros(size=(1, num_tokens - 1, class_offset.size(-1)))],
+        dim=1,
+    )
+    embeddings += token_offset
+    return embeddings
+
+
+def resize_pos_embedding(pos_embedding: Tensor, grid: tuple[int, int]) -> Tensor:
+    """
+    Resamples a positional embedding shaped [1, 1 + G * G, latent_size], learned for a square G x G grid of patches, to
+    a ``grid`` of (rows, columns) patches with bilinear interpolation; the class token's entry is kept as is.
+
+    Gradients flow back into the original embedding, so training at a lower resolution still trains the embedding of
+    the full-resolution grid.
+    """
+    side = math.isqrt(pos_embedding.size(1) - 1)
+    if grid == (side, side):
+        return pos_embedding
+    patches = pos_embedding[:, 1:].reshape(1, side, side, -1).permute(0, 3, 1, 2)  # -> [1, latent_size, G, G]
+    patches = F.interpolate(patches, size=grid, mode="bilinear", align_corners=False)
+    return torch.cat([pos_embedding[:, :1], patches.flatten(2).transpose(1, 2)], dim=1)
+
+
+def num_kept_tokens(num_patches: int, keep_ratio: float) -> int:
+    """
+    Returns how many of ``num_patches`` patch tokens ``drop_tokens`` keeps at ``keep_ratio``.
+    """
+    return min(num_patches, max(1, round(num_patches * keep_ratio)))
+
+
+def sequence_length(height: int, width: int, patch_size: int, keep_ratio: float = 1.0) -> int:
+    """
+    Returns the number of tokens the encoder sees for an image of ``height`` x ``width``: the class token and the patch
+    tokens kept at ``keep_ratio``.
+    """
+    return 1 + num_kept_tokens((height // patch_size) * (width // patch_size), keep_ratio)
+
+
+def drop_tokens(embeddings: Tensor, keep_ratio: float, mode: TokenDropMode) -> Tensor:
+    """
+    Keeps the class token and a ``keep_ratio`` share of the patch tokens of ``embeddings`` shaped
+    [B, 1 + num_patches, latent_size], which already carry their positional embedding.
+
+    With ``random``, every image keeps its own random subset of patches (one gather). With ``structured``, the whole
+    batch keeps the same patches, evenly spaced in row-major order from a random start, so they cover the whole image
+    (one index_select). Encoder cost is roughly linear in the number of tokens (quadratic in attention), so keeping half
+    of them about halves it.
+    """
+    B, num_patches, latent_size = embeddings.size(0), embeddings.size(1) - 1, embeddings.size(2)
+    num_kept = num_kept_tokens(num_patches, keep_ratio)
+    if num_kept == num_patches:
+        return embeddings
+
+    match mode:
+        case "random":
+            noise = torch.rand(B, num_patches, device=embeddings.device)
+            kept = noise.topk(num_kept, dim=1, sorted=False).indices + 1  # -> [B, num_kept], skipping the class token
+            patches = embeddings.gather(1, kept.unsqueeze(-1).expand(-1, -1, latent_size))
+        case "structured":
+            # Position i is floor((i * num_patches + offset) / num_kept): spaced num_patches / num_kept >= 1 apart, so
+            # distinct, and at most floor((num_kept * num_patches - 1) / num_kept) = num_patches - 1. Integer arithmetic
+            # keeps rounding from pushing the last one past the end.
+            offset = torch.randint(num_patches, (), device=embeddings.device)
+            positions = (torch.arange(num_kept, device=embeddings.device) * num_patches + offset) // num_kept
+            patches = embeddings.index_select(1, positions + 1)
+    return torch.cat([embeddings[:, :1], patches], dim=1)  # -> [B, 1+num_kept, latent_size]
+
 
 class SelfAttention(pl.LightningModule):
     """
@@ -17,6 +136,88 @@ class SelfAttention(pl.LightningModule):
     def forward(self, x: Tensor) -> Tensor:
         return self.module(x, x, x)[0]
 
+    def attend_class_token(self, x: Tensor) -> Tensor:
+        """
+        Attention output for the class token only, with keys and values from every token: [B, T, H] -> [B, 1, H].
+        """
+        return self.module(x[:, :1], x, x)[0]
+
+
+def _strip_multihead_attention_prefix(
+    module: nn.Module,
+    state_dict: dict[str, Tensor],
+    prefix: str,
+    *args: object,
+) -> None:
+    """
+    Renames ``SelfAttention(nn.MultiheadAttention(...))`` keys in ``state_dict`` to ``FusedSelfAttention`` keys, e.g.,
+    ``<prefix>module.in_proj_weight`` -> ``<prefix>in_proj_weight``.
+    """
+    for name in [name for name, _ in module.named_parameters()]:
+        old_key = f"{prefix}module.{name}"
+        if old_key in state_dict and f"{prefix}{name}" not in state_dict:
+            state_dict[f"{prefix}{name}"] = state_dict.pop(old_key)
+
+
+@dataclass(kw_only=True, eq=False)
+class FusedSelfAttention(pl.LightningModule):
+    """
+    Self-attention with a single QKV projection that calls ``F.scaled_dot_product_attention`` directly.
+
+    Equivalent to ``SelfAttention(nn.MultiheadAttention(..., batch_first=True))``, and with the same parameter names
+    (``in_proj_weight``, ``in_proj_bias``, ``out_proj``) and initialization, but it never computes or returns the
+    attention weights, so SDPA is free to pick the flash or memory-efficient kernel. State dicts saved from
+    ``SelfAttention`` (whose keys carry an extra ``module.``) load as-is.
+    """
+
+    # Args
+    dropout: float
+    latent_size: int
+    num_heads: int
+
+    # Non-args
+    head_dim: int = field(init=False)
+    in_proj_weight: nn.Parameter = field(init=False)
+    in_proj_bias: nn.Parameter = field(init=False)
+    out_proj: nn.Linear = field(init=False)
+
+    def __post_init__(self) -> None:
+        super().__init__()
+        if self.latent_size % self.num_heads != 0:
+            raise ValueError(f"latent_size ({self.latent_size}) must be divisible by num_heads ({self.num_heads})")
+        self.head_dim = self.latent_size // self.num_heads
+
+        self.in_proj_weight = nn.Parameter(
+            nn.init.xavier_uniform_(torch.empty(size=(3 * self.latent_size, self.latent_size)))
+        )
+        self.in_proj_bias = nn.Parameter(torch.zeros(size=(3 * self.latent_size,)))
+        self.out_proj = nn.Linear(self.latent_size, self.latent_size)
+        nn.init.zeros_(self.out_proj.bias)
+        self.register_load_state_dict_pre_hook(_strip_multihead_attention_prefix)
+
+    def forward(self, x: Tensor) -> Tensor:
+        B, T, _ = x.shape
+        qkv = F.linear(x, self.in_proj_weight, self.in_proj_bias)  # -> [B, T, 3*latent_size]
+        # [B, T, 3, H, D] -> [3, B, H, T, D]
+        q, k, v = qkv.view(B, T, 3, self.num_heads, self.head_dim).permute(2, 0, 3, 1, 4).unbind(0)
+        out = F.scaled_dot_product_attention(q, k, v, dropout_p=self.dropout if self.training else 0.0)
+        return self.out_proj(out.transpose(1, 2).reshape(B, T, self.latent_size))
+
+    def attend_class_token(self, x: Tensor) -> Tensor:
+        """
+        Attention output for the class token only, with keys and values from every token: [B, T, latent_size] ->
+        [B, 1, latent_size]. Only the class token's query is projected.
+        """
+        B, T, _ = x.shape
+        q_weight, kv_weight = self.in_proj_weight.split([self.latent_size, 2 * self.latent_size])
+        q_bias, kv_bias = self.in_proj_bias.split([self.latent_size, 2 * self.latent_size])
+        q = F.linear(x[:, :1], q_weight, q_bias).view(B, 1, self.num_heads, self.head_dim).transpose(1, 2)
+        kv = F.linear(x, kv_weight, kv_bias)  # -> [B, T, 2*latent_size]
+        # [B, T, 2, H, D] -> [2, B, H, T, D]
+        k, v = kv.view(B, T, 2, self.num_heads, self.head_dim).permute(2, 0, 3, 1, 4).unbind(0)
+        out = F.scaled_dot_product_attention(q, k, v, dropout_p=self.dropout if self.training else 0.0)
+        return self.out_proj(out.transpose(1, 2).reshape(B, 1, self.latent_size))
+
 
 class SkipConnection(pl.LightningModule):
     """
@@ -39,6 +240,8 @@ class InputEmbedding(pl.LightningModule):
     n_channels: int
     num_patches: int
     patch_size: int
+    fused: bool = True  # Use embed_patches instead of the reference Unfold path
+    token_drop: TokenDropMode = "random"  # See drop_tokens
 
     # Non-args
     class_token: nn.Parameter = field(init=False)
@@ -46,6 +249,8 @@ class InputEmbedding(pl.LightningModule):
     linear_proj: nn.Linear = field(init=False)
     pos_embedding: nn.Parameter = field(init=False)
     unfold: nn.Unfold = field(init=False)
+    # Share of the patch tokens kept in training; set every epoch from the model's schedule.
+    token_keep_ratio: float = field(init=False, default=1.0)
 
     def __post_init__(self) -> None:
         super().__init__()
@@ -69,7 +274,25 @@ class InputEmbedding(pl.LightningModule):
         )
 
     def forward(self, input_data: Tensor) -> Tensor:
-        # input_data: [B, C, H, W]
+        embeddings = self.embed(input_data)  # -> [B, 1+num_patches, latent_size]
+        # Evaluation always sees every token.
+        if self.training and self.token_keep_ratio < 1.0:
+            embeddings = drop_tokens(embeddings, self.token_keep_ratio, self.token_drop)
+        return embeddings
+
+    def embed(self, input_data: Tensor) -> Tensor:
+        # input_data: [B, C, H, W], at any resolution; the positional embedding is resampled to its grid of patches.
+        H, W = input_data.shape[-2:]
+        pos_embedding = resize_pos_embedding(self.pos_embedding, (H // self.patch_size, W // self.patch_size))
+        if self.fused:
+            return embed_patches(
+                input_data,
+                patch_size=self.patch_size,
+                linear_proj=self.linear_proj,
+                class_token=self.class_token,
+                pos_embedding=pos_embedding,
+            )  # -> [B, 1+num_patches, latent_size]
+
         B = input_data.size(0)
 
         # 1) Patchify
@@ -84,7 +307,7 @@ class InputEmbedding(pl.LightningModule):
         embeddings = torch.cat([class_token, embeddings], dim=1)  # -> [B, 1+num_patches, latent_size]
 
         # 4) Add positional embedding
-        embeddings += self.pos_embedding[:, : embeddings.size(1), :]  # -> [B, 1+num_patches, latent_size]
+        embeddings += pos_embedding[:, : embeddings.size(1), :]  # -> [B, 1+num_patches, latent_size]
 
         return embeddings
 
@@ -95,25 +318,35 @@ class EncoderBlock(pl.LightningModule):
     dropout: float
     latent_size: int
     num_heads: int
+    fused_attention: bool = True  # Use FusedSelfAttention instead of nn.MultiheadAttention
 
     # Non-args
     module: nn.Module = field(init=False)
 
     def __post_init__(self) -> None:
         super().__init__()
+        attention = (
+            FusedSelfAttention(
+                dropout=self.dropout,
+                latent_size=self.latent_size,
+                num_heads=self.num_heads,
+            )
+            if self.fused_attention
+            else SelfAttention(
+                nn.MultiheadAttention(
+                    embed_dim=self.latent_size,
+                    num_heads=self.num_heads,
+                    dropout=self.dropout,
+                    batch_first=True,
+                )
+            )
+        )
         self.module = nn.Sequential(
             # Attention with skip connection
             SkipConnection(
                 nn.Sequential(
                     nn.LayerNorm(self.latent_size),
-                    SelfAttention(
-                        nn.MultiheadAttention(
-                            embed_dim=self.latent_size,
-                            num_heads=self.num_heads,
-                            dropout=self.dropout,
-                            batch_first=True,
-                        )
-                    ),
+                    attention,
                 )
             ),
             # MLP with skip connection
@@ -129,8 +362,23 @@ class EncoderBlock(pl.LightningModule):
             ),
         )
 
-    def forward(self, emb_patches: Tensor) -> Tensor:
-        return self.module(emb_patches)
+    def forward(self, emb_patches: Tensor, class_token_only: bool = False) -> Tensor:
+        """
+        Runs the block over ``emb_patches`` shaped [B, 1+num_patches, latent_size].
+
+        With ``class_token_only``, only the class token's output is computed, shaped [B, 1, latent_size]: keys and
+        values still come from every token, but the query, the residual path, and the MLP only cover the class token.
+        That is all the classifier reads from the last block. It goes through ``forward`` rather than a separate
+        method so FSDP's hooks gather the parameters.
+        """
+        if not class_token_only:
+            return self.module(emb_patches)
+
+        attention_block: SkipConnection = self.module[0]  # type: ignore[assignment]
+        mlp_block: SkipConnection = self.module[1]  # type: ignore[assignment]
+        norm, attention = attention_block.module  # pyright: ignore[reportGeneralTypeIssues]
+        class_token = emb_patches[:, :1] + attention.attend_class_token(norm(emb_patches))
+        return mlp_block(class_token)  # -> [B, 1, latent_size]
 
 
 @dataclass(kw_only=True, eq=False)
@@ -140,17 +388,23 @@ class EncoderStack(pl.LightningModule):
     latent_size: int
     num_heads: int
     num_encoders: int
+    fused_attention: bool = True  # Use FusedSelfAttention instead of nn.MultiheadAttention
+    checkpoint_policy: str = "none"  # See CheckpointPolicy
+    class_token_only_last_layer: bool = False  # See EncoderBlock.forward
 
     # Non-args
     module: nn.Module = field(init=False)
+    policy: CheckpointPolicy = field(init=False)
 
     def __post_init__(self) -> None:
         super().__init__()
+        self.policy = CheckpointPolicy.parse(self.checkpoint_policy)
         self.module = nn.Sequential(*[
             EncoderBlock(
                 dropout=self.dropout,
                 latent_size=self.latent_size,
                 num_heads=self.num_heads,
+                fused_attention=self.fused_attention,
             )
             for _ in range(self.num_encoders)
         ])
@@ -158,4 +412,18 @@ class EncoderStack(pl.LightningModule):
     def forward(self, emb_patches: Tensor) -> Tensor:
         # emb_patches: [B, 1+num_patches, latent_size]
         # Run through the encoders and then take the class token
-        return self.module(emb_patches)[:, 0]  # -> shape: [B, latent_size]
+        checkpointed = self.policy.layers(
+            num_layers=self.num_encoders,
+            layer_bytes=estimate_layer_activation_bytes(
+                emb_patches, self.num_heads, attention_matrix=not self.fused_attention
+            ),
+            input_bytes=emb_patches.numel() * emb_patches.element_size(),
+        )
+        layers = list(self.module)
+        if not self.class_token_only_last_layer:
+            return run_layers(layers, emb_patches, checkpointed)[:, 0]  # -> shape: [B, latent_size]
+
+        # Only the class token reaches the classifier, so the last layer computes nothing else; it keeps little for
+        # the backward pass and is never checkpointed.
+        x = run_layers(layers[:-1], emb_patches, checkpointed)
+        return layers[-1](x, class_token_only=True)[:, 0]  # -> shape: [B, latent_size]
@@ -1,10 +1,13 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 
 import pytorch_lightning as pl
 from torch import Tensor, nn
-from torch.optim.adam import Adam
 from torch.optim.optimizer import Optimizer
 
+from nix_cuda_test.distributed import fully_shard_layers
+from nix_cuda_test.models import TokenDropMode
+from nix_cuda_test.optim import OptimizerName, build_optimizer, default_optimizer_name, parameter_groups
+from nix_cuda_test.utils import EncoderBlock, sequence_length
 from nix_cuda_test.vit import ViT
 
 
@@ -34,14 +37,24 @@ class WrappedViT(pl.LightningModule):
     num_heads: int
     num_patches: int
     patch_size: int
+    fused_attention: bool = True
+    checkpoint_policy: str = "none"
+    # Compute only the class token in the last encoder layer, which is all the classifier reads.
+    class_token_only_last_layer: bool = False
+    # Share of patch tokens kept in training, per epoch; the last one applies to every later epoch.
+    token_keep_ratios: tuple[float, ...] = (1.0,)
+    token_drop: TokenDropMode = "random"
 
     # Optimizer args
     lr: float
     weight_decay: float
+    optimizer_name: OptimizerName = field(default_factory=default_optimizer_name)
 
     # Non-args
     criterion: nn.CrossEntropyLoss = field(init=False)
     module: ViT = field(init=False)
+    # Share of patch tokens kept in the current epoch's training steps.
+    token_keep_ratio: float = field(init=False, default=1.0)
 
     def __post_init__(self) -> None:
         super().__init__()
@@ -55,7 +68,30 @@ class WrappedViT(pl.LightningModule):
             num_heads=self.num_heads,
             num_patches=self.num_patches,
             patch_size=self.patch_size,
+            fused_attention=self.fused_attention,
+            checkpoint_policy=self.checkpoint_policy,
+            class_token_only_last_layer=self.class_token_only_last_layer,
+            token_drop=self.token_drop,
         )
+        # Record the constructor arguments so load_from_checkpoint can rebuild the model.
+        self.save_hyperparameters({f.name: getattr(self, f.name) for f in fields(self) if f.init})
+
+    def configure_model(self) -> None:
+        # Only the fsdp2 strategy provides a device mesh; shard over its data parallel dimension, layer by layer.
+        if self.device_mesh is not None:
+            fully_shard_layers(self.module, EncoderBlock, self.device_mesh["data_parallel"])
+
+    def on_train_epoch_start(self) -> None:
+        self.token_keep_ratio = self.token_keep_ratios[min(self.current_epoch, len(self.token_keep_ratios) - 1)]
+        self.module.set_token_keep_ratio(self.token_keep_ratio)
+        self.log("token_keep_ratio", self.token_keep_ratio)
+
+    def train_sequence_length(self, images: Tensor) -> int:
+        """
+        Returns the number of tokens per image the encoder sees in a training step on ``images``, at their resolution
+        and the current token keep ratio.
+        """
+        return sequence_length(images.size(-2), images.size(-1), self.patch_size, self.token_keep_ratio)
 
     def forward(self, test_input: Tensor) -> Tensor:  # type: ignore[override]
         return self.module(test_input)
@@ -72,8 +108,13 @@ class WrappedViT(pl.LightningModule):
         logits: Tensor = self(images)
         loss: Tensor = self.criterion(logits, labels)
         self.log("val_loss", loss, prog_bar=True)  # type: ignore
+        self.log("val_acc", (logits.argmax(dim=-1) == labels).float().mean(), prog_bar=True)  # type: ignore
         return loss
 
+    def predict_step(self, batch: Tensor | tuple[Tensor, ...], batch_idx: int) -> Tensor:  # type: ignore[override]
+        images = batch[0] if isinstance(batch, tuple | list) else batch
+        logits: Tensor = self(images)
+        return logits
+
     def configure_optimizers(self) -> Optimizer:
-        optimizer: Optimizer = Adam(self.module.parameters(), lr=self.lr, weight_decay=self.weight_decay)
-        return optimizer
+        return build_optimizer(self.optimizer_name, parameter_groups(self.module, self.weight_decay), lr=self.lr)
@@ -0,0 +1,84 @@
+import os
+from pathlib import Path
+
+import pytest
+import torch
+
+from nix_cuda_test.async_checkpoint import AsyncCheckpointIO, encoder_layer_names, read_checkpoint_dir, shard_name
+from nix_cuda_test.utils import EncoderBlock
+from nix_cuda_test.wrapped_vit import WrappedViT
+
+NUM_ENCODERS = 3
+
+
+def _small_vit() -> WrappedViT:
+    return WrappedViT(
+        dropout=0.0,
+        latent_size=16,
+        lr=1e-3,
+        n_channels=3,
+        num_classes=4,
+        num_encoders=NUM_ENCODERS,
+        num_heads=2,
+        num_patches=4,
+        patch_size=4,
+        weight_decay=0.0,
+    )
+
+
+def test_one_shard_per_encoder_layer() -> None:
+    model = _small_vit()
+    layer_names = encoder_layer_names(model, EncoderBlock)
+    shards = {key: shard_name(key, layer_names) for key in model.state_dict()}
+
+    assert set(shards.values()) == {"model", *(f"model-module.module.1.module.{i}" for i in range(NUM_ENCODERS))}
+    assert shards["module.module.0.class_token"] == "model"
+    assert shards["module.module.2.weight"] == "model"
+    assert all(shard == "model" or key.startswith(shard.removeprefix("model-") + ".") for key, shard in shards.items())
+
+
+def _save(checkpoint_io: AsyncCheckpointIO, model: WrappedViT, path: Path, epoch: int) -> None:
+    checkpoint_io.save_checkpoint({"state_dict": model.state_dict(), "epoch": epoch}, path)
+    checkpoint_io.wait()
+
+
+def test_checkpoint_round_trip(tmp_path: Path) -> None:
+    model = _small_vit()
+    checkpoint_io = AsyncCheckpointIO()
+    checkpoint_io.shard_by_layer(model, EncoderBlock)
+    path = tmp_path / "last.ckpt"
+
+    _save(checkpoint_io, model, path, epoch=0)
+    _save(checkpoint_io, model, path, epoch=1)
+    checkpoint_io.teardown()
+
+    assert len(list(path.glob("*.safetensors"))) == NUM_ENCODERS + 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["last.ckpt"]
+    checkpoint = read_checkpoint_dir(path)
+    assert checkpoint["epoch"] == 1
+    for key, tensor in model.state_dict().items():
+        torch.testing.assert_close(checkpoint["state_dict"][key], tensor)
+
+
+def test_preempted_write_keeps_previous_checkpoint(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    model = _small_vit()
+    checkpoint_io = AsyncCheckpointIO()
+    path = tmp_path / "last.ckpt"
+    _save(checkpoint_io, model, path, epoch=0)
+
+    # Stop the second write between moving the previous checkpoint aside and moving the new one in.
+    real_replace = os.replace
+
+    def replace(src: Path, dst: Path) -> None:
+        if Path(src).name.endswith(".tmp"):
+            raise KeyboardInterrupt
+        real_replace(src, dst)
+
+    monkeypatch.setattr("nix_cuda_test.async_checkpoint.os.replace", replace)
+    with pytest.raises(KeyboardInterrupt):
+        _save(checkpoint_io, model, path, epoch=1)
+    monkeypatch.undo()
+
+    assert not path.exists()
+    assert checkpoint_io.load_checkpoint(path)["epoch"] == 0
+    checkpoint_io.teardown()
@@ -0,0 +1,73 @@
+import pytest
+import torch
+
+from nix_cuda_test.batch_size_finder import StepMemoryProbe, find_batch_size, find_max_batch_size
+from nix_cuda_test.config import RunConfig
+from nix_cuda_test.wrapped_vit import WrappedViT
+
+
+@pytest.mark.parametrize(("max_fitting", "limit"), [(1, 64), (37, 64), (64, 64), (100, 64), (1000, 1000)])
+def test_find_max_batch_size(max_fitting: int, limit: int) -> None:
+    probed: list[int] = []
+
+    def fits(batch_size: int) -> bool:
+        probed.append(batch_size)
+        return batch_size <= max_fitting
+
+    assert find_max_batch_size(fits, limit=limit) == min(max_fitting, limit)
+    assert max(probed) <= limit
+
+
+def test_find_max_batch_size_when_nothing_fits() -> None:
+    assert find_max_batch_size(lambda _: False, start=4) == 0
+
+
+@pytest.mark.parametrize("autocast_dtype", [None, torch.bfloat16])
+def test_step_memory_probe_on_cpu(autocast_dtype: torch.dtype | None) -> None:
+    torch.manual_seed(0)
+    model = WrappedViT(
+        dropout=0.0,
+        latent_size=16,
+        lr=1e-3,
+        n_channels=3,
+        num_classes=4,
+        num_encoders=2,
+        num_heads=2,
+        num_patches=4,
+        patch_size=4,
+        weight_decay=0.0,
+    )
+    probe = StepMemoryProbe(
+        model=model, budget_bytes=2**40, img_size=8, n_channels=3, num_classes=4, autocast_dtype=autocast_dtype
+    )
+    before = [parameter.detach().clone() for parameter in model.parameters()]
+
+    assert probe(2)
+    assert probe.peaks[2] is not None and probe.peaks[2] > 0
+    # The optimizer stepped and the gradients were cleared for the next probe.
+    assert any(not torch.equal(b, a) for b, a in zip(before, model.parameters(), strict=True))
+    assert all(parameter.grad is None for parameter in model.parameters())
+
+    probe.budget_bytes = 1
+    assert not probe(2)
+
+
+def test_find_batch_size_honors_cpu_accelerator(capsys: pytest.CaptureFixture[str]) -> None:
+    max_batch_size = 4
+    config = RunConfig.model_validate({
+        "model": {
+            "img_size": 8,
+            "patch_size": 4,
+            "latent_size": 16,
+            "num_heads": 2,
+            "num_encoders": 2,
+            "num_classes": 4,
+            "class_token_only_last_layer": True,
+        },
+        "trainer": {"memory_budget": 2**40, "max_batch_size": max_batch_size},
+        "dist": {"accelerator": "cpu"},
+    })
+
+    assert find_batch_size(config) == max_batch_size
+    # Even where CUDA is available.
+    assert "on cpu" in capsys.readouterr().out
@@ -0,0 +1,21 @@
+from nix_cuda_test.compile_cache import compile_cache_key
+
+HPARAMS = {
+    "latent_size": 64,
+    "num_encoders": 2,
+    "lr": 1e-3,
+    "weight_decay": 0.1,
+    "optimizer_name": "adamw-foreach",
+}
+
+
+def test_compile_cache_key_ignores_optimizer_hparams() -> None:
+    swept = {**HPARAMS, "lr": 3e-4, "weight_decay": 0.0, "optimizer_name": "adamw-fused"}
+    assert compile_cache_key("vit", swept, "bf16-mixed") == compile_cache_key("vit", HPARAMS, "bf16-mixed")
+
+
+def test_compile_cache_key_tracks_graph_hparams() -> None:
+    key = compile_cache_key("vit", HPARAMS, "bf16-mixed")
+    assert compile_cache_key("vit", {**HPARAMS, "latent_size": 128}, "bf16-mixed") != key
+    assert compile_cache_key("te-vit", HPARAMS, "bf16-mixed") != key
+    assert compile_cache_key("vit", HPARAMS, "32-true") != key
@@ -0,0 +1,234 @@
+import argparse
+import json
+import os
+import socket
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pytest
+import pytorch_lightning as pl
+import torch
+import torch.distributed as dist
+import torch.distributed.checkpoint as dcp
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+from torch.distributed.checkpoint.state_dict import get_state_dict, set_state_dict
+from torch.distributed.device_mesh import init_device_mesh
+from torch.distributed.tensor import DTensor
+from torch.optim.optimizer import Optimizer
+from torch.utils.data import DataLoader, TensorDataset
+
+from nix_cuda_test import scaling
+from nix_cuda_test.cifar_data_module import ResumableSampler
+from nix_cuda_test.distributed import build_strategy, fully_shard_layers
+from nix_cuda_test.sharded_data_module import ShardedDataset, pack_shards
+from nix_cuda_test.utils import EncoderBlock
+from nix_cuda_test.wrapped_vit import WrappedViT
+
+WORLD_SIZE = 2
+NUM_SAMPLES = 17  # Doesn't divide evenly between the ranks
+NUM_SHARDS = 5  # Plus a partial one, which is skipped with several ranks
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _join_process_group(rank: int, port: int) -> None:
+    # Lightning joins these processes instead of launching its own when LOCAL_RANK is set.
+    os.environ.update(
+        MASTER_ADDR="127.0.0.1",
+        MASTER_PORT=str(port),
+        WORLD_SIZE=str(WORLD_SIZE),
+        NODE_RANK="0",
+        LOCAL_RANK=str(rank),
+        RANK=str(rank),
+    )
+    torch.set_num_threads(1)
+
+
+def _small_vit() -> WrappedViT:
+    return WrappedViT(
+        dropout=0.0,
+        latent_size=16,
+        lr=1e-3,
+        n_channels=3,
+        num_classes=4,
+        num_encoders=2,
+        num_heads=2,
+        num_patches=4,
+        patch_size=4,
+        weight_decay=0.0,
+    )
+
+
+def _train_ddp(rank: int, port: int, tmp_path: Path) -> None:
+    _join_process_group(rank, port)
+    torch.manual_seed(rank)  # DDP must broadcast rank 0's parameters for the replicas to agree
+    model = _small_vit()
+    strategy = build_strategy(
+        "ddp",
+        world_size=WORLD_SIZE,
+        process_group_backend="gloo",
+        bucket_cap_mb=25,
+        gradient_as_bucket_view=True,
+        static_graph=False,
+        comm_hook="none",
+        powersgd_rank=1,
+        powersgd_start_iter=10,
+        layer_class=EncoderBlock,
+    )
+    trainer = pl.Trainer(
+        accelerator="cpu",
+        devices=WORLD_SIZE,
+        strategy=strategy,
+        max_epochs=1,
+        use_distributed_sampler=False,
+        logger=False,
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+    )
+    generator = torch.Generator().manual_seed(0)
+    dataset = TensorDataset(
+        torch.rand(NUM_SAMPLES, 3, 8, 8, generator=generator), torch.randint(0, 4, (NUM_SAMPLES,), generator=generator)
+    )
+    sampler = ResumableSampler(
+        num_samples=NUM_SAMPLES, shuffle=True, seed=0, rank=rank, num_replicas=WORLD_SIZE, drop_last=True
+    )
+    trainer.fit(model, DataLoader(dataset, batch_size=4, sampler=sampler))
+    assert trainer.global_rank == rank
+
+    sharded = ShardedDataset(shard_dir=tmp_path / "shards", shuffle=True, rank=rank, world_size=WORLD_SIZE)
+    result = {
+        "samples": list(sampler),
+        "shard_samples": [label for _, label in sharded],
+        "shard_len": len(sharded),
+        "num_batches": trainer.num_training_batches,
+    }
+    (tmp_path / f"rank{rank}.json").write_text(json.dumps(result), encoding="utf-8")
+    torch.save(model.state_dict(), tmp_path / f"rank{rank}.pt")
+
+
+def test_ddp_trains_on_disjoint_slices(tmp_path: Path) -> None:
+    shard_size = 4
+    num_shard_samples = NUM_SHARDS * shard_size + 2
+    # Each sample's label is its index, so the labels a rank reads tell which samples it got.
+    pack_shards(
+        np.zeros((num_shard_samples, 3, 2, 2), dtype=np.uint8),
+        np.arange(num_shard_samples, dtype=np.int64),
+        tmp_path / "shards",
+        shard_size,
+    )
+
+    mp.spawn(_train_ddp, args=(_free_port(), tmp_path), nprocs=WORLD_SIZE)
+
+    results = [json.loads((tmp_path / f"rank{rank}.json").read_text(encoding="utf-8")) for rank in range(WORLD_SIZE)]
+    for key in ("samples", "shard_samples"):
+        slices = [result[key] for result in results]
+        assert len({len(s) for s in slices}) == 1, key
+        assert len(set().union(*slices)) == sum(len(s) for s in slices), key
+    assert all(len(result["samples"]) == NUM_SAMPLES // WORLD_SIZE for result in results)
+    assert all(len(result["shard_samples"]) == result["shard_len"] for result in results)
+    assert sum(result["shard_len"] for result in results) == NUM_SHARDS // WORLD_SIZE * WORLD_SIZE * shard_size
+    assert all(result["num_batches"] > 0 for result in results)
+
+    # Gradients were all-reduced, so both replicas took the same steps.
+    state_dicts = [torch.load(tmp_path / f"rank{rank}.pt") for rank in range(WORLD_SIZE)]
+    for name, tensor in state_dicts[0].items():
+        torch.testing.assert_close(state_dicts[1][name], tensor, msg=name)
+
+
+def _sharded_vit(mesh: Any) -> tuple[WrappedViT, Optimizer]:
+    model = _small_vit()
+    fully_shard_layers(model.module, EncoderBlock, mesh)
+    return model, model.configure_optimizers()
+
+
+def _load_sharded_vit(mesh: Any, checkpoint_dir: Path) -> tuple[WrappedViT, Optimizer]:
+    model, optimizer = _sharded_vit(mesh)
+    model_state, optimizer_state = get_state_dict(model, optimizer)
+    state = {"model": model_state, "optimizer": optimizer_state}
+    dcp.load(state, checkpoint_id=checkpoint_dir)
+    set_state_dict(model, optimizer, model_state_dict=state["model"], optim_state_dict=state["optimizer"])
+    return model, optimizer
+
+
+def _local(tensor: torch.Tensor) -> torch.Tensor:
+    return tensor.to_local() if isinstance(tensor, DTensor) else tensor
+
+
+def _train_fsdp2(rank: int, port: int, tmp_path: Path) -> None:
+    _join_process_group(rank, port)
+    dist.init_process_group("gloo")
+    try:
+        mesh = init_device_mesh("cpu", (WORLD_SIZE,))
+        torch.manual_seed(0)
+        model, optimizer = _sharded_vit(mesh)
+
+        layers = [module for module in model.modules() if isinstance(module, EncoderBlock)]
+        assert layers
+        for layer in layers:
+            for name, parameter in layer.named_parameters():
+                assert isinstance(parameter, DTensor), name
+                assert parameter.to_local().numel() * WORLD_SIZE == parameter.numel(), name
+
+        before = {name: parameter.full_tensor() for name, parameter in model.named_parameters()}
+        generator = torch.Generator().manual_seed(rank)
+        images = torch.rand(4, 3, 8, 8, generator=generator)
+        labels = torch.randint(0, 4, (4,), generator=generator)
+        F.cross_entropy(model(images), labels).backward()
+        optimizer.step()
+        assert all(
+            not torch.equal(parameter.full_tensor(), before[name]) for name, parameter in model.named_parameters()
+        )
+
+        model_state, optimizer_state = get_state_dict(model, optimizer)
+        dcp.save({"model": model_state, "optimizer": optimizer_state}, checkpoint_id=tmp_path / "checkpoint")
+
+        torch.manual_seed(1)  # Different initial weights, so matching ones can only come from the checkpoint
+        restored, restored_optimizer = _load_sharded_vit(mesh, tmp_path / "checkpoint")
+        for (name, expected), actual in zip(model.named_parameters(), restored.parameters(), strict=True):
+            torch.testing.assert_close(_local(actual), _local(expected), msg=name)
+            for key, value in optimizer.state[expected].items():
+                torch.testing.assert_close(
+                    _local(restored_optimizer.state[actual][key]), _local(value), msg=f"{name} {key}"
+                )
+    finally:
+        dist.destroy_process_group()
+
+
+def test_fsdp2_shards_trains_and_checkpoints(tmp_path: Path) -> None:
+    mp.spawn(_train_fsdp2, args=(_free_port(), tmp_path), nprocs=WORLD_SIZE)
+
+    # One shard file per rank, written in parallel.
+    assert len(list((tmp_path / "checkpoint").glob("*.distcp"))) == WORLD_SIZE
+
+
+@pytest.mark.parametrize("drop_last", [False, True])
+def test_resumable_sampler_lengths(drop_last: bool) -> None:
+    samplers = [
+        ResumableSampler(num_samples=NUM_SAMPLES, shuffle=True, rank=rank, num_replicas=WORLD_SIZE, drop_last=drop_last)
+        for rank in range(WORLD_SIZE)
+    ]
+    for sampler in samplers:
+        assert len(list(sampler)) == len(sampler)
+    # Padding repeats a sample on another rank; dropping the remainder instead leaves the slices disjoint.
+    samples = [set(sampler) for sampler in samplers]
+    assert (samples[0] & samples[1] == set()) == drop_last
+
+
+def test_scaling_report_fails_if_a_world_size_fails(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    summary = {"images_per_s": {"p50": 100.0}, "step_s": {"p50": 0.1}, "data_wait_s": {"p50": 0.0}}
+    monkeypatch.setattr(scaling, "_run", lambda world_size, *_: None if world_size == WORLD_SIZE else summary)
+    parser = argparse.ArgumentParser()
+    scaling.add_scaling_report_arguments(parser)
+    output = tmp_path / "report.json"
+
+    with pytest.raises(SystemExit, match="failed world sizes: 2"):
+        scaling.scaling_report(parser.parse_args(["--world-sizes", "1", "2", "4", "--output", str(output)]))
+    # The world sizes which ran are still reported.
+    assert [row["world_size"] for row in json.loads(output.read_text(encoding="utf-8"))] == [1, 4]
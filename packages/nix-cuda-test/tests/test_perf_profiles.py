@@ -0,0 +1,22 @@
+import pytest
+
+from nix_cuda_test.perf_profiles import PerfProfile, load_perf_profiles
+
+
+@pytest.mark.parametrize("name", list(load_perf_profiles()))
+def test_shipped_profiles_are_valid(name: str) -> None:
+    PerfProfile.from_table(name, load_perf_profiles()[name])
+
+
+@pytest.mark.parametrize(
+    ("path", "value"),
+    [
+        ("set_float32_matmul_precision", "fast"),
+        ("backends.cuda.enable_flash_sdp", "yes"),
+        ("backends.cudnn.allow_tf32", 1),
+        ("backends.does_not_exist", True),
+    ],
+)
+def test_invalid_settings_fail_when_parsed(path: str, value: object) -> None:
+    with pytest.raises(ValueError, match=path):
+        PerfProfile.from_table("invalid", {"settings": {path: value}})
@@ -0,0 +1,31 @@
+import pytest
+
+from nix_cuda_test.startup import heavy_imports, parse_import_times, time_command
+
+SAMPLE = """\
+import time: self [us] | cumulative | imported package
+import time:       212 |        212 |   _io
+import time:      1034 |       1500 |     torch.nn
+import time:     15023 |     350061 | torch
+not an import time line
+"""
+
+
+def test_parse_import_times() -> None:
+    assert parse_import_times(SAMPLE) == [
+        {"module": "_io", "self_ms": 0.212, "cumulative_ms": 0.212, "depth": 1},
+        {"module": "torch.nn", "self_ms": 1.034, "cumulative_ms": 1.5, "depth": 2},
+        {"module": "torch", "self_ms": 15.023, "cumulative_ms": 350.061, "depth": 0},
+    ]
+
+
+def test_heavy_imports() -> None:
+    assert heavy_imports(parse_import_times(SAMPLE)) == ["torch"]
+
+
+@pytest.mark.parametrize("command", ["train", "run"])
+def test_help_does_not_import_heavy_modules(command: str) -> None:
+    _, imports = time_command(command)
+
+    assert imports
+    assert heavy_imports(imports) == []
@@ -0,0 +1,103 @@
+import pytest
+import torch
+from torch import nn
+
+from nix_cuda_test.models import TOKEN_DROP_MODES, TokenDropMode
+from nix_cuda_test.utils import EncoderBlock, InputEmbedding, drop_tokens, embed_patches, sequence_length
+
+
+def _input_embedding(*, fused: bool) -> InputEmbedding:
+    return InputEmbedding(latent_size=32, n_channels=3, num_patches=16, patch_size=4, fused=fused)
+
+
+def test_fused_patch_embedding_matches_unfold() -> None:
+    torch.manual_seed(0)
+    fused = _input_embedding(fused=True)
+    # A non-zero class token, so its row checks the `class_token - bias` swap rather than just the bias.
+    nn.init.normal_(fused.class_token)
+    reference = _input_embedding(fused=False)
+    reference.load_state_dict(fused.state_dict())
+    images = torch.randn(2, 3, 16, 16)
+
+    expected = reference(images)
+    actual = fused(images)
+
+    assert actual.shape == (2, 17, 32)
+    torch.testing.assert_close(actual[:, 0], expected[:, 0])
+    torch.testing.assert_close(actual, expected)
+
+
+def test_fused_patch_embedding_gradients_match_unfold() -> None:
+    torch.manual_seed(0)
+    fused = _input_embedding(fused=True)
+    nn.init.normal_(fused.class_token)
+    reference = _input_embedding(fused=False)
+    reference.load_state_dict(fused.state_dict())
+    images = torch.randn(2, 3, 16, 16)
+
+    fused(images).square().sum().backward()
+    reference(images).square().sum().backward()
+
+    for (name, actual), expected in zip(fused.named_parameters(), reference.parameters(), strict=True):
+        assert actual.grad is not None and expected.grad is not None, name
+        torch.testing.assert_close(actual.grad, expected.grad, msg=name)
+
+
+def test_embed_patches_without_bias() -> None:
+    torch.manual_seed(0)
+    linear_proj = nn.Linear(in_features=48, out_features=32, bias=False)
+    class_token = torch.randn(1, 1, 32)
+    pos_embedding = torch.randn(1, 17, 32)
+    images = torch.randn(2, 3, 16, 16)
+
+    patches = nn.Unfold(kernel_size=4, stride=4)(images).transpose(1, 2)
+    expected = torch.cat([class_token.expand(2, -1, -1), linear_proj(patches)], dim=1) + pos_embedding
+    actual = embed_patches(
+        images, patch_size=4, linear_proj=linear_proj, class_token=class_token, pos_embedding=pos_embedding
+    )
+
+    torch.testing.assert_close(actual, expected)
+
+
+@pytest.mark.parametrize("mode", TOKEN_DROP_MODES)
+@pytest.mark.parametrize(("num_patches", "keep_ratio"), [(196, 0.25), (196, 0.99), (49, 0.5), (3, 0.7)])
+def test_drop_tokens_keeps_distinct_patches(mode: TokenDropMode, num_patches: int, keep_ratio: float) -> None:
+    torch.manual_seed(0)
+    # Each token's embedding is its index, so the output shows which tokens were kept.
+    embeddings = torch.arange(1 + num_patches, dtype=torch.float32).view(1, -1, 1).expand(2, -1, 1)
+    num_kept = max(1, round(num_patches * keep_ratio))
+
+    for _ in range(100):
+        kept = drop_tokens(embeddings, keep_ratio, mode)[..., 0]
+
+        assert kept.shape == (2, 1 + num_kept)
+        assert (kept[:, 0] == 0).all()
+        for row in kept[:, 1:]:
+            assert row.unique().numel() == num_kept
+            assert 1 <= row.min() and row.max() <= num_patches
+
+
+@pytest.mark.parametrize(
+    ("img_size", "keep_ratio", "expected"),
+    [(224, 1.0, 197), (112, 1.0, 50), (224, 0.5, 99), (112, 0.25, 13)],
+)
+def test_sequence_length_matches_drop_tokens(img_size: int, keep_ratio: float, expected: int) -> None:
+    num_patches = (img_size // 16) ** 2
+    embeddings = torch.zeros(1, 1 + num_patches, 8)
+
+    assert sequence_length(img_size, img_size, 16, keep_ratio) == expected
+    assert drop_tokens(embeddings, keep_ratio, "random").size(1) == expected
+
+
+def test_fused_self_attention_loads_multihead_attention_weights() -> None:
+    torch.manual_seed(0)
+    reference = EncoderBlock(dropout=0.0, latent_size=32, num_heads=4, fused_attention=False).eval()
+    # Non-zero biases, so a bias left at its initial zeros would show up in the outputs.
+    for name, parameter in reference.named_parameters():
+        if name.endswith("bias"):
+            nn.init.normal_(parameter)
+    fused = EncoderBlock(dropout=0.0, latent_size=32, num_heads=4, fused_attention=True).eval()
+    fused.load_state_dict(reference.state_dict())
+    x = torch.randn(2, 17, 32)
+
+    torch.testing.assert_close(fused(x), reference(x))
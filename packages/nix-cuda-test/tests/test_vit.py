@@ -0,0 +1,50 @@
+import pytest
+import torch
+from torch import nn
+
+from nix_cuda_test.vit import ViT
+
+MODEL_ARGS = {
+    "dropout": 0.0,
+    "latent_size": 32,
+    "n_channels": 3,
+    "num_classes": 10,
+    "num_encoders": 3,
+    "num_heads": 4,
+    "num_patches": 16,
+    "patch_size": 4,
+}
+
+
+def _full_and_class_token_only(model_cls: type[nn.Module], **kwargs: object) -> tuple[nn.Module, nn.Module]:
+    torch.manual_seed(0)
+    full = model_cls(**MODEL_ARGS, **kwargs)
+    class_token_only = model_cls(**MODEL_ARGS, **kwargs, class_token_only_last_layer=True)
+    class_token_only.load_state_dict(full.state_dict())
+    return full, class_token_only
+
+
+@pytest.mark.parametrize("fused_attention", [True, False])
+def test_class_token_only_last_layer_matches_full_forward(fused_attention: bool) -> None:
+    full, class_token_only = _full_and_class_token_only(ViT, fused_attention=fused_attention)
+    images = torch.randn(2, 3, 16, 16)
+
+    full(images).square().sum().backward()
+    class_token_only(images).square().sum().backward()
+
+    torch.testing.assert_close(class_token_only.eval()(images), full.eval()(images))
+    for (name, actual), expected in zip(class_token_only.named_parameters(), full.parameters(), strict=True):
+        assert actual.grad is not None and expected.grad is not None, name
+        torch.testing.assert_close(actual.grad, expected.grad, msg=name)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="Transformer Engine needs CUDA")
+def test_te_class_token_only_last_layer_matches_full_forward() -> None:
+    pytest.importorskip("transformer_engine")
+    from nix_cuda_test.te_vit import TEViT  # noqa: PLC0415
+
+    with torch.device("cuda"):
+        full, class_token_only = _full_and_class_token_only(TEViT)
+        images = torch.randn(2, 3, 16, 16)
+
+    torch.testing.assert_close(class_token_only.eval()(images), full.eval()(images))